@@ -6,10 +6,23 @@ import sys
 
 #from avr_sim import * # import from avr_sim file in sim
 
+import os
+import io
+import glob
+import time
 import string
-import copy
-from tkinter import *
-from tkinter.filedialog import askopenfilename
+import re
+import ast
+import json
+import argparse
+import pickle
+import hashlib
+import struct
+import gzip
+import contextlib
+import collections
+import itertools
+import concurrent.futures
 
 """
 To add a new instruction:
@@ -17,7 +30,8 @@ To add a new instruction:
 - Add to INST_REQUIREMENTS (in avr_parser.py)
 - Add in INST_OPERANDS (in avr_parser.py)
 - Add its execution info interpreter.step() method (in avr_interpreter.py)
-- Add it's binary info to interpreter get_binary_instruction() method
+- Add its handler & operand kinds to INST_HANDLERS and INST_DECODE
+- Add its bit pattern to INST_ENCODING
 - UDL on Notepadd++ ALREADY has all the instructions
 
 To add a new directive:
@@ -81,6 +95,30 @@ class StackOverflowError():  # Used for interpreter
 
     def as_string(self):
         return self.__repr__()
+
+class ConditionError():  # Used for interpreter
+    def __init__(self, pos, details):
+        self.pos = pos
+        self.details = details
+
+    def __repr__(self):
+        result = f'Breakpoint Condition Error: {self.details}\nInstruction {self.pos}\n'
+        return result
+
+    def as_string(self):
+        return self.__repr__()
+
+class BreakpointHit():  # Used for interpreter, stops a run without being an error
+    def __init__(self, pos, details):
+        self.pos = pos
+        self.details = details
+
+    def __repr__(self):
+        result = f'Breakpoint: {self.details}\nInstruction {self.pos}\n'
+        return result
+
+    def as_string(self):
+        return self.__repr__()
         
 ##################################################################################################################
 #  POSITION
@@ -97,17 +135,6 @@ class Position:
     def __repr__(self):
         return f'Line {self.ln}, column {self.col} in file: {self.fn}'
 
-    def advance(self, current_char):
-        self.idx += 1
-        self.col += 1
-
-        if current_char == '\n':
-            self.ln += 1
-            self.col = 0
-    
-    def copy(self):
-        return Position(self.idx, self.ln, self.col, self.fn, self.fxtx)
-
 
 ##################################################################################################################
 #  TOKEN
@@ -125,295 +152,336 @@ class Token:
 
 
 ##################################################################################################################
-#  REGISTER
+#  LEXER
 ##################################################################################################################
 
-class Register:
-    def __init__(self, name, value=0, changed=0):
-        self.name = str(name) # eg 3 for R3
-        self.value = value
-        self.changed = changed # for displaying as red when the value is updated
-
-    def __repr__(self):
-        return f'{self.name}: {self.value}'
-
-    def as_string(self):
-        return f'{self.name}: {self.value}'
-
-    def new_instruct(self):
-        self.changed = 0
+# What can come next in the text (after any spaces), tried in order. Anything else is illegal
+LEXER_REGEX = re.compile(r'''
+    [ \t]*
+    (?:
+        (?P<word>[A-Za-z._][A-Za-z0-9._()]*)
+      | (?P<comma>,)
+      | (?P<newline>\n)
+      | (?P<number>0[box][^\n ,;]*|[0-9]+)
+      | (?P<comment>;[^\n]*)
+      | (?P<string>"(?:[^"\\\n]|\\[^\n])*")
+      | (?P<open_string>"(?:[^"\\\n]|\\[^\n])*\\?)   # runs into the end of the line or file
+      | (?P<plus>\+)
+      | (?P<minus>-)
+      | (?P<equals>=)
+      | (?P<eof>\Z)
+      | (?P<illegal>.)
+    )
+''', re.VERBOSE)
+
+XYZ_REGEX = re.compile(r'[XYZ+\- ]*') # pointer registers (or a minus sign), spaces allowed in between
+NUMBER_REGEX = re.compile(r'0[box][^\n ,;]*|[0-9]+') # anything up to the end of the value once it has a base
+WORD_REGEX = re.compile(r'[A-Za-z0-9._()]*')
+
+WORD_TOKENS = {} # (type, value) of each instruction, register, directive & function name seen so far
+
+# Lines are split into these parts & most lex to the same token wherever they are,
+# so each part is only lexed once (based numbers run into tabs, as in NUMBER_REGEX)
+PART_REGEX = re.compile(r'-?0[box][^ ,;]*|[^ \t,;]+|,|;.*')
+SIMPLE_WORD_REGEX = re.compile(r'[A-Za-z._][A-Za-z0-9._()]*')
+SPACED_POINTER_REGEX = re.compile(r'[XYZ+\-] +[XYZ+\-]') # eg 'X +', which make_XYZ() reads as one token
+
+PART_TOKENS = {} # part: token (shared by every line it is in, nothing changes tokens), or False if it has to be lexed in its line
+FIRST_PART_TOKENS = {} # the same for the first part of a line (eg labels, or X as a word)
+
+# Entries each of the caches above can hold, shared by every file lexed. Past it they are
+# cleared when the next file starts, so grading many files doesn't keep every label & number
+LEXER_CACHE_SIZE = 100000
 
-    def set_value(self, new_value):
-        self.value = new_value % 256
-        self.changed = 1
+class Lexer:
+    def __init__(self, fn, text):
+        self.fn = fn # file name
+        self.text = text
+        self.ln = 1 # line number
+        self.line_start = 0 # index of the start of the line
 
-    def get_bits(self): # returns as string
+    def position(self, idx):
         """
-        Returns as string
+        Returns the Position of index \'idx\' of
+        the current line (only needed for errors).
         """
-        
-        val = str(bin(self.value))[2:]
-        while len(val) < 8:
-            val = '0' + val
-        return val
-
-    def clr(self):
-        self.set_value(0)
 
-    def ser(self):
-        self.set_value(255)
+        return Position(idx, self.ln, idx - self.line_start, self.fn, self.text)
 
-    def set_bit(self, bit):
-        num = 2**bit
-        self.value = self.value | num
-
-    def clear_bit(self, bit):
-        num = 255 - 2**bit
-        self.value = self.value & num
+    def make_tokens(self):
+        for cache in (WORD_TOKENS, PART_TOKENS, FIRST_PART_TOKENS):
+            if len(cache) > LEXER_CACHE_SIZE:
+                cache.clear()
+
+        text = self.text
+        self.lines = []
+        self.line_nums = [] # line that each tokens list is on in the original file
+        self.open_strings = [] # errors kept as tokens, which end where the lexer ends
+
+        text_lines = text.split('\n')
+        simple_lines = {} # line: its make_simple_line() tokens, as lines often repeat
+        lines = self.lines
+        line_nums = self.line_nums
+        last = len(text_lines) # the last line has no line number
+        idx = 0 # index of the start of the line
+
+        next_ln = 1 # lines before this were lexed by make_line()
+        for ln, line in enumerate(text_lines, 1):
+            if ln < next_ln:
+                continue
+
+            if line in simple_lines: tokens = simple_lines[line]
+            else: tokens = simple_lines[line] = self.make_simple_line(line)
+
+            if tokens is None: # a token at a time
+                self.ln = ln
+                self.line_start = idx
+                idx, error = self.make_line(idx)
+                if idx is None: return [], error
+                if idx >= len(text): # an open string on the last line
+                    break
+                next_ln = self.ln
+                continue
 
-    def com(self):
-        self.set_value(255 - self.value)
+            if len(tokens) > 0:
+                lines.append(tokens.copy()) # the parser swaps .def names in its lines
+                if ln < last: line_nums.append(ln)
+            idx += len(line) + (ln < last)
 
-    def neg(self):
-        self.set_value(256 - self.value)
+        if self.open_strings:
+            self.ln = last
+            self.line_start = len(text) - len(text_lines[-1])
+            pos_end = self.position(idx)
+            for error in self.open_strings:
+                error.pos_end = pos_end
 
-    def inc(self):
-        self.set_value(self.value + 1)
+        lines.append(line_nums) # adding the line numbers to the end of the list to be taken off and used
 
-    def dec(self):
-        self.set_value(self.value - 1)
+        return lines, None
 
+    def make_simple_line(self, line):
+        """
+        Returns the tokens of a line (without its newline) from
+        the PART_TOKENS of each part of it, or None if it needs
+        make_line() (strings, pointers with spaces in them,
+        errors & anything else that depends on the rest of the line).
+        """
 
+        if ('"' in line) or SPACED_POINTER_REGEX.search(line):
+            return None
 
-##################################################################################################################
-#  LEXER
-##################################################################################################################
+        parts = PART_REGEX.findall(line)
+        if (len(parts) > 0) and (parts[-1][0] == ';'): # comment
+            parts.pop()
+        if len(parts) == 0:
+            return parts
 
-class Lexer:
-    def __init__(self, fn, text):
-        self.fn = fn # file name
-        self.text = text
-        self.pos = Position(-1, 1, -1, fn, text)
-        self.current_char = None 
+        tokens = list(map(PART_TOKENS.get, parts))
+        tokens[0] = FIRST_PART_TOKENS.get(parts[0])
+        if not all(tokens): # parts not seen before, or that can\'t be lexed on their own
+            tokens = [self.part_token(part, i == 0) for i, part in enumerate(parts)]
+            if not all(tokens):
+                return None
+        return tokens
 
-        self.advance()
+    def part_token(self, part, first=False):
+        """
+        Returns (& remembers) the token \'part\' of a line always
+        lexes to, or False if it doesn\'t (see make_simple_line()).
+        \'first\' is whether it is the first part of its line.
+        """
 
-    def advance(self):
-        self.pos.advance(self.current_char)
-        self.current_char = self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
+        known = FIRST_PART_TOKENS if first else PART_TOKENS
+        if part in known:
+            return known[part]
+
+        tok = None
+        if part == ',':
+            tok = Token(TT_COMMA)
+        elif part == '+':
+            tok = Token(TT_PLUS)
+        elif part[0] in '-XYZ' and (part[0] == '-' or not first): # as make_XYZ() would
+            match = XYZ_REGEX.match(part)
+            char_str = match.group()
+            if (char_str == '-') and NUMBER_REGEX.fullmatch(part, 1):
+                try: tok = self.make_number(part[1:])
+                except ValueError: tok = None # eg 0x with no digits
+                else: tok.value = (-1 * tok.value) % 256
+            elif (match.end() == len(part)) and (char_str in XYZ_TOKENS):
+                tok = Token(XYZ_TOKENS[char_str])
+        elif part[0] in DIGITS:
+            if NUMBER_REGEX.fullmatch(part):
+                try: tok = self.make_number(part)
+                except ValueError: tok = None
+        elif SIMPLE_WORD_REGEX.fullmatch(part):
+            tok, end = self.make_InstRegLabelStrDir(part, len(self.text)) # as if not followed by a colon
+            if isinstance(tok, Token) and (tok.type == TT_DIR) and (tok.value in ['string', 'asciz']):
+                tok = None # changes the words after it
+        elif first and (part[-1] == ':') and SIMPLE_WORD_REGEX.fullmatch(part, 0, len(part) - 1):
+            tok = Token(TT_LABEL, part[:-1])
+
+        if not isinstance(tok, Token): tok = False
+        known[part] = tok
+        return tok
+
+    def make_line(self, idx):
+        """
+        Lexes from \'idx\' to the end of the line one token at a time
+        (carrying on past the newline after an open string). Returns
+        (index of the next line, None), or (None, error) if the lexer
+        stops (the error is None for an unknown name(...)).
+        """
 
-    def make_tokens(self):
-        lines = []
+        text = self.text
         tokens = []
         directive = None
-        line_nums = [] # line that each tokens list is on in the original file
-
-        while self.current_char != None:
 
-            if self.current_char in [' ', '\t']:
-                self.advance()
-            elif self.current_char == '\n':
-                if len(tokens) > 0:
-                    lines.append(tokens)
-                    tokens = []
-                    line_nums.append(self.pos.ln)
-                self.advance()
-                directive = None
-            elif self.current_char == ';':
-                self.skip_comments()
-            elif self.current_char == ',':
-                tokens.append(Token(TT_COMMA))
-                self.advance()
-            elif self.current_char == '\"':
-                tokens.append(self.make_string(directive))
-                self.advance()
-            elif (len(tokens) > 0) and (self.current_char in 'XYZ'):
-                tok = self.make_XYZ()
-                if not isinstance(tok, Token): return [], tok
-                tokens.append(tok) # dont advance after because it does in the method
-            elif self.current_char in (LETTERS + '._'):
-                if len(tokens) > 0: tok = self.make_InstRegLabelStrDir(directive, tokens[-1])
-                else: tok = self.make_InstRegLabelStrDir(directive)
-                if not isinstance(tok, Token): return [], tok
-                tokens.append(tok) # dont advance after because it does in the method
+        while idx < len(text):
+            match = LEXER_REGEX.match(text, idx)
+            kind = match.lastgroup
+            end = match.end()
+
+            # most common first
+            if kind == 'word':
+                word = match.group(kind)
+                if (len(tokens) > 0) and (word[0] in 'XYZ'):
+                    tok, end = self.make_XYZ(end - len(word))
+                    if not isinstance(tok, Token): return None, tok
+                elif (word in WORD_TOKENS) and (text[end:end + 1] != ':'):
+                    tok = Token(*WORD_TOKENS[word])
+                else:
+                    if len(tokens) > 0: tok, end = self.make_InstRegLabelStrDir(word, end, directive, tokens[-1])
+                    else: tok, end = self.make_InstRegLabelStrDir(word, end, directive)
+                    if not isinstance(tok, Token): return None, tok
+                tokens.append(tok)
                 if (tok.type == TT_DIR) and (tok.value in ['string', 'asciz']):
                     directive = tok.value
-            elif self.current_char == '+':
+            elif kind == 'comma':
+                tokens.append(Token(TT_COMMA))
+            elif kind == 'newline':
+                if len(tokens) > 0:
+                    self.lines.append(tokens)
+                    self.line_nums.append(self.ln)
+                self.ln += 1
+                self.line_start = end
+                return end, None
+            elif kind == 'number':
+                tokens.append(self.make_number(match.group(kind)))
+            elif kind == 'comment':
+                pass
+            elif kind == 'string':
+                tokens.append(self.make_string(text[match.start(kind) + 1:end - 1], directive))
+            elif kind == 'open_string':
+                # the error is kept as a token & the newline after it is skipped
+                start = match.start(kind)
+                self.open_strings.append(InvalidInstructionError(self.position(start), None, '"' + text[start + 1:end] + '"'))
+                tokens.append(self.open_strings[-1])
+                if end < len(text):
+                    self.ln += 1
+                    self.line_start = end + 1
+                end += 1
+            elif kind == 'plus':
                 tokens.append(Token(TT_PLUS))
-                self.advance()
-            elif self.current_char == '-':
-                tok = self.make_XYZ()
-                if not isinstance(tok, Token): return [], tok
+            elif kind == 'minus':
+                tok, end = self.make_XYZ(end - 1)
+                if not isinstance(tok, Token): return None, tok
                 tokens.append(tok)
-            elif self.current_char in DIGITS:
-                tokens.append(self.make_number()) # dont advance after because it already does in the method
-            elif self.current_char == '=':
+            elif kind == 'equals':
                 tokens.append(Token(TT_EQ))
-                self.advance()
-            else:
-                pos_start = self.pos.copy()
-                char = self.current_char
-                self.advance()
-                return [], IllegalCharError(pos_start, self.pos, "'" + char + "'")
-
+            elif kind == 'illegal':
+                return None, IllegalCharError(self.position(end - 1), self.position(end), "'" + match.group(kind) + "'")
 
-        if len(tokens) > 0: lines.append(tokens)
-        lines.append(line_nums) # adding the line numbers to the end of the list to be taken off and used
-
-        return lines, None
+            idx = end
 
-    def make_number(self):
-        num_str = ''
-        other_base = False # if the number is in another base such as hex or binary, continue
-        base = 10 # assume base == 10 unless otherwise
+        if len(tokens) > 0: self.lines.append(tokens) # last line, which has no line number
+        return idx, None
 
+    def make_number(self, num_str):
         base_signifiers = {'b': 2, 'o': 8, 'x': 16} # tells what base the number is in
-        
-        while ( self.current_char not in [None, '\n', ' ', ',', ';']) and ( self.current_char in DIGITS or other_base ):
-            num_str += self.current_char
-            self.advance()
-            
-            #########################
-            # For dealing with other bases
-
-            if (num_str == '0') and (self.current_char in base_signifiers):
-                other_base = True
-                base = base_signifiers[self.current_char]
-
 
-
-            #########################
-        if base != 10: number = int(num_str[2:], base)
+        if num_str[1:2] in base_signifiers: number = int(num_str[2:], base_signifiers[num_str[1]])
         else: number = int(num_str)
 
         number = number % 256
         
         return Token(TT_INT, number)
 
-    def make_directive(self):
-        """
-        Makes section token
-        """
-        pos_start = self.pos.copy()
-        dir_str = ''
-
-        while (self.current_char != None) and (self.current_char != '\n') and (self.current_char in (LETTERS + '.')):
-            dir_str += self.current_char
-            self.advance()
-
-        if dir_str in DIRECTIVES:
-            dir_ = dir_str.split('.')[-1] # directive type
-            return Token(TT_DIR, dir_)
-        
-        return InvalidInstructionError(pos_start, self.pos, "'" + dir_str + "'")
-
-    def make_string(self, directive=None):
-        pos_start = self.pos.copy()
-        char = self.current_char
-        if char != '\"': return IllegalCharError(pos_start, self.pos, '"' + self.current_char + '"')
-        self.advance()
-
-        slash = False
-        str_string = ''
-        while (self.current_char != '\"') or slash:
-            if self.current_char in ['\n', None]: return InvalidInstructionError(pos_start, self.pos, '"' + str_string + '"')
-            str_string += self.current_char
-            if self.current_char == '\\':
-                slash = (not slash)
-            else: slash = False
-            self.advance()
-
+    def make_string(self, str_string, directive=None):
         if (directive != None) and (directive in ['string', 'asciz']):
             str_string += chr(0x00) # += NULL
 
         return Token(TT_STRING, str_string)
 
-    def make_XYZ(self):
-        pos_start = self.pos.copy()
-        char_str = ''
+    def make_XYZ(self, idx):
+        """
+        Makes a pointer register token, or a negative number
+        token for a lone minus sign. Returns (token or error,
+        index after it).
+        """
 
-        while self.current_char in ['X', 'Y', 'Z', '-', '+', ' ']:
-            if self.current_char != ' ': char_str += self.current_char
-            self.advance()
+        match = XYZ_REGEX.match(self.text, idx)
+        end = match.end()
+        char_str = match.group().replace(' ', '')
         
-        if (self.current_char in DIGITS) and (char_str == '-'):
-            tok = self.make_number()
+        if (char_str == '-') and (end < len(self.text)) and (self.text[end] in DIGITS): # eg -5
+            match = NUMBER_REGEX.match(self.text, end)
+            tok = self.make_number(match.group())
             tok.value = (-1 * tok.value) % 256
-            return tok
-
-        XYZ_dict = {
-            'X': TT_X,
-            'Y': TT_Y,
-            'Z': TT_Z,
-            'X+': TT_XP,
-            '-X': TT_MX,
-            'Y+': TT_YP,
-            '-Y': TT_MY,
-            'Z+': TT_ZP,
-            '-Z': TT_MZ,
-        }
+            return tok, match.end()
 
-        if char_str in XYZ_dict: return Token(XYZ_dict[char_str])
+        if char_str in XYZ_TOKENS: return Token(XYZ_TOKENS[char_str]), end
 
-        else: return InvalidInstructionError(pos_start, self.pos, "'" + char_str + "'")
+        else: return InvalidInstructionError(self.position(idx), self.position(end), "'" + char_str + "'"), end
 
-    def make_InstRegLabelStrDir(self, directive=None, last_tok=None):
+    def make_InstRegLabelStrDir(self, id_str, end, directive=None, last_tok=None):
         """
         Makes instruction token or
         register token or label token.
+        Returns (token, index after it).
         """
-        pos_start = self.pos.copy()
-        id_str = self.make_id_str()
 
-        if self.current_char == ':': # important if statement
-            self.advance()
+        if self.text[end:end + 1] == ':': # important if statement
+            end += 1
 
             if isinstance(last_tok, Token) and (last_tok.type in [TT_INST, TT_COMMA]): # for double register tokenizing
-                id_str = id_str + ':' + self.make_id_str()
-                return Token(TT_REG, id_str.upper())
+                match = WORD_REGEX.match(self.text, end)
+                id_str = id_str + ':' + match.group()
+                return Token(TT_REG, id_str.upper()), match.end()
 
-            return Token(TT_LABEL, id_str)
+            return Token(TT_LABEL, id_str), end
         
         elif id_str.upper() in INST_LIST:
-            return Token(TT_INST, id_str.upper())
+            WORD_TOKENS[id_str] = (TT_INST, id_str.upper())
+            return Token(TT_INST, id_str.upper()), end
             
         elif id_str.upper() in REGISTER_FILE:
-            return Token(TT_REG, id_str.upper())
+            WORD_TOKENS[id_str] = (TT_REG, id_str.upper())
+            return Token(TT_REG, id_str.upper()), end
 
         elif id_str in DIRECTIVES:
-            return Token(TT_DIR, id_str[1:])
+            WORD_TOKENS[id_str] = (TT_DIR, id_str[1:])
+            return Token(TT_DIR, id_str[1:]), end
 
         elif id_str.upper() in FUNCTIONS:
-            return Token(TT_FNCT, id_str.upper())
+            WORD_TOKENS[id_str] = (TT_FNCT, id_str.upper())
+            return Token(TT_FNCT, id_str.upper()), end
 
         elif (len(id_str) > 5) and (id_str[-1] == ')'):
             if (id_str[:4].lower() == 'lo8('):
-                return Token(TT_LO8, id_str[4:len(id_str) - 1])
+                return Token(TT_LO8, id_str[4:len(id_str) - 1]), end
             
             elif (id_str[:4].lower() == 'hi8('):
-                return Token(TT_HI8, id_str[4:len(id_str) - 1])
+                return Token(TT_HI8, id_str[4:len(id_str) - 1]), end
+
+            return None, end # neither, so the lexer stops without tokens or an error
 
         else:
             if directive in ['string', 'asciz']:
                 id_str += chr(0x00) # += NULL
-            return Token(TT_STRING, id_str)
+            return Token(TT_STRING, id_str), end
 
         #return InvalidInstructionError(pos_start, self.pos, "'" + id_str + "'")
 
-    def make_id_str(self):
-        id_str = ''
-        while (self.current_char != None) and (self.current_char != '\n') and (self.current_char in (LETTERS + DIGITS + '._()')):
-            id_str += self.current_char
-            self.advance()
-
-        return id_str
-
-    def skip_comments(self):
-
-        while self.current_char not in [None, '\n']:
-            self.advance()
-
-
 
 ######################################
 #  CHARACTERS
@@ -532,6 +600,12 @@ FUNCTIONS = [
     "PRINTF"
 ]
 
+######################################
+#  REGISTERS
+######################################
+
+REGISTER_FILE = [f'R{i}' for i in range(32)]
+
 ######################################
 #  TOKENS
 ######################################
@@ -560,6 +634,19 @@ TT_LO8 = 'LO8' # lo8 function
 TT_HI8 = 'HI8' # hi8 function
 TT_FNCT = 'FNCT' # inbuilt function
 
+# Token type of each pointer register (see Lexer.make_XYZ())
+XYZ_TOKENS = {
+    'X': TT_X,
+    'Y': TT_Y,
+    'Z': TT_Z,
+    'X+': TT_XP,
+    '-X': TT_MX,
+    'Y+': TT_YP,
+    '-Y': TT_MY,
+    'Z+': TT_ZP,
+    '-Z': TT_MZ,
+}
+
 DIRECTIVES = [
     '.section',
     '.end',
@@ -586,7 +673,8 @@ class Parser:
         self.line_num = -1
         self.token_num = -1
         self.idx = -1
-        self.pos = Position(-1, 0, -1, self.fn, self.lines)
+        self.pos_idx = -1 # index & line of the current token, only made into a Position for errors
+        self.pos_ln = 0
         
         self.next_line()
         
@@ -611,21 +699,45 @@ class Parser:
         if self.token_num >= len(self.line): self.tok = None
         else: self.tok = self.line[self.token_num]
 
-        self.pos = Position(self.idx, self.line_num, self.line_num, self.fn, self.lines)
+        self.pos_idx = self.idx
+        self.pos_ln = self.line_num
+
+    def position(self, start=None):
+        """
+        Returns the Position of \'start\' (an (index, line)
+        pair) or of the current token.
+        """
+
+        if start == None: start = (self.pos_idx, self.pos_ln)
+        idx, ln = start
+
+        if idx == -1: return Position(-1, 0, -1, self.fn, self.lines) # before the first token
+        return Position(idx, ln, ln, self.fn, self.lines)
+
+    def error(self, start, details, ln=None):
+        """
+        Makes an InvalidInstructionError from \'start\' to the
+        current token, reported on line \'ln\' of the file
+        (the line \'start\' came from by default).
+        """
+
+        pos_start = self.position(start)
+        if ln == None: ln = self.line_nums[pos_start.ln]
+        pos_start.ln = ln
+
+        return InvalidInstructionError(pos_start, self.position(), details)
         
     def parse(self):
 
-        pos_start = self.pos.copy()
+        pos_start = (self.pos_idx, self.pos_ln)
 
         if (self.tok == None) or (self.tok.type != TT_DIR) or (self.tok.value != 'section'):
-            pos_start.ln = self.line_nums[pos_start.ln]
-            return [], InvalidInstructionError(pos_start, self.pos, "First line must be a \'.section\' directive")
+            return [], self.error(pos_start, "First line must be a \'.section\' directive")
 
         self.advance()
 
         if (self.tok == None) or (self.tok.type != TT_STRING) or (self.tok.value not in ['.text', '.data']):
-            pos_start.ln = self.line_nums[pos_start.ln]
-            return [], InvalidInstructionError(pos_start, self.pos, "First line must be a \'.section .data\' or \'.section .text\' directive")
+            return [], self.error(pos_start, "First line must be a \'.section .data\' or \'.section .text\' directive")
 
         if self.tok.value == '.data': self.section = '.data'
         else: self.section = '.text'
@@ -641,7 +753,7 @@ class Parser:
         ###### Parsing data section
         while self.section == '.data':
 
-            pos_start = self.pos
+            pos_start = (self.pos_idx, self.pos_ln)
             # Move to text section if you find text
             if (self.tok.type == TT_DIR) and (self.tok.value == 'section') and (len(self.line) == 2):
                 self.advance()
@@ -666,7 +778,7 @@ class Parser:
         ###### Finding the label locations
         inst_count = 0
         while self.line != None:
-            pos_start = self.pos
+            pos_start = (self.pos_idx, self.pos_ln)
             if self.tok.type == TT_LABEL:
                 self.label_locations[self.tok.value] = inst_count
                 if len(self.line) > 1:
@@ -680,13 +792,11 @@ class Parser:
                 inst_count += 1
             elif self.tok.type == TT_DIR:
                 if self.tok.value not in ['global', 'end']:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return [], InvalidInstructionError(pos_start, self.pos, "'" + self.tok.value + "'")
+                    return [], self.error(pos_start, "'" + self.tok.value + "'")
             elif self.tok.type == TT_FNCT:
                 pass
             else:
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return [], InvalidInstructionError(pos_start, self.pos, "'" + self.tok.value + "'")
+                return [], self.error(pos_start, "'" + self.tok.value + "'")
 
 
             self.next_line()
@@ -701,7 +811,7 @@ class Parser:
         #### Parsing instruction section
         pc = 0
         while self.line != None:
-            pos_start = self.pos.copy()
+            pos_start = (self.pos_idx, self.pos_ln)
             if (self.tok.type == TT_LABEL) and (len(self.line) > 1): # if there is an instruction in the line
                 self.advance()
             
@@ -730,40 +840,32 @@ class Parser:
 
             elif self.tok.type == TT_LABEL:
                 if len(self.line) > 1:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return [], InvalidInstructionError(pos_start, self.pos, "'" + self.tok.value + "'")
+                    return [], self.error(pos_start, "'" + self.tok.value + "'")
             
             elif self.tok.type == TT_DIR:
                 if self.tok.value == 'end':
                     if (self.line_num != ( len(self.lines) - 1 )):
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return [], InvalidInstructionError(pos_start, self.pos, ".end must be the last line of the file")
+                        return [], self.error(pos_start, ".end must be the last line of the file")
                 elif self.tok.value == 'global':
                     if len(self.instructions) != 0:
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return [], InvalidInstructionError(pos_start, self.pos, ".global must be the first line in the text section")
+                        return [], self.error(pos_start, ".global must be the first line in the text section")
                     self.advance()
                     if not isinstance(self.tok, Token):
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return [], InvalidInstructionError(pos_start, self.pos, ".global must have another argument")
+                        return [], self.error(pos_start, ".global must have another argument")
                     if (self.tok.type != TT_STRING) or (self.tok.value not in self.label_locations):
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return [], InvalidInstructionError(pos_start, self.pos, f'Cannot find label \'{self.tok.value}\' in this file')
+                        return [], self.error(pos_start, f'Cannot find label \'{self.tok.value}\' in this file')
                 else:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return [], InvalidInstructionError(pos_start, self.pos, f'\'{self.tok.value}\'')
+                    return [], self.error(pos_start, f'\'{self.tok.value}\'')
             
             else:
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return [], InvalidInstructionError(pos_start, self.pos, "'" + self.tok.value + "'")
+                return [], self.error(pos_start, "'" + self.tok.value + "'")
 
             self.next_line()
 
         if self.lines[-1][0].value != 'end':    # check file ends in ".end" 
-            pos_start.ln = self.line_nums[-1]
-            return [], InvalidInstructionError(pos_start, self.pos, ".end must be the last line of the file")
+            return [], self.error(pos_start, ".end must be the last line of the file", self.line_nums[-1])
 
-        return [self.instructions, self.data], None
+        return [self.instructions, self.data, self.label_locations], None
 
     def inst_parse(self, pc):
         """
@@ -772,7 +874,7 @@ class Parser:
         are valid.
         """
 
-        pos_start = self.pos.copy()
+        pos_start = (self.pos_idx, self.pos_ln)
         inst = self.tok.value
         reqs = INST_REQUIREMENTS[inst]
         req_len = len(reqs)
@@ -782,23 +884,18 @@ class Parser:
         while (self.tok != None):
 
             if idx >= req_len: # if instruction has too many arguments
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, "Too many arguments given")
+                return self.error(pos_start, "Too many arguments given")
             
             req = reqs[idx] # requirement up to
             if isinstance(req, list): # if requirement has options
                 if self.tok.type not in req: 
                     if self.tok.value != None:
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return InvalidInstructionError(pos_start, self.pos, "Incorrect argument \'" + str(self.tok.value) + "\'")
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "Incorrect argument \'" + str(self.tok.type) + "\'")
+                        return self.error(pos_start, "Incorrect argument \'" + str(self.tok.value) + "\'")
+                    return self.error(pos_start, "Incorrect argument \'" + str(self.tok.type) + "\'")
             elif self.tok.type != req: 
                 if self.tok.value != None:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "Incorrect argument \'" + str(self.tok.value) + "\'")
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, "Incorrect argument \'" + str(self.tok.type) + "\'")
+                    return self.error(pos_start, "Incorrect argument \'" + str(self.tok.value) + "\'")
+                return self.error(pos_start, "Incorrect argument \'" + str(self.tok.type) + "\'")
             
             if (self.tok.type == TT_STRING): # if it's a label or data value
                 
@@ -806,11 +903,9 @@ class Parser:
                     if inst[:2].upper() in ['RC', 'RJ', 'BR']: # if branch, rcall or rjump (has a set range of jumping)
                         k = self.label_locations[self.tok.value] - pc - 1
                         if inst[:2].upper == 'BR' and ( (k < -64) or (k > 63) ):
-                            pos_start.ln = self.line_nums[pos_start.ln]
-                            return InvalidInstructionError(pos_start, self.pos, "Label too far away to access from \'" + self.tok.value + "\'")
+                            return self.error(pos_start, "Label too far away to access from \'" + self.tok.value + "\'")
                         elif ( (k < -2048) or (k > 2047) ):
-                            pos_start.ln = self.line_nums[pos_start.ln]
-                            return InvalidInstructionError(pos_start, self.pos, "Label too far away to access from \'" + self.tok.value + "\'")
+                            return self.error(pos_start, "Label too far away to access from \'" + self.tok.value + "\'")
                         inst_info.append(k)
 
                     else: inst_info.append(self.label_locations[self.tok.value]) # add the label location instead of the name
@@ -818,13 +913,11 @@ class Parser:
                 elif (self.tok.value in self.data_locations): # for RAM variables
                     k = self.data_locations[self.tok.value]
                     if ( (k < 0) or (k > 65535) ):
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return InvalidInstructionError(pos_start, self.pos, "\'" + self.tok.value + "\'")
+                        return self.error(pos_start, "\'" + self.tok.value + "\'")
                     inst_info.append(k)
 
                 else:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, f"Illegal argument given: {self.tok.value}")
+                    return self.error(pos_start, f"Illegal argument given: {self.tok.value}")
                 
             elif (self.tok.type in [TT_HI8, TT_LO8]):
                 loc = self.data_locations[self.tok.value]
@@ -843,15 +936,14 @@ class Parser:
         if reqs[0] == None: idx += 1
 
         if (idx < req_len): # if not enough arguments given in the instruction
-            pos_start.ln = self.line_nums[pos_start.ln]
-            return InvalidInstructionError(pos_start, self.pos, "Not enough arguments given")
+            return self.error(pos_start, "Not enough arguments given")
 
         self.instructions.append(inst_info)
         if inst in DOUBLE_LENGTH_INSTRUCTIONS:
             self.instructions.append(None)
         
     def data_label_parse(self):
-        pos_start = self.pos.copy()
+        pos_start = (self.pos_idx, self.pos_ln)
 
         lab = self.tok.value # label
         lab_type = self.tok.type
@@ -860,12 +952,10 @@ class Parser:
             self.advance()
         
         if self.tok == None:
-            pos_start.ln = self.line_nums[pos_start.ln]
-            return InvalidInstructionError(pos_start, self.pos, "Not enough arguments given")
+            return self.error(pos_start, "Not enough arguments given")
 
         if (self.tok.type != TT_DIR):
-            pos_start.ln = self.line_nums[pos_start.ln]
-            return InvalidInstructionError(pos_start, self.pos, "'" + self.tok.value + "'")
+            return self.error(pos_start, "'" + self.tok.value + "'")
 
         self.data_locations[lab] = len(self.data) + 0x100 # add lable to data locations
 
@@ -875,11 +965,9 @@ class Parser:
             comma_ = False
             while self.tok != None:
                 if (int_) and (self.tok.type != TT_INT):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "Expected integer, instead got \'" + self.tok.value + "'")
+                    return self.error(pos_start, "Expected integer, instead got \'" + self.tok.value + "'")
                 elif (comma_) and (self.tok.type != TT_COMMA):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "Expected comma, instead got \'" + self.tok.value + "'")
+                    return self.error(pos_start, "Expected comma, instead got \'" + self.tok.value + "'")
 
                 if int_:
                     #val = int(self.tok.value) % 256
@@ -894,35 +982,29 @@ class Parser:
 
                 self.advance()
             if int_: # if you've just ended on a comma
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, "Cannot end a line with a comma")
+                return self.error(pos_start, "Cannot end a line with a comma")
 
         elif self.tok.value == 'space':
             if not (1 < len(self.line) < 6):
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, "The .space directive has an incorrect number of arguments")
+                return self.error(pos_start, "The .space directive has an incorrect number of arguments")
             
             self.advance()
             if self.tok.type != TT_INT:
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, "The .space directive needs an integer as an argument")
+                return self.error(pos_start, "The .space directive needs an integer as an argument")
             
             num_spaces = int(self.tok.value)
             self.advance()
             val = 0
             if len(self.line) in [4, 5]:
                 if self.tok.type != TT_COMMA:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "The .space directive needs a comma")
+                    return self.error(pos_start, "The .space directive needs a comma")
                 self.advance()
                 if self.tok.type != TT_INT:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "The .space directive needs an integer for both arguments")
+                    return self.error(pos_start, "The .space directive needs an integer for both arguments")
                 val = int(self.tok.value)
 
                 if not 0 <= val <= 255:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "RAM cells cannot store a number outside of the range: 0 - 255")
+                    return self.error(pos_start, "RAM cells cannot store a number outside of the range: 0 - 255")
                 
             
             for i in range(num_spaces):
@@ -932,11 +1014,9 @@ class Parser:
             self.advance()
             while self.tok != None:
                 if (self.tok == None):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "Not enough arguments given")
+                    return self.error(pos_start, "Not enough arguments given")
                 if self.tok.type not in [TT_STRING, TT_COMMA]:
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, "'" + str(self.tok.value) + "'" + " is not a string")
+                    return self.error(pos_start, "'" + str(self.tok.value) + "'" + " is not a string")
                 if self.tok.type == TT_STRING:
                     slash = False
                     for elem in self.tok.value:
@@ -954,33 +1034,28 @@ class Parser:
         elif self.tok.value == 'def':  # if the initial is a .def
 
             if len(self.line) != 4:
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, f'Incorrect number of arguments given')
+                return self.error(pos_start, f'Incorrect number of arguments given')
             
             self.advance()
 
             variable = self.tok.value
 
             if self.tok.type != TT_STRING:
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, f'Illegal variable name \'{self.tok.value}\'')
+                return self.error(pos_start, f'Illegal variable name \'{self.tok.value}\'')
             
             self.advance()
             if self.tok.type != TT_EQ:
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, 'Must have an equals sign following a variable name')
+                return self.error(pos_start, 'Must have an equals sign following a variable name')
             
             self.advance()
 
             if self.tok.type != TT_REG:
-                pos_start.ln = self.line_nums[pos_start.ln]
-                return InvalidInstructionError(pos_start, self.pos, 'Must set variable name to a register')
+                return self.error(pos_start, 'Must set variable name to a register')
 
             self.definitions[variable] = self.tok.value # setting a variable name for a register
                 
         elif self.tok.value in ['section', 'global', 'end']:
-            pos_start.ln = self.line_nums[pos_start.ln]
-            return InvalidInstructionError(pos_start, self.pos, f'\'.{self.tok.value}\' is not a valid directive in the data section.')
+            return self.error(pos_start, f'\'.{self.tok.value}\' is not a valid directive in the data section.')
 
     def check_operands(self, idx):
 
@@ -992,7 +1067,7 @@ class Parser:
         ops = inst[1:]
         requirements = INST_OPERANDS[inst[0]]
 
-        pos_start = self.pos.copy()
+        pos_start = (self.pos_idx, self.pos_ln)
 
         for i in range(len(requirements)):
             req = requirements[i]
@@ -1005,15 +1080,13 @@ class Parser:
                 
                 if ( not isinstance(req[1], list) ): # check d is within the bounds
                     if (d < req[1]) or (d > req[2]):
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return InvalidInstructionError(pos_start, self.pos, f'Register \'{ops[i]}\' not allowed for {inst[0]}')
+                        return self.error(pos_start, f'Register \'{ops[i]}\' not allowed for {inst[0]}')
 
                 elif ':' in ops[i]: # check for double register instructions
                     d_plus1 = int(ops[i].split('R')[-2].rstrip(':')) # big end register number
                     
                     if (d not in req[1]) or (d + 1 != d_plus1):
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return InvalidInstructionError(pos_start, self.pos, f'Register \'{ops[i]}\' not allowed for {inst[0]}')
+                        return self.error(pos_start, f'Register \'{ops[i]}\' not allowed for {inst[0]}')
 
                     self.instructions[idx][i+1] = f'R{d}'
 
@@ -1023,15 +1096,13 @@ class Parser:
                 
                 if ( not isinstance(req[1], list) ): # check d is within the bounds
                     if (r < req[1]) or (r > req[2]):
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return InvalidInstructionError(pos_start, self.pos, f'Register \'{ops[i]}\' not allowed for {inst[0]}')
+                        return self.error(pos_start, f'Register \'{ops[i]}\' not allowed for {inst[0]}')
 
                 elif ':' in ops[i]: # check for double register instructions
                     r_plus1 = int(ops[i].split('R')[-2].rstrip(':')) # big end register number
 
                     if (r not in req[1]) or (r + 1 != r_plus1):
-                        pos_start.ln = self.line_nums[pos_start.ln]
-                        return InvalidInstructionError(pos_start, self.pos, f'Register \'{ops[i]}\' not allowed for {inst[0]}')
+                        return self.error(pos_start, f'Register \'{ops[i]}\' not allowed for {inst[0]}')
 
                     self.instructions[idx][i+1] = f'R{r}'
 
@@ -1039,43 +1110,37 @@ class Parser:
                 K = int(ops[i])
                 
                 if (K < req[1]) or (K > req[2]):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, f'Immediate value \'{ops[i]}\' out of bounds for {inst[0]}')
+                    return self.error(pos_start, f'Immediate value \'{ops[i]}\' out of bounds for {inst[0]}')
 
             elif req[0] == 'k':
                 k = int(ops[i])
                 
                 if (k < req[1]) or (k > req[2]):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, f'Address value \'{ops[i]}\' out of bounds for {inst[0]}')
+                    return self.error(pos_start, f'Address value \'{ops[i]}\' out of bounds for {inst[0]}')
 
             elif req[0] == 'q':
                 q = int(ops[i])
                  
                 if (q < req[1]) or (q > req[2]):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, f'Offset \'{ops[i]}\' out of bounds for {inst[0]}')
+                    return self.error(pos_start, f'Offset \'{ops[i]}\' out of bounds for {inst[0]}')
 
             elif req[0] == 'A':
                 A = int(ops[i])
                  
                 if (A < req[1]) or (A > req[2]):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, f'I/O address \'{ops[i]}\' out of bounds for {inst[0]}')
+                    return self.error(pos_start, f'I/O address \'{ops[i]}\' out of bounds for {inst[0]}')
 
             elif req[0] == 'b':
                 b = int(ops[i])
                  
                 if (b < req[1]) or (b > req[2]):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, f'Bit \'{ops[i]}\' out of bounds for {inst[0]}')
+                    return self.error(pos_start, f'Bit \'{ops[i]}\' out of bounds for {inst[0]}')
 
             elif req[0] == 's':
                 s = int(ops[i])
                  
                 if (s < req[1]) or (s > req[2]):
-                    pos_start.ln = self.line_nums[pos_start.ln]
-                    return InvalidInstructionError(pos_start, self.pos, f'Bit \'{ops[i]}\' out of bounds for {inst[0]}')
+                    return self.error(pos_start, f'Bit \'{ops[i]}\' out of bounds for {inst[0]}')
 
 
 BACKSLASH_VALS = {
@@ -1267,7 +1332,7 @@ INST_OPERANDS = {
     'SEH': [None],
     'SEI': [None],
     'SEN': [None],
-    'SER': [['d', 0, 31]],
+    'SER': [['d', 16, 31]],
     'SES': [None],
     'SET': [None],
     'SEV': [None],
@@ -1304,1694 +1369,3506 @@ DOUBLE_LENGTH_INSTRUCTIONS = [
 ##################################################################################################################
 
 
+# Memory sizes
+PMEM_SIZE = 0x4000 # max 0x3FFF
+DMEM_SIZE = 0x900 # max 0x8FF
+DMEM_MAX = DMEM_SIZE - 1
+
+# Data memory addresses (DMEM is a flat bytearray)
+SPL = 0x5D # stack pointer low byte (0x3D in I/O file)
+SPH = 0x5E # stack pointer high byte (0x3E in I/O file)
+SREG = 0x5F # status register (0x3F in I/O file)
+
+# SREG flag bit masks
+FLAG_C = 0x01 # carry
+FLAG_Z = 0x02 # zero
+FLAG_N = 0x04 # negative
+FLAG_V = 0x08 # two's complement overflow
+FLAG_S = 0x10 # sign (N ^ V)
+FLAG_H = 0x20 # half carry
+FLAG_T = 0x40 # bit copy storage
+FLAG_I = 0x80 # global interrupt enable
+
+# Names breakpoint conditions can use besides R0-R31 (the pointers, SP & SREG are added when checked)
+CONDITION_FLAGS = {'FLAG_C': FLAG_C, 'FLAG_Z': FLAG_Z, 'FLAG_N': FLAG_N, 'FLAG_V': FLAG_V, 'FLAG_S': FLAG_S, 'FLAG_H': FLAG_H, 'FLAG_T': FLAG_T, 'FLAG_I': FLAG_I}
+CONDITION_NAMES = ['X', 'Y', 'Z', 'SP', 'SREG'] + list(CONDITION_FLAGS)
+# Syntax breakpoint conditions can use: names, ints & operators, so no calls, attributes, lambdas or comprehensions
+CONDITION_NODES = (ast.Expression, ast.Name, ast.Load, ast.Constant, ast.Compare, ast.BoolOp, ast.BinOp, ast.UnaryOp,
+                   ast.cmpop, ast.boolop, ast.operator, ast.unaryop)
+
+# Reverse stepping history
+CHECKPOINT_INTERVAL = 10000 # steps between snapshots
+MAX_CHECKPOINTS = 64 # when full every other one is dropped & the interval doubles
+MAX_UNDO = 100000 # steps that can be undone without replaying from a snapshot
+
+# Default clock for turning cycles into time
+CLOCK_HZ = 16_000_000 # 16 MHz
+
+# PRINTF output held before being written out
+OUTPUT_BUFFER_SIZE = 4096 # characters
+MAX_OUTPUT = 1_000_000 # PRINTF characters run_interpreter() keeps, the rest are counted & dropped
+
+# Basic block compiler
+BLOCK_MAX_LENGTH = 256 # most instructions compiled into one block
+BLOCK_CACHE_SIZE = 64 # programs whose compiled blocks are kept
+
+def make_add_flags():
+    """
+    Builds the H, S, V, N, Z & C flags of Rd + Rr + C
+    for every Rd, Rr & C. Indexed by (C << 16) | (Rd << 8) | Rr.
+    """
+
+    flags = bytearray(2 * 256 * 256)
+    for C in range(2):
+        for Rd in range(256):
+            Rd3 = (Rd >> 3) & 1
+            Rd7 = Rd >> 7
+            idx = (C << 16) | (Rd << 8)
+            for Rr in range(256):
+                R = (Rd + Rr + C) & 0xFF
+                Rr3 = (Rr >> 3) & 1
+                Rr7 = Rr >> 7
+                R3 = (R >> 3) & 1
+                R7 = R >> 7
+                H = (Rd3 & Rr3) | (Rr3 & (1 - R3)) | (Rd3 & (1 - R3))
+                V = (Rd7 & Rr7 & (1 - R7)) | ((1 - Rd7) & (1 - Rr7) & R7)
+                N = R7
+                Z = int(R == 0)
+                c = (Rd7 & Rr7) | (Rr7 & (1 - R7)) | (Rd7 & (1 - R7))
+                flags[idx | Rr] = (H << 5) | ((V ^ N) << 4) | (V << 3) | (N << 2) | (Z << 1) | c
+    return bytes(flags)
+
+def make_sub_flags():
+    """
+    Builds the H, S, V, N, Z & C flags of Rd - Rr - C
+    for every Rd, Rr & C. Indexed by (C << 16) | (Rd << 8) | Rr.
+    """
+
+    flags = bytearray(2 * 256 * 256)
+    for C in range(2):
+        for Rd in range(256):
+            Rd3 = (Rd >> 3) & 1
+            Rd7 = Rd >> 7
+            idx = (C << 16) | (Rd << 8)
+            for Rr in range(256):
+                R = (Rd - Rr - C) & 0xFF
+                Rr3 = (Rr >> 3) & 1
+                Rr7 = Rr >> 7
+                R3 = (R >> 3) & 1
+                R7 = R >> 7
+                H = (Rr3 & R3) | (Rr3 & (1 - Rd3)) | (R3 & (1 - Rd3))
+                V = (Rr7 & R7 & (1 - Rd7)) | ((1 - Rr7) & (1 - R7) & Rd7)
+                N = R7
+                Z = int(R == 0)
+                c = (Rr7 & R7) | (Rr7 & (1 - Rd7)) | (R7 & (1 - Rd7))
+                flags[idx | Rr] = (H << 5) | ((V ^ N) << 4) | (V << 3) | (N << 2) | (Z << 1) | c
+    return bytes(flags)
+
+def make_result_flags(V_result=None):
+    """
+    Builds the S, V, N & Z flags of an 8 bit result R, indexed by R.
+    V is only set when R == V_result (eg 0x80 for INC).
+    """
+
+    flags = bytearray(256)
+    for R in range(256):
+        V = int(R == V_result)
+        N = R >> 7
+        flags[R] = ((V ^ N) << 4) | (V << 3) | (N << 2) | (int(R == 0) << 1)
+    return bytes(flags)
+
+ADD_FLAGS = make_add_flags() # ADD, ADC
+SUB_FLAGS = make_sub_flags() # SUB, SUBI, SBC, CP, CPC, CPI
+LOGIC_FLAGS = make_result_flags() # AND, ANDI, OR, ORI, EOR, CBR, SBR, TST, COM
+INC_FLAGS = make_result_flags(0x80)
+DEC_FLAGS = make_result_flags(0x7F)
+
+def write_stdout(text):
+    sys.stdout.write(text) # looked up each time so redirect_stdout still works
+
+class OutputBuffer:
+    """
+    Holds PRINTF output and writes it to each of
+    \'sinks\' in batches, once \'size\' characters
+    are held or when flush() is called.
+    """
+
+    def __init__(self, size=OUTPUT_BUFFER_SIZE, sinks=(write_stdout,)):
+        self.size = size
+        self.sinks = list(sinks)
+        self.parts = []
+        self.length = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+        if self.length >= self.size:
+            self.flush()
+
+    def flush(self):
+        if not self.parts:
+            return
+
+        text = ''.join(self.parts)
+        self.parts = []
+        self.length = 0
+        for sink in self.sinks:
+            sink(text)
+
 class Interpreter:
-    def __init__(self, dmem, pmem, fn, inst_length):
+    def __init__(self, dmem, pmem, fn, inst_length, program=None, labels=None):
         self.dmem = dmem
         self.pmem = pmem
         self.fn = fn
-        self.pos = Position(-1, 0, -1, fn, self.pmem)
         self.inst_length = inst_length # number of instructions before all NOPs
+        self.labels = labels or {} # label name -> PMEM address, from Parser.label_locations
         self.file_end = False # have you executed the whole file
 
-        #self.pcl = self.dmem[0x5B] # PC low
-        #self.pch = self.dmem[0x5C] # PC high
-
-        self.pcl = Register('PCL')
-        self.pch = Register('PCH')
-
+        self.pc = 0 # program counter
         self.last_pc = 'N/A'
 
-        self.sreg = self.dmem[0x5F]
-        self.sph = self.dmem[0x5E]
-        self.spl = self.dmem[0x5D]
-
-        self.current_inst = self.pmem[self.get_pc_val()]
-
         self.pmem_length = len(self.pmem)
         self.dmem_length = len(self.dmem)
+        self.changed = bytearray(self.dmem_length) # dirty bitmap of dmem, for displaying changes in red
+        self.output = OutputBuffer() # PRINTF output, flushed in batches
 
-        self.fnctmap = {
-            'ADC': self.adc_instruction,
-            'ADD': self.add_instruction,
-            'ADIW': self.adiw_instruction,
-            'AND': self.and_instruction,
-            'ANDI': self.andi_instruction,
-            'ASR': self.asr_instruction,
-            'BCLR': self.bclr_instruction,
-            'BRBC': self.brbc_instruction,
-            'BRBS': self.brbs_instruction,
-            'BRCC': self.brcc_instruction,
-            'BRCS': self.brcs_instruction,
-            'BREQ': self.breq_instruction,
-            'BRGE': self.brge_instruction,
-            'BRHC': self.brhc_instruction,
-            'BRHS': self.brhs_instruction,
-            'BRID': self.brid_instruction,
-            'BRIE': self.brie_instruction,
-            'BRLO': self.brlo_instruction,
-            'BRLT': self.brlt_instruction,
-            'BRMI': self.brmi_instruction,
-            'BRNE': self.brne_instruction,
-            'BRPL': self.brpl_instruction,
-            'BRSH': self.brsh_instruction,
-            'BRTC': self.brtc_instruction,
-            'BRTS': self.brts_instruction,
-            'BRVC': self.brvc_instruction,
-            'BRVS': self.brvs_instruction,
-            'BSET': self.bset_instruction,
-            'CALL': self.call_instruction,
-            'CBI': self.cbi_instruction,
-            'CBR': self.cbr_instruction,
-            'CLC': self.clc_instruction,
-            'CLH': self.clh_instruction,
-            'CLI': self.cli_instruction,
-            'CLN': self.cln_instruction,
-            'CLR': self.clr_instruction,
-            'CLS': self.cls_instruction,
-            'CLT': self.clt_instruction,
-            'CLV': self.clv_instruction,
-            'CLZ': self.clz_instruction,
-            'COM': self.com_instruction,
-            'CP': self.cp_instruction,
-            'CPC': self.cpc_instruction,
-            'CPI': self.cpi_instruction,
-            'DEC': self.dec_instruction,
-            'EOR': self.eor_instruction,
-            'IN': self.in_instruction,
-            'INC': self.inc_instruction,
-            'JMP': self.jmp_instruction,
-            'LD': self.ld_instruction,
-            'LDD': self.ldd_instruction,
-            'LDI': self.ldi_instruction,
-            'LDS': self.lds_instruction,
-            'LSL': self.lsl_instruction,
-            'LSR': self.lsr_instruction,
-            'MOV': self.mov_instruction,
-            'MOVW': self.movw_instruction,
-            'MUL': self.mul_instruction,
-            'MULS': self.muls_instruction,
-            'MULSU': self.mulsu_instruction,
-            'NEG': self.neg_instruction,
-            'NOP': self.nop_instruction,
-            'OR': self.or_instruction,
-            'ORI': self.ori_instruction,
-            'OUT': self.out_instruction,
-            'POP': self.pop_instruction,
-            'PUSH': self.push_instruction,
-            'RJMP': self.rjmp_instruction,
-            'RET': self.ret_instruction,
-            'ROL': self.rol_instruction,
-            'ROR': self.ror_instruction,
-            'SBC': self.sbc_instruction,
-            'SBI': self.sbi_instruction,
-            'SBIW': self.sbiw_instruction,
-            'SBR': self.sbr_instruction,
-            'SBRC': self.sbrc_instruction,
-            'SBRS': self.sbrs_instruction,
-            'SEC': self.sec_instruction,
-            'SEH': self.seh_instruction,
-            'SEI': self.sei_instruction,
-            'SEN': self.sen_instruction,
-            'SER': self.ser_instruction,
-            'SES': self.ses_instruction,
-            'SET': self.set_instruction,
-            'SEV': self.sev_instruction,
-            'SEZ': self.sez_instruction,
-            'ST': self.st_instruction,
-            'STD': self.std_instruction,
-            'STS': self.sts_instruction,
-            'SUB': self.sub_instruction,
-            'SUBI': self.subi_instruction,
-            'SWAP': self.swap_instruction,
-            'TST': self.tst_instruction,
-            'XCH': self.xch_instruction
-        }
+        if program is None: program = decode_program(self.pmem)
+        self.program = program # pmem decoded into (handler, operands) records, shared & never changed
+        self.cycle_costs = program_cycles(program) # cycles of each record (branches & skips add more when taken)
+
+        self.cycles = 0 # cycles run so far
+        self.clock_hz = CLOCK_HZ
+
+        self.breakpoints = {} # PMEM address -> compiled condition or None
+        self.watchpoints = [] # dmem addresses
+        self.hit = None # BreakpointHit that stopped the last run_interpreter()
+        self.blocks = None # BlockCache when running whole basic blocks (see enable_blocks())
+        self.record_lengths = None # instructions each record runs, once fused (see enable_fusion())
 
         #self.pushpop = 0 # counting (pushes - pops) for each subroutine layer
 
     def copy(self):
-        return Interpreter(self.dmem, self.pmem, self.fn, self.inst_length)
+        return Interpreter(self.dmem, self.pmem, self.fn, self.inst_length, self.program, self.labels)
 
     def step(self):
-        if (not self.file_end) and (self.get_pc_val() < self.pmem_length):
-            # Executes instruction and updates PC and SREG
-            self.current_inst = self.pmem[self.get_pc_val()] # set current instruction
-            inst = self.current_inst[0] # set instruction name
-            self.last_pc = self.get_pc_val()
+        pc = self.pc
+        if self.file_end or (pc >= self.pmem_length):
+            self.file_end = True
+            return
 
-        else: self.file_end = True
+        # Executes instruction and updates PC and SREG
+        self.last_pc = pc
+        self.cycles += self.cycle_costs[pc]
+        handler, operands = self.program[pc]
+        return handler(self, *operands)
 
-        if self.file_end:
-            pass
+    def enable_fusion(self):
+        """
+        Runs a fuse_program() copy of the program, so common
+        pairs of instructions take one step() between them
+        (run_interpreter() still counts them as 2 steps).
+        Only for plain runs: breakpoints, watchpoints, history,
+        traces & profiles all expect one instruction per step.
+        """
 
-        else:
-            self.fnctmap[inst]()
+        self.unfused_program = self.program
+        self.program = fuse_program(self.program, self.labels)
+        self.cycle_costs = program_cycles(self.program)
+        self.record_lengths = program_lengths(self.program)
 
+    def counted_step(self, limit=None):
+        """
+        step() that also returns how many instructions it ran,
+        as (instructions run, output). If a fused pair is more
+        than \'limit\' instructions only the first one is run.
+        """
 
-    def adc_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value # get Rr value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value # get Rd value
-        C = int(self.sreg.value[7]) # get carry bit
-        R = (Rd + Rr + C) % 256 # calculate result
-        Rd = self.make_8_bit_binary(Rd)
-        
-        self.dmem[int(self.current_inst[1][1:])].set_value(R) # set result register value
-        self.update_pc_val(self.get_pc_val() + 1) # increment PC
-        
-        Rr = self.make_8_bit_binary(Rr)
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[2] = int((int(Rd[4]) & int(Rr[4])) | (int(Rr[4]) & (1 - int(R[4]))) | (int(Rd[4]) & (1 - int(R[4]))))
-        self.sreg.value[4] = int((int(Rd[0]) & int(Rr[0]) & (1 - int(R[0]))) | ((1 - int(Rd[0])) & (1 - int(Rr[0])) & int(R[0])))
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-        self.sreg.value[7] = int((int(Rd[0]) & int(Rr[0])) | (int(Rr[0]) & (1 - int(R[0]))) | (int(Rd[0]) & (1 - int(R[0]))))
-
-    def add_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = (Rd + Rr) % 256
-        Rd = self.make_8_bit_binary(Rd)
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        Rr = self.make_8_bit_binary(Rr)
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[2] = int((int(Rd[4]) & int(Rr[4])) | (int(Rr[4]) & (1 - int(R[4]))) | (int(Rd[4]) & (1 - int(R[4]))))
-        self.sreg.value[4] = int((int(Rd[0]) & int(Rr[0]) & (1 - int(R[0]))) | ((1 - int(Rd[0])) & (1 - int(Rr[0])) & int(R[0])))
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-        self.sreg.value[7] = int((int(Rd[0]) & int(Rr[0])) | (int(Rr[0]) & (1 - int(R[0]))) | (int(Rd[0]) & (1 - int(R[0]))))
-
-    def adiw_instruction(self):
-        Rdl = self.dmem[int(self.current_inst[1][1:])].value
-        Rdh = self.dmem[int(self.current_inst[1][1:]) + 1].value
-        K = int(self.current_inst[2])
-
-        R = (256 * Rdh) + Rdl
-        R = (R + K) % (256 * 256)
-        RLow = R % 256
-        RHigh = int((R - RLow)/256)
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(RLow)
-        self.dmem[int(self.current_inst[1][1:]) + 1].set_value(RHigh)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        Rdh = self.make_8_bit_binary(Rdh)
-        Rdl = self.make_8_bit_binary(Rdl)
-        R = self.make_n_bit_binary(R, 16)
-
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[6] = int(R == '0000000000000000')
-        self.sreg.value[4] = int(R[0]) & (1 - int(Rdh[0]))
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[7] = (1- int(R[0])) & int(Rdh[0])
-
-    def and_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = Rd & Rr
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-
-    def andi_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        K = int(self.current_inst[2])
-        R = Rd & K
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-
-    def asr_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        R = self.make_8_bit_binary(Rd)
-        C = int(R[7])
-        R = R[0] + R[0:7]
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(int(R, 2))
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[4] = int(R[0]) ^ C
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-        self.sreg.value[7] = C
-
-    def bclr_instruction(self):
-        s = int(self.current_inst[1])
-        self.sreg.value[7 - s] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def brbc_instruction(self):
-        s = int(self.current_inst[1])
-        k = int(self.current_inst[2])
-        if (self.sreg.value[7 - s] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brbs_instruction(self):
-        s = int(self.current_inst[1])
-        k = int(self.current_inst[2])
-        if (self.sreg.value[7 - s] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brcc_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[7] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brcs_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[7] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def breq_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[6] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brge_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[4] ^ self.sreg.value[5] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brhc_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[2] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brhs_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[2] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brid_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[0] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brie_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[0] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brlo_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[7] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brlt_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[4] ^ self.sreg.value[5] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brmi_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[5] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brne_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[6] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brpl_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[5] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brsh_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[7] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brtc_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[1] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brts_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[1] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brvc_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[4] == 0): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def brvs_instruction(self):
-        k = int(self.current_inst[1])
-        if (self.sreg.value[4] == 1): self.update_pc_val(self.get_pc_val() + k + 1)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def bset_instruction(self):
-        s = int(self.current_inst[1])
-        self.sreg.value[7 - s] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def call_instruction(self):
-        self.update_pc_val(self.get_pc_val() + 2) # same for both if/else statements
-
-        if self.current_inst[1] not in FUNCTIONS:
-            self.dmem[self.get_SP()] = self.pcl.value # adding to stack
-            self.decrement_SP()
-            self.dmem[self.get_SP()] = self.pch.value # adding to stack
-            self.decrement_SP()
-            k = int(self.current_inst[1])
-            self.update_pc_val(k)
-
-        elif self.current_inst[1] == 'PRINTF':
-            ### Pop
-            self.increment_SP()
-            self.dmem[26].set_value(self.dmem[self.get_SP()] ) # R26 = lo8()
+        pc = self.pc
+        if (self.record_lengths is None) or self.file_end or (pc >= self.pmem_length):
+            return 1, self.step()
 
-            self.increment_SP()
-            self.dmem[27].set_value(self.dmem[self.get_SP()]) # R27 = hi8()
-
-            ### Print
-            printed_string = ''
-            while True:
-                XYZ = 'X+'
-                val = self.get_XYZ(XYZ) # dmem value in XYZ
-                self.increment_XYZ(XYZ) # increments XYZ if necessary
-                K = self.dmem[val]
-                if K == 0:
-                    break
-                char = chr(K)
-                print(char, end = '') # prints the value
-                printed_string += char
-            # print('') -> could be used to add \n to end of each line
-
-            ### Push
-            Rr = self.dmem[27].value
-            self.dmem[self.get_SP()] = Rr
-            self.decrement_SP()
-            #self.dmem[27].set_value(Xhigh) # reset the value of R27 to what it was so it isnt disturbed
-
-            Rr = self.dmem[26].value
-            self.dmem[self.get_SP()] = Rr
-            self.decrement_SP()
-            #self.dmem[26].set_value(Xlow) # reset the value of R26 to what it was so it isnt disturbed
-
-            return printed_string
-
-    def cbi_instruction(self):
-        A = int(self.current_inst[1]) + 0x20
-        b = int(self.current_inst[2])
-        self.dmem[A].clear_bit(b)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def cbr_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        K = int(self.current_inst[2])
-        R = Rd & (0xFF - K)
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
+        length = self.record_lengths[pc]
+        if (limit is not None) and (length > limit): # the unfused record, the second stays at the next address
+            self.last_pc = pc
+            handler, operands = self.unfused_program[pc]
+            self.cycles += HANDLER_CYCLES.get(handler, 1)
+            return 1, handler(self, *operands)
 
-    def clc_instruction(self):
-        self.sreg.value[7] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
+        return length, self.step()
 
-    def clh_instruction(self):
-        self.sreg.value[2] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
+    def enable_blocks(self):
+        """
+        Makes run_interpreter() run a whole basic block
+        per block_step(), each compiled into one function
+        the first time it is reached. Like fusion, only
+        for plain runs.
+        """
 
-    def cli_instruction(self):
-        self.sreg.value[0] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
+        self.blocks = program_blocks(self.program, self.labels)
 
-    def cln_instruction(self):
-        self.sreg.value[5] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
+    def block_step(self, limit=None):
+        """
+        Runs the compiled block at the PC, or a single
+        counted_step() if it is longer than \'limit\'
+        instructions or the file has ended. Returns
+        (instructions run, error or None).
+        """
 
-    def clr_instruction(self):
-        self.dmem[int(self.current_inst[1][1:])].set_value(0)
-        self.update_pc_val(self.get_pc_val() + 1)
-        self.sreg.value[3] = 0
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = 0
-        self.sreg.value[6] = 1
+        pc = self.pc
+        if self.file_end or (pc >= self.pmem_length):
+            return self.counted_step(limit)
 
-    def cls_instruction(self):
-        self.sreg.value[3] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
+        block, length = self.blocks[pc]
+        if (limit is not None) and (length > limit):
+            return self.counted_step(limit)
+        return block(self)
 
-    def clt_instruction(self):
-        self.sreg.value[1] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
+    def enable_profiling(self):
+        """
+        Swaps step() for profile_step() on this interpreter,
+        so runs without profiling don\'t pay for it.
+        """
 
-    def clv_instruction(self):
-        self.sreg.value[4] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
+        self.profile_counts = [0] * self.pmem_length    # executions of each PMEM address
+        self.profile_cycles = [0] * self.pmem_length    # cycles spent at each PMEM address
+        self.profile_inclusive = [0] * self.pmem_length # cycles from each CALL until its RET
+        self.profile_inclusive_counts = [0] * self.pmem_length # instructions from each CALL until its RET
+        self.profile_executed = 0                       # instructions run while profiling
+        self.profile_stack = []                         # (CALL address, cycles & instructions at the CALL)
+        self.step = self.profile_step
 
-    def clz_instruction(self):
-        self.sreg.value[6] = 0
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def com_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        R = 0xFF - Rd
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R > 127)
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == 0)
-        self.sreg.value[7] = 1
-
-    def cp_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = (Rd - Rr) % 256
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        Rd = self.make_8_bit_binary(Rd)
-        Rr = self.make_8_bit_binary(Rr)
-        R = self.make_8_bit_binary(R)
-
-        self.sreg.value[2] = int((int(Rr[4]) & int(R[4])) | (int(Rr[4]) & (1 - int(Rd[4]))) | (int(R[4]) & (1 - int(Rd[4]))))
-        self.sreg.value[4] = int((int(Rr[0]) & int(R[0]) & (1 - int(Rd[0]))) | ((1 - int(Rr[0])) & (1 - int(R[0])) & int(Rd[0])))
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-        self.sreg.value[7] = int((int(Rr[0]) & int(R[0])) | (int(Rr[0]) & (1 - int(Rd[0]))) | (int(R[0]) & (1 - int(Rd[0]))))
-
-    def cpc_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        C = self.sreg.value[7]
-        R = (Rd - Rr - C) % 256
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        Rd = self.make_8_bit_binary(Rd)
-        Rr = self.make_8_bit_binary(Rr)
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[2] = int((int(Rr[4]) & int(R[4])) | (int(Rr[4]) & (1 - int(Rd[4]))) | (int(R[4]) & (1 - int(Rd[4]))))
-        self.sreg.value[4] = int((int(Rr[0]) & int(R[0]) & (1 - int(Rd[0]))) | ((1 - int(Rr[0])) & (1 - int(R[0])) & int(Rd[0])))
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int((R == '00000000') & (self.sreg.value[6]))
-        self.sreg.value[7] = int((int(Rr[0]) & int(R[0])) | (int(Rr[0]) & (1 - int(Rd[0]))) | (int(R[0]) & (1 - int(Rd[0]))))
-
-    def cpi_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        K = int(self.current_inst[2])
-        R = (Rd - K) % 256
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        Rd = self.make_8_bit_binary(Rd)
-        K = self.make_8_bit_binary(K)
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[2] = int((int(K[4]) & int(R[4])) | (int(K[4]) & (1 - int(Rd[4]))) | (int(R[4]) & (1 - int(Rd[4]))))
-        self.sreg.value[4] = int((int(K[0]) & int(R[0]) & (1 - int(Rd[0]))) | ((1 - int(K[0])) & (1 - int(R[0])) & int(Rd[0])))
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-        self.sreg.value[7] = int((int(K[0]) & int(R[0])) | (int(K[0]) & (1 - int(Rd[0]))) | (int(R[0]) & (1 - int(Rd[0]))))
-
-    def dec_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        R = (Rd - 1) % 256
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = int(R == '01111111')
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-
-    def eor_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = Rd ^ Rr
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-
-    def in_instruction(self):
-        A = self.dmem[int(self.current_inst[2]) + 0x20].value
-        self.dmem[int(self.current_inst[1][1:])].set_value(A)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def inc_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        R = (Rd + 1) % 256
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = int(R == '10000000')
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-
-    def jmp_instruction(self):
-        k = int(self.current_inst[1])
-        self.update_pc_val(k)
-
-    def ld_instruction(self):
-        XYZ = self.current_inst[2]
-        self.decrement_XYZ(XYZ) # decrements XYZ if necessary
-        val = self.get_XYZ(XYZ) # dmem value in XYZ
-        K = self.dmem[val]
-        self.dmem[int(self.current_inst[1][1:])].set_value(K)
-        self.update_pc_val(self.get_pc_val() + 1)
-        self.increment_XYZ(XYZ) # increments XYZ if necessary
-
-    def ldd_instruction(self):
-        XYZ = self.current_inst[2]
-        q = int(self.current_inst[3])
-        val = self.get_XYZ(XYZ) + q # dmem value in XYZ
-        K = self.dmem[val]
-        self.dmem[int(self.current_inst[1][1:])].set_value(K)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def ldi_instruction(self):
-        K = int(self.current_inst[2])
-        self.dmem[int(self.current_inst[1][1:])].set_value(K)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def lds_instruction(self):
-        k = self.dmem[int(self.current_inst[2])]
-        self.dmem[int(self.current_inst[1][1:])].set_value(k)
-        self.update_pc_val(self.get_pc_val() + 2)
-
-    def lsl_instruction(self):
-        R = self.make_8_bit_binary(self.dmem[int(self.current_inst[1][1:])].value)
-        Rd = R + '0'
-        C = int(Rd[0])
-        Rd = int(Rd[1:], 2)
-        self.dmem[int(self.current_inst[1][1:])].set_value(Rd)
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[2] = int(R[4])
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[7] = C
-        self.sreg.value[4] = self.sreg.value[5] ^ self.sreg.value[7]
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-
-    def lsr_instruction(self):
-        R = '0' + self.make_8_bit_binary(self.dmem[int(self.current_inst[1][1:])].value)
-        C = int(R[8])
-        Rd = int(R[:8], 2)
-        self.dmem[int(self.current_inst[1][1:])].set_value(Rd)
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[5] = 0
-        self.sreg.value[7] = C
-        self.sreg.value[4] = self.sreg.value[5] ^ self.sreg.value[7]
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R[:8] == '00000000')
-
-    def mov_instruction(self):
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        self.dmem[int(self.current_inst[1][1:])].set_value(Rr)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def movw_instruction(self):
-        d = int(self.current_inst[1][1:])
-        r = int(self.current_inst[2][1:])
-        Rrl = self.dmem[r].value
-        Rrh = self.dmem[r + 1].value
-
-        self.dmem[d].set_value(Rrl)
-        self.dmem[d + 1].set_value(Rrh)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def mul_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = Rd * Rr
-        R0 = R % 256
-        R1 = int((R - R0) / 256)
-
-        self.dmem[0].set_value(R0)
-        self.dmem[1].set_value(R1)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[6] = int(R == 0)
-        self.sreg.value[7] = int(R >= 32768)
-
-    def muls_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = Rd * Rr
-        R0 = R % 256
-        R1 = int((R - R0) / 256)
-
-        self.dmem[0].set_value(R0)
-        self.dmem[1].set_value(R1)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[6] = int(R == 0)
-        self.sreg.value[7] = int(R >= 32768)
-
-    def mulsu_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = Rd * Rr
-        R0 = R % 256
-        R1 = int((R - R0) / 256)
-
-        self.dmem[0].set_value(R0)
-        self.dmem[1].set_value(R1)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[6] = int(R == 0)
-        self.sreg.value[7] = int(R >= 32768)
-
-    def neg_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        R = (0x00 - Rd) % 256
-        Rd = self.make_8_bit_binary(Rd)
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[2] = int(int(R[4]) | (1 - int(Rd[4])))
-        self.sreg.value[4] = int(R == '10000000')
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R != '00000000')
+    def profile_step(self):
+        """
+        step() that also counts the executions &
+        cycles of each PMEM address.
+        """
 
-    def nop_instruction(self):
-        self.update_pc_val(self.get_pc_val() + 1)
+        pc = self.pc
+        if self.file_end or (pc >= self.pmem_length):
+            return Interpreter.step(self)
 
-    def or_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = Rd | Rr
+        cycles = self.cycles
+        output = Interpreter.step(self)
+        self.profile_counts[pc] += 1
+        self.profile_cycles[pc] += self.cycles - cycles
+        self.profile_executed += 1
 
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
+        handler = self.program[pc][0]
+        if handler is Interpreter.call_instruction:
+            self.profile_stack.append((pc, cycles, self.profile_executed - 1))
+        elif (handler is Interpreter.ret_instruction) and self.profile_stack and (not self.file_end):
+            call_pc, call_cycles, call_executed = self.profile_stack.pop()
+            self.profile_inclusive[call_pc] += self.cycles - call_cycles
+            self.profile_inclusive_counts[call_pc] += self.profile_executed - call_executed
 
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
+        return output
 
-    def ori_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        K = int(self.current_inst[2])
-        R = Rd | K
+    def enable_trace(self, writer):
+        """
+        Swaps step() for trace_step() on this interpreter so
+        each instruction run is written to a TraceWriter.
+        Uses the \'changed\' bitmap to find the writes, so it
+        no longer shows what changed since the last refresh.
+        """
 
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
+        self.trace_writer = writer
+        self.trace_opcodes = {}                 # PMEM address -> first word of its machine code
+        self.trace_dmem = bytearray(self.dmem)  # dmem before the current instruction
+        self.traced_step = self.step            # eg profile_step() if profiling too
+        self.clear_changed()
+        self.step = self.trace_step
 
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
+    def trace_step(self):
+        """
+        step() that also writes the PC, opcode, SREG
+        before & after and every dmem write (except
+        SREG) of the instruction to the trace.
+        """
 
-    def out_instruction(self):
-        Rd = self.dmem[int(self.current_inst[2][1:])].value
-        A = int(self.current_inst[1])
-        self.dmem[A + 0x20].set_value(Rd)
-        self.update_pc_val(self.get_pc_val() + 1)
+        pc = self.pc
+        if self.file_end or (pc >= self.pmem_length):
+            return self.traced_step()
 
-    def pop_instruction(self):
+        sreg = self.dmem[SREG]
+        output = self.traced_step()
 
-        if self.get_SP() < DMEM_MAX: # check if the top layer has no elements left (ie nothing left in stack)
-            self.increment_SP()
-            STACK = self.dmem[self.get_SP()]
-            self.dmem[int(self.current_inst[1][1:])].set_value(STACK)
-            self.update_pc_val(self.get_pc_val() + 1)
-        else:
-            return RETError(self.get_pc_val(), 'No elements left to pop.')
+        opcode = self.trace_opcodes.get(pc)
+        if opcode is None:
+            opcode = self.trace_opcodes[pc] = encode_instruction(self.pmem[pc])[0]
 
-    def push_instruction(self):
-        sp = self.get_SP()
-        if sp < 0x100:
-            return StackOverflowError(self.get_pc_val(), f'Cannot push another element to the stack.')
+        writes = []
+        changed = self.changed
+        addr = changed.find(1)
+        while addr != -1:
+            changed[addr] = 0
+            writes.append((addr, self.trace_dmem[addr], self.dmem[addr]))
+            self.trace_dmem[addr] = self.dmem[addr]
+            addr = changed.find(1, addr + 1)
 
-        Rr = self.dmem[int(self.current_inst[1][1:])].value
-        self.dmem[sp] = Rr
-        self.decrement_SP()
-        self.update_pc_val(self.get_pc_val() + 1)
+        self.trace_dmem[SREG] = self.dmem[SREG]
+        self.trace_writer.write_step(pc, opcode, sreg, self.dmem[SREG], writes)
+        return output
 
-    def rjmp_instruction(self):
-        k = int(self.current_inst[1])
-        self.update_pc_val(self.get_pc_val() + k + 1)
+    def enable_history(self, checkpoint_interval=CHECKPOINT_INTERVAL, max_checkpoints=MAX_CHECKPOINTS, max_undo=MAX_UNDO):
+        """
+        Swaps step() for history_step() on this interpreter
+        so it can be stepped backwards with reverse_step().
+        """
 
-    def ret_instruction(self):
+        self.history_base_step = self.step
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+        self.undo = collections.deque(maxlen=max_undo) # (pc, last_pc, file_end, cycles, SREG, writes) of each step
+        self.step_changed = bytearray(self.dmem_length)  # dmem written by the current step
+        self.step = self.history_step
+        self.clear_history()
 
-        # If stack pointer at end or all NOPs afterwards then end
-        if (self.get_SP() == DMEM_MAX):
-            self.file_end = True
+    def clear_history(self):
+        """
+        Forgets the history, starting again from the
+        current state (eg after restore()).
+        """
 
-        elif (self.get_SP() == DMEM_MAX - 1):
-            return RETError(self.get_pc_val(), f'Invalid stack pointer to return from correctly.')
+        self.history_dmem = bytearray(self.dmem) # dmem before the current step
+        self.steps_run = 0
+        self.checkpoints = [(0, self.snapshot())] # (steps run, snapshot()), oldest first
+        self.undo.clear()
 
-        else:
-            self.increment_SP()
-            kH = self.dmem[self.get_SP()]   # return location(high) from the stack
-            self.increment_SP()
-            kL = self.dmem[self.get_SP()]   # return location(low) from the stack
-            #if self.pushpop[-1] < 0:        # must have balanced stack pushes & pops to return correctly
-            #    return RETError(self.get_pc_val(), f'{-1 * self.pushpop[-1]} too many pops from the stack to return correctly.')
-            #elif self.pushpop[-1] > 0:        # must have balanced stack pushes & pops to return correctly
-            #    return RETError(self.get_pc_val(), f'{self.pushpop[-1]} too many pushes to the stack to return correctly.')
+    def history_step(self):
+        """
+        step() that also keeps what each instruction
+        overwrote, & a snapshot every so often.
+        """
 
-            self.update_pc_val((256 * kH) + kL)
-
-    def rol_instruction(self):
-        R = self.make_8_bit_binary(self.dmem[int(self.current_inst[1][1:])].value) + str(self.sreg.value[7])
-        C = int(R[0], 2)
-        Rd = int(R[1:], 2)
-        self.dmem[int(self.current_inst[1][1:])].set_value(Rd)
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[2] = int(R[4])
-        self.sreg.value[5] = int(R[1])
-        self.sreg.value[6] = int(R[1:9] == '00000000')
-        self.sreg.value[7] = C
-        self.sreg.value[4] = self.sreg.value[5] ^ self.sreg.value[7]
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-
-    def ror_instruction(self):
-        R = str(self.sreg.value[7]) + self.make_8_bit_binary(self.dmem[int(self.current_inst[1][1:])].value)
-        C = int(R[8], 2)
-        Rd = int(R[0:8], 2)
-        self.dmem[int(self.current_inst[1][1:])].set_value(Rd)
-
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[6] = int(R[0:8] == '00000000')
-        self.sreg.value[7] = C
-        self.sreg.value[4] = self.sreg.value[5] ^ self.sreg.value[7]
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-
-    def sbc_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value # get Rr value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value # get Rd value
-        C = int(self.sreg.value[7]) # get carry bit
-        R = (Rd - Rr - C) % 256 # calculate result
-        Rd = self.make_8_bit_binary(Rd)
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R) # set result register value
-        self.update_pc_val(self.get_pc_val() + 1) # increment PC
-
-        Rr = self.make_8_bit_binary(Rr)
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[2] = int((int(R[4]) & int(Rr[4])) | (int(Rr[4]) & (1 - int(Rd[4]))) | (int(R[4]) & (1 - int(Rd[4]))))
-        self.sreg.value[4] = int((int(R[0]) & int(Rr[0]) & (1 - int(Rd[0]))) | ((1 - int(R[0])) & (1 - int(Rr[0])) & int(Rd[0])))
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-        self.sreg.value[7] = int((int(R[0]) & int(Rr[0])) | (int(Rr[0]) & (1 - int(Rd[0]))) | (int(R[0]) & (1 - int(Rd[0]))))
-
-    def sbi_instruction(self):
-        A = int(self.current_inst[1]) + 0x20
-        b = int(self.current_inst[2])
-        self.dmem[A].set_bit(b)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def sbiw_instruction(self):
-        Rdl = self.dmem[int(self.current_inst[1][1:])].value
-        Rdh = self.dmem[int(self.current_inst[1][1:]) + 1].value
-        K = int(self.current_inst[2])
-
-        R = (256 * Rdh) + Rdl
-        R = (R - K) % (256 * 256)
-        RLow = R % 256
-        RHigh = int((R - RLow)/256)
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(RLow)
-        self.dmem[int(self.current_inst[1][1:]) + 1].set_value(RHigh)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        Rdh = self.make_8_bit_binary(Rdh)
-        Rdl = self.make_8_bit_binary(Rdl)
-        R = self.make_n_bit_binary(R, 16)
-
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[6] = int(R == '0000000000000000')
-        self.sreg.value[4] = (1- int(R[0])) & int(Rdh[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[7] = (1- int(R[0])) & int(Rdh[0])
-
-    def sbr_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        K = int(self.current_inst[2])
-        R = Rd | K
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-
-    def sbrc_instruction(self):
-        Rr = self.dmem[int(self.current_inst[1][1:])].value
-        b = int(self.current_inst[2])
-
-        R = (Rr & (2**b)) == 0 # check the b-th bit of R
-
-        if R and (self.pmem[self.get_pc_val() + 2] != None): self.update_pc_val(self.get_pc_val() + 2)
-        elif R: self.update_pc_val(self.get_pc_val() + 3)
-        else: self.update_pc_val(self.get_pc_val() + 1)
-
-    def sbrs_instruction(self):
-        Rr = self.dmem[int(self.current_inst[1][1:])].value
-        b = int(self.current_inst[2])
-
-        R = (Rr & (2**b)) != 0 # check the b-th bit of R
-
-        if R and (self.pmem[self.get_pc_val() + 2] != None): self.update_pc_val(self.get_pc_val() + 2)
-        elif R: self.update_pc_val(self.get_pc_val() + 3)
-        else: self.update_pc_val(self.get_pc_val() + 1)
+        pc = self.pc
+        if self.file_end or (pc >= self.pmem_length):
+            return self.history_base_step()
 
-    def sec_instruction(self):
-        self.sreg.value[7] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
+        record = (pc, self.last_pc, self.file_end, self.cycles, self.dmem[SREG])
 
-    def seh_instruction(self):
-        self.sreg.value[2] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
+        changed = self.changed
+        self.changed = step_changed = self.step_changed # so only this step's writes are marked
+        try: output = self.history_base_step()
+        finally: self.changed = changed
 
-    def sei_instruction(self):
-        self.sreg.value[0] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
+        writes = []
+        addr = step_changed.find(1)
+        while addr != -1:
+            step_changed[addr] = 0
+            changed[addr] = 1
+            writes.append((addr, self.history_dmem[addr]))
+            self.history_dmem[addr] = self.dmem[addr]
+            addr = step_changed.find(1, addr + 1)
 
-    def sen_instruction(self):
-        self.sreg.value[5] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
+        self.history_dmem[SREG] = self.dmem[SREG]
+        self.undo.append(record + (writes,))
+        self.steps_run += 1
 
-    def ser_instruction(self):
-        self.dmem[int(self.current_inst[1][1:])].set_value(0xFF)
-        self.update_pc_val(self.get_pc_val() + 1)
+        if self.steps_run % self.checkpoint_interval == 0:
+            self.add_checkpoint()
 
-    def ses_instruction(self):
-        self.sreg.value[3] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
+        return output
 
-    def set_instruction(self):
-        self.sreg.value[1] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
+    def add_checkpoint(self):
+        if self.checkpoints[-1][0] >= self.steps_run: # already have one (eg when replaying)
+            return
 
-    def sev_instruction(self):
-        self.sreg.value[4] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
+        self.checkpoints.append((self.steps_run, self.snapshot()))
+        if len(self.checkpoints) > self.max_checkpoints: # keep the first & every other one after it
+            self.checkpoints = self.checkpoints[::2]
+            self.checkpoint_interval *= 2
 
-    def sez_instruction(self):
-        self.sreg.value[6] = 1
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def st_instruction(self):
-        XYZ = self.current_inst[1]
-        self.decrement_XYZ(XYZ) # decrements XYZ if necessary
-        val = self.get_XYZ(XYZ) # dmem value in XYZ
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        self.dmem[val] = Rr
-        self.update_pc_val(self.get_pc_val() + 1)
-        self.increment_XYZ(XYZ) # increments XYZ if necessary
-
-    def std_instruction(self):
-        XYZ = self.current_inst[1]
-        q = int(self.current_inst[2])
-        val = self.get_XYZ(XYZ) + q # dmem value in XYZ
-        Rr = self.dmem[int(self.current_inst[3][1:])].value
-        self.dmem[val] = Rr
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def sts_instruction(self):
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        self.dmem[int(self.current_inst[1])] = Rr
-        self.update_pc_val(self.get_pc_val() + 2)
-
-    def sub_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        Rr = self.dmem[int(self.current_inst[2][1:])].value
-        R = (Rd - Rr) % 256
-        Rd = self.make_8_bit_binary(Rd)
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        Rr = self.make_8_bit_binary(Rr)
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[2] = int((int(R[4]) & int(Rr[4])) | (int(Rr[4]) & (1 - int(Rd[4]))) | (int(R[4]) & (1 - int(Rd[4]))))
-        self.sreg.value[4] = int((int(R[0]) & int(Rr[0]) & (1 - int(Rd[0]))) | ((1 - int(R[0])) & (1 - int(Rr[0])) & int(Rd[0])))
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-        self.sreg.value[7] = int((int(R[0]) & int(Rr[0])) | (int(Rr[0]) & (1 - int(Rd[0]))) | (int(R[0]) & (1 - int(Rd[0]))))
-
-    def subi_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        K = int(self.current_inst[2])
-        R = (Rd - K) % 256
-        Rd = self.make_8_bit_binary(Rd)
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        K = self.make_8_bit_binary(K)
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[2] = int((int(K[4]) & int(R[4])) | (int(K[4]) & (1 - int(Rd[4]))) | (int(R[4]) & (1 - int(Rd[4]))))
-        self.sreg.value[4] = int((int(R[0]) & int(K[0]) & (1 - int(Rd[0]))) | ((1 - int(R[0])) & (1 - int(K[0])) & int(Rd[0])))
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-        self.sreg.value[7] = int((int(K[0]) & int(R[0])) | (int(K[0]) & (1 - int(Rd[0]))) | (int(R[0]) & (1 - int(Rd[0]))))
-
-    def swap_instruction(self):
-        Rd = self.make_8_bit_binary(self.dmem[int(self.current_inst[1][1:])].value)
-        Rd = Rd[4:8] + Rd[0:4]
-        self.dmem[int(self.current_inst[1][1:])].set_value(int(Rd, 2))
-        self.update_pc_val(self.get_pc_val() + 1)
-
-    def tst_instruction(self):
-        Rd = self.dmem[int(self.current_inst[1][1:])].value
-        R = Rd & Rd
-
-        self.dmem[int(self.current_inst[1][1:])].set_value(R)
-        self.update_pc_val(self.get_pc_val() + 1)
-
-        R = self.make_8_bit_binary(R)
-        self.sreg.value[4] = 0
-        self.sreg.value[5] = int(R[0])
-        self.sreg.value[3] = self.sreg.value[4] ^ self.sreg.value[5]
-        self.sreg.value[6] = int(R == '00000000')
-
-
-    def xch_instruction(self):
-        Z = self.get_XYZ('Z')
-        Rd = self.dmem[int(self.current_inst[2][1:])].value
-
-        self.dmem[int(self.current_inst[2][1:])].set_value(self.dmem[Z]) # Rd <- Z
-        self.dmem[Z] = Rd # Z <- Rd
+    def reverse_step(self, n=1):
+        """
+        Undoes the last \'n\' steps (or all of them).
+        Returns how many steps were undone.
+        """
 
-        self.update_pc_val(self.get_pc_val() + 1)
+        n = min(n, self.steps_run)
+        if n > len(self.undo): # too far back to undo, so replay from the snapshot before it
+            self.replay_to(self.steps_run - n)
+            return n
 
-    def get_S(self, N, V):
-        return int(N ^ V)
+        dmem = self.dmem
+        for i in range(n):
+            self.pc, self.last_pc, self.file_end, self.cycles, dmem[SREG], writes = self.undo.pop()
+            for addr, val in writes:
+                dmem[addr] = val
+                self.changed[addr] = 1
+                self.history_dmem[addr] = val
 
-    def get_XYZ(self, XYZ):
-        if 'X' in XYZ:
-            return (self.dmem[27].value * 256) + self.dmem[26].value
-        elif 'Y' in XYZ:
-            return (self.dmem[29].value * 256) + self.dmem[28].value
-        elif 'Z' in XYZ:
-            return (self.dmem[31].value * 256) + self.dmem[30].value
-
-    def increment_XYZ(self, XYZ):
-        regs = {'X': [26, 27], 'Y': [28, 29], 'Z': [30, 31]}
-
-        if '+' in XYZ:
-            L_idx = regs[XYZ[0]][0] # index of the low val
-            H_idx = regs[XYZ[0]][1] # index of the high val
-            L = self.dmem[L_idx].value # low val
-            H = self.dmem[H_idx].value # high val
-            if (L == 255):
-                if (H == 255):
-                    self.dmem[L_idx].set_value(0)
-                    self.dmem[H_idx].set_value(0)
-                else:
-                    self.dmem[L_idx].set_value(0)
-                    self.dmem[H_idx].set_value(H + 1)
-            else:
-                self.dmem[L_idx].set_value(L + 1)
-           
-    def decrement_XYZ(self, XYZ):
-        regs = {'X': [26, 27], 'Y': [28, 29], 'Z': [30, 31]}
-        
-        if '-' in XYZ:
-            L_idx = regs[XYZ[1]][0] # index of the low val
-            H_idx = regs[XYZ[1]][1] # index of the high val
-            L = self.dmem[L_idx].value # low val
-            H = self.dmem[H_idx].value # high val
-            if (L == 0):
-                if (H == 0):
-                    self.dmem[L_idx].set_value(255)
-                    self.dmem[H_idx].set_value(255)
-                else:
-                    self.dmem[L_idx].set_value(255)
-                    self.dmem[H_idx].set_value(H - 1)
-            else:
-                self.dmem[L_idx].set_value(L - 1) 
+        self.history_dmem[SREG] = dmem[SREG]
+        self.steps_run -= n
+        return n
 
-    def increment_SP(self):
-        L = (self.dmem_length - 1) % 256
-        H = int((self.dmem_length - (L)) / 256)
-        if (self.spl.value == 255):
-            if (self.sph.value == H):
-                self.spl.set_value(0)
-                self.sph.set_value(0)
-            else:
-                self.spl.set_value(0)
-                self.sph.set_value(self.sph.value + 1)
-        else:
-            self.spl.set_value(self.spl.value + 1)
+    def add_breakpoint(self, where, condition=None):
+        """
+        Stops runs before the instruction at \'where\' (a PMEM
+        address or label) when \'condition\' is true, if given.
+        Conditions are Python expressions of R0-R31, X, Y,
+        Z, SP, SREG & the FLAG_ masks, eg 'R16 == 3 and
+        X > 0x100' or 'SREG & FLAG_Z'.
+        """
 
-    def decrement_SP(self):
-        L = (self.dmem_length - 1) % 256
-        H = int((self.dmem_length - (L)) / 256)
-        if (self.spl.value == 0):
-            if (self.sph.value == 0):
-                self.spl.set_value(255)
-                self.sph.set_value(H)
-            else:
-                self.spl.set_value(255)
-                self.sph.set_value(self.sph.value - 1)
-        else:
-            self.spl.set_value(self.spl.value - 1)
+        pc = self.find_location(where)
+        if condition:
+            tree = ast.parse(condition, '<breakpoint>', 'eval')
+            for node in ast.walk(tree): # checked now rather than failing part way through a run
+                if not isinstance(node, CONDITION_NODES) or (isinstance(node, ast.Constant) and not isinstance(node.value, int)):
+                    raise ValueError(f'Cannot use \'{ast.get_source_segment(condition, node) or type(node).__name__}\' in a breakpoint condition, only names, numbers & operators')
+                if isinstance(node, ast.Name) and (node.id not in REGISTER_FILE) and (node.id not in CONDITION_NAMES):
+                    raise ValueError(f'Cannot use \'{node.id}\' in a breakpoint condition, only R0-R31, X, Y, Z, SP, SREG & FLAG_C etc')
+            condition = compile(tree, '<breakpoint>', 'eval')
+        self.breakpoints[pc] = condition or None
+        self.update_debug_step()
+        return pc
+
+    def remove_breakpoint(self, where):
+        self.breakpoints.pop(self.find_location(where), None)
+        self.update_debug_step()
+
+    def add_watchpoint(self, where):
+        """
+        Stops runs after an instruction changes the value at
+        \'where\' (a register name like 'R16' or a dmem address).
+        """
 
-    def get_SP(self):
-        return (256 * self.sph.value) + self.spl.value
+        if isinstance(where, str) and (where.upper() in REGISTER_FILE):
+            addr = REGISTER_FILE.index(where.upper())
+        else:
+            addr = int(where, 0) if isinstance(where, str) else where
 
-    def make_8_bit_binary(self, integer):
-        b = bin(integer)[2:]
-        while len(b) < 8:
-            b = '0' + b
-        return b
+        if not (0 <= addr < self.dmem_length):
+            raise ValueError(f'Cannot watch address {where}, RAM ends at {hex(self.dmem_length - 1)}')
 
-    def update_pc_val(self, new_val):
-        pos_start = self.pos.copy()
-        if self.pcl.name != 'PCL': return UnexpectedValue(pos_start, self.pos, "Incorrect PC(low) location")
-        if self.pch.name != 'PCH': return UnexpectedValue(pos_start, self.pos, "Incorrect PC(high) location")
-        low_val = new_val % 256
-        high_val = int((new_val - low_val) / 256)
-        self.pcl.set_value(low_val)
-        self.pch.set_value(high_val)
+        if addr not in self.watchpoints:
+            self.watchpoints.append(addr)
+        self.update_debug_step()
+        return addr
 
-    def get_pc_val(self):
-        pos_start = self.pos.copy()
-        if self.pcl.name != 'PCL': return UnexpectedValue(pos_start, self.pos, "Incorrect PC(low) location")
-        if self.pch.name != 'PCH': return UnexpectedValue(pos_start, self.pos, "Incorrect PC(high) location")
-        return (256 * self.pch.value) + self.pcl.value
+    def remove_watchpoint(self, addr):
+        if addr in self.watchpoints:
+            self.watchpoints.remove(addr)
+        self.update_debug_step()
 
-    def make_n_bit_binary(self, integer, n: int):
+    def find_location(self, where):
         """
-        Returns binary value of length \'n\' without
-        the \'0b\' at the front.
+        Turns a label or address (int or string)
+        into a PMEM address.
         """
 
-        b = bin(int(integer))[2:]
-        l = len(b)
+        if isinstance(where, str):
+            if where in self.labels:
+                return self.labels[where]
+            try: where = int(where, 0)
+            except ValueError:
+                raise ValueError(f'Cannot find label \'{where}\' in this file')
 
-        if l > n: return b[0:n+1]
-        
-        while l < n: # extending the length
-            b = '0' + b
-            l += 1
-        return b
+        if not (0 <= where < self.pmem_length):
+            raise ValueError(f'Cannot break at {where}, program memory ends at {self.pmem_length - 1}')
+        return where
 
-    def twos_comp(self, val, bits):
+    def update_debug_step(self):
         """
-        Returns the 2's comp of a value for
-        a given number of bits.
+        Swaps in debug_step() only while there are breakpoints
+        or watchpoints, so runs without them don't pay for the checks.
         """
 
-        if val >= 0:
-            return '0' + self.make_n_bit_binary(val, bits - 1)
-        
-        b = bin((2 ** (bits - 1)) + val)[2:]    # flip bits and add 1
-        
-        l = len(b)
-        while l < bits - 1:
-            b = '0' + b
-            l += 1
-        b = '1' + b
-        return b
+        debugging = bool(self.breakpoints or self.watchpoints)
+        if debugging and (self.step != self.debug_step):
+            self.debug_base_step = self.step
+            self.step = self.debug_step
+        elif (not debugging) and (self.step == self.debug_step):
+            self.step = self.debug_base_step
 
-    def get_binary_instruction(self, instruction: list):
+    def debug_step(self):
         """
-        Returns string or list of strings.
+        step() that returns a BreakpointHit once the PC reaches
+        a breakpoint or a watched address changes value.
         """
-        inst = instruction[0]
 
-        if inst == 'ADC':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'000111{r[0]}{d}{r[1:]}'
+        dmem = self.dmem
+        watched = [(addr, dmem[addr]) for addr in self.watchpoints]
 
-        elif inst == 'ADD':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'000011{r[0]}{d}{r[1:]}'
-        
-        elif inst == 'ADIW':
-            d = self.make_n_bit_binary(int((int(instruction[1][1:]) - 24)/2), 2) # reg number converted to binary
-            K = self.make_n_bit_binary(instruction[2], 6) # reg number converted to binary
-            return f'10010110{K[0:2]}{d}{K[2:]}'
-
-        elif inst == 'AND':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'001000{r[0]}{d}{r[1:]}'
-        
-        elif inst == 'ANDI':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            K = self.make_n_bit_binary(instruction[2], 8) # reg number converted to binary
-            return f'0111{K[0:4]}{d[1:]}{K[4:]}'
-
-        elif inst == 'ASR':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001010{d}0101'
-
-        elif inst == 'BCLR':
-            s = self.make_n_bit_binary(instruction[1], 3)
-            return f'100101001{s}1000'
-
-        elif inst == 'BRBC':
-            s = self.make_n_bit_binary(instruction[1], 3)
-            k = self.twos_comp(instruction[2], 7)
-            return f'111101{k}{s}'
-
-        elif inst == 'BRBS':
-            s = self.make_n_bit_binary(instruction[1], 3)
-            k = self.twos_comp(instruction[2], 7)
-            return f'111100{k}{s}'
-
-        elif inst == 'BRCC':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}000'
-
-        elif inst == 'BRCS':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}000'
-
-        elif inst == 'BREQ':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}001'
-
-        elif inst == 'BRGE':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}100'
-
-        elif inst == 'BRHC':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}101'
-
-        elif inst == 'BRHS':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}101'
-
-        elif inst == 'BRID':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}111'
-
-        elif inst == 'BRIE':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}111'
-
-        elif inst == 'BRLO':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}000'
-
-        elif inst == 'BRLT':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}100'
-
-        elif inst == 'BRMI':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}010'
-
-        elif inst == 'BRNE':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}001'
-
-        elif inst == 'BRPL':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}010'
-            
-        elif inst == 'BRSH':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}000'
+        output = self.debug_base_step()
+        if output:
+            return output
 
-        elif inst == 'BRTC':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}110'
+        for addr, val in watched:
+            if dmem[addr] != val:
+                name = REGISTER_FILE[addr] if addr < 32 else hex(addr)
+                return BreakpointHit(self.last_pc, f'{name} changed from {val} to {dmem[addr]}')
 
-        elif inst == 'BRTS':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}110'
+        if self.pc in self.breakpoints:
+            return self.breakpoint_hit()
 
-        elif inst == 'BRVC':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111101{k}011'
+    def breakpoint_hit(self):
+        """
+        Returns a BreakpointHit if the PC is at a breakpoint
+        whose condition (if it has one) is true, a ConditionError
+        if the condition fails (eg dividing by zero), otherwise None.
+        """
 
-        elif inst == 'BRVS':
-            k = self.twos_comp(instruction[1], 7)
-            return f'111100{k}011'
+        if self.pc not in self.breakpoints:
+            return None
 
-        elif inst == 'BSET':
-            s = self.make_n_bit_binary(instruction[1], 3)
-            return f'100101000{s}1000'
+        condition = self.breakpoints[self.pc]
+        if condition is None:
+            return BreakpointHit(self.pc, 'reached')
 
-        elif inst == 'CALL':
-            if instruction[1] == 'PRINTF':
-                return ['1001010111111111', '1111111111111111']
-            else:
-                k = self.make_n_bit_binary(instruction[1], 22)
-                return [f'1001010{k[0:5]}111{k[5]}', k[6:]]
+        try:
+            if self.condition_true(condition):
+                return BreakpointHit(self.pc, 'condition is true')
+        except (ArithmeticError, ValueError) as e: # eg R16 % R17 with R17 = 0, or a negative shift
+            return ConditionError(self.pc, f'{e}')
 
-        elif inst == 'CBI':
-            A = self.make_n_bit_binary(instruction[1], 5)
-            b = self.make_n_bit_binary(instruction[2], 3)
-            return f'10011000{A}{b}'
+    def at_breakpoint(self):
+        """
+        Returns whether the PC is at a breakpoint whose
+        condition (if it has one) is true, or fails.
+        """
 
-        elif inst == 'CBR':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            K = self.make_n_bit_binary(255 - instruction[2], 8) # reg number converted to binary
-            return f'0111{K[0:4]}{d[1:]}{K[4:]}'
+        return self.breakpoint_hit() is not None
 
-        elif inst == 'CLC':
-            return '1001010010001000'
+    def condition_true(self, condition):
+        """
+        Evaluates a compiled breakpoint condition
+        against the registers, pointers, SP & SREG.
+        """
 
-        elif inst == 'CLH':
-            return '1001010011011000'
-            
-        elif inst == 'CLI':
-            return '1001010011111000'
-
-        elif inst == 'CLN':
-            return '1001010010101000'
-
-        elif inst == 'CLR':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'001001{d[0]}{d}{d[1:]}'
-
-        elif inst == 'CLS':
-            return '1001010011001000'
-
-        elif inst == 'CLT':
-            return '1001010011101000'
-
-        elif inst == 'CLV':
-            return '1001010010111000'
-
-        elif inst == 'CLZ':
-            return '1001010010011000'
-
-        elif inst == 'COM':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001010{d}0000'
-
-        elif inst == 'CP':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'000101{r[0]}{d}{r[1:]}'
-
-        elif inst == 'CPC':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'000001{r[0]}{d}{r[1:]}'
-
-        elif inst == 'CPI':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            K = self.make_n_bit_binary(instruction[2], 8) # reg number converted to binary
-            return f'0011{K[0:4]}{d[1:]}{K[4:]}'
-
-        elif inst == 'DEC':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001010{d}1010'
-
-        elif inst == 'EOR':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'001001{r[0]}{d}{r[1:]}'
-
-        elif inst == 'IN':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            A = self.make_n_bit_binary(instruction[2], 6) # reg number converted to binary
-            return f'10110{A[0:2]}{d}{A[2:]}'
-
-        elif inst == 'INC':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001010{d}0011'
-
-        elif inst == 'JMP':
-            k = self.make_n_bit_binary(instruction[1], 22)
-            return [f'1001010{k[0:5]}110{k[5]}', k[6:]]
-
-        elif inst == 'LD':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            if instruction[2] == 'X':
-                return f'1001000{d}1100'
-            elif instruction[2] == 'X+':
-                return f'1001000{d}1101'
-            elif instruction[2] == '-X':
-                return f'1001000{d}1110'
-            elif instruction[2] == 'Y':
-                return f'1000000{d}1000'
-            elif instruction[2] == 'Y+':
-                return f'1001000{d}1001'
-            elif instruction[2] == '-Y':
-                return f'1001000{d}1010'
-            elif instruction[2] == 'Z':
-                return f'1000000{d}0000'
-            elif instruction[2] == 'Z+':
-                return f'1001000{d}0001'
-            elif instruction[2] == '-Z':
-                return f'1001000{d}0010'
-        
-        elif inst == 'LDD':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            q = self.make_n_bit_binary(instruction[3], 6) # reg number converted to binary
-            if instruction[2] == 'Y+':
-                return f'10{q[0]}0{q[1:3]}0{d}1{q[3:]}'
-            elif instruction[2] == 'Z+':
-                return f'10{q[0]}0{q[1:3]}0{d}0{q[3:]}'
-        
-        elif inst == 'LDI':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            K = self.make_n_bit_binary(instruction[2], 8) # reg number converted to binary
-            return f'1110{K[0:4]}{d[1:]}{K[4:]}'
-        
-        elif inst == 'LDS':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            k = self.make_n_bit_binary(instruction[2], 16) # reg number converted to binary
-            return [f'1001000{d}0000', k]
-        
-        elif inst == 'LSL':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'000011{d[0]}{d}{d[1:]}'
-
-        elif inst == 'LSR':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001010{d}0110'
-
-        elif inst == 'MOV':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'001011{r[0]}{d}{r[1:]}'
-
-        elif inst == 'MOVW':
-            d = int(instruction[1][1:])
-            r = int(instruction[2][1:])
-            d = self.make_n_bit_binary(d, 5) # reg number converted to binary
-            r = self.make_n_bit_binary(r, 5) # reg number converted to binary
-            return f'00000001{d[:4]}{r[:4]}'
-        
-        elif inst == 'MUL':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'100111{r[0]}{d}{r[1:]}'
-
-        elif inst == 'MULS':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'00000010{d[1:]}{r[1:]}'
-
-        elif inst == 'MULSU':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'000000110{d[2:]}0{r[2:]}'
-
-        elif inst == 'NEG':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001010{d}0001'
-
-        elif inst == 'NOP':
-            return '0000000000000000'
-        
-        elif inst == 'OR':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'001010{r[0]}{d}{r[1:]}'
-
-        elif inst == 'ORI':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            K = self.make_n_bit_binary(instruction[2], 8) # reg number converted to binary
-            return f'0110{K[0:4]}{d[1:]}{K[4:]}'
-
-        elif inst == 'OUT':
-            A = self.make_n_bit_binary(instruction[1], 6) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'10111{A[0:2]}{r}{A[2:]}'
-
-        elif inst == 'POP':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001000{d}1111'
-
-        elif inst == 'PUSH':
-            r = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001001{r}1111'
-
-        elif inst == 'RET':
-            return '1001010100001000'
-        
-        elif inst == 'RJMP':
-            k = self.twos_comp(instruction[1], 12)
-            return f'1100{k}'
-
-        elif inst == 'ROL':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'000111{d[0]}{d}{d[1:]}'
-
-        elif inst == 'ROR':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001010{d}0111'
-
-        elif inst == 'SBC':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'000010{r[0]}{d}{r[1:]}'
-
-        elif inst == 'SBI':
-            A = self.make_n_bit_binary(instruction[1], 5)
-            b = self.make_n_bit_binary(instruction[2], 3)
-            return f'10011010{A}{b}'
-
-        elif inst == 'SBIW':
-            d = self.make_n_bit_binary(int((int(instruction[1][1:]) - 24)/2), 2) # reg number converted to binary
-            K = self.make_n_bit_binary(instruction[2], 6) # reg number converted to binary
-            return f'10010111{K[0:2]}{d}{K[2:]}'
-
-        elif inst == 'SBR':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            K = self.make_n_bit_binary(instruction[2], 8) # reg number converted to binary
-            return f'0110{K[0:4]}{d[1:]}{K[4:]}'
-
-        elif inst == 'SBRC':
-            r = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            b = self.make_n_bit_binary(instruction[2], 3)
-            return f'1111110{r}0{b}'
-
-        elif inst == 'SBRS':
-            r = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            b = self.make_n_bit_binary(instruction[2], 3)
-            return f'1111111{r}0{b}'
-
-        elif inst == 'SEC':
-            return '1001010000001000'
-
-        elif inst == 'SEH':
-            return '1001010001011000'
-
-        elif inst == 'SEI':
-            return '1001010001111000'
-
-        elif inst == 'SEN':
-            return '1001010000101000'
-
-        elif inst == 'SER':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'11101111{d[1:]}1111'
-
-        elif inst == 'SES':
-            return '1001010001001000'
-
-        elif inst == 'SET':
-            return '1001010001101000'
-
-        elif inst == 'SEV':
-            return '1001010000111000'
-
-        elif inst == 'SEZ':
-            return '1001010000011000'
-
-        elif inst == 'ST':
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            if instruction[1] == 'X':
-                return f'1001001{r}1100'
-            elif instruction[1] == 'X+':
-                return f'1001001{r}1101'
-            elif instruction[1] == '-X':
-                return f'1001001{r}1110'
-            elif instruction[1] == 'Y':
-                return f'1000001{r}1000'
-            elif instruction[1] == 'Y+':
-                return f'1001001{r}1001'
-            elif instruction[1] == '-Y':
-                return f'1001001{r}1010'
-            elif instruction[1] == 'Z':
-                return f'1000001{r}0000'
-            elif instruction[1] == 'Z+':
-                return f'1001001{r}0001'
-            elif instruction[1] == '-Z':
-                return f'1001001{r}0010'
-
-        elif inst == 'STD':
-            r = self.make_n_bit_binary(instruction[3][1:], 5) # reg number converted to binary
-            q = self.make_n_bit_binary(instruction[2], 6) # reg number converted to binary
-            if instruction[1] == 'Y+':
-                return f'10{q[0]}0{q[1:3]}1{r}1{q[3:]}'
-            elif instruction[1] == 'Z+':
-                return f'10{q[0]}0{q[1:3]}1{r}0{q[3:]}'
-
-        elif inst == 'STS':
-            k = self.make_n_bit_binary(instruction[1], 16) # reg number converted to binary
-            d = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return [f'1001001{d}0000', k]
-
-        elif inst == 'SUB':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            r = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'000110{r[0]}{d}{r[1:]}'
-
-        elif inst == 'SUBI':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            K = self.make_n_bit_binary(instruction[2], 8) # reg number converted to binary
-            return f'0101{K[0:4]}{d[1:]}{K[4:]}'
-
-        elif inst == 'SWAP':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'1001010{d}0010'
-
-        elif inst == 'TST':
-            d = self.make_n_bit_binary(instruction[1][1:], 5) # reg number converted to binary
-            return f'001000{d[0]}{d}{d[1:]}'
-
-        elif inst == 'XCH':
-            d = self.make_n_bit_binary(instruction[2][1:], 5) # reg number converted to binary
-            return f'1001001{d}0100'
+        dmem = self.dmem
+        names = {name: dmem[i] for i, name in enumerate(REGISTER_FILE)}
+        names.update({'X': self.get_pointer(26), 'Y': self.get_pointer(28), 'Z': self.get_pointer(30), 'SP': self.get_SP(), 'SREG': dmem[SREG]})
+        names.update(CONDITION_FLAGS)
+        return bool(eval(condition, {'__builtins__': {}}, names))
 
+    def reverse_continue(self, stop=None):
+        """
+        Steps backwards until stop(interpreter) is true
+        or the start is reached. Returns the steps undone.
+        """
 
-##################################################################################################################
+        undone = 0
+        while self.reverse_step(1):
+            undone += 1
+            if (stop is not None) and stop(self):
+                break
+        return undone
+
+    def replay_to(self, steps):
+        """
+        Restores the last snapshot before \'steps\' and
+        runs forward to it, with PRINTF output dropped.
+        """
+
+        while self.checkpoints[-1][0] > steps:
+            self.checkpoints.pop()
+
+        self.steps_run, state = self.checkpoints[-1]
+        self.restore(state)
+        self.history_dmem[:] = self.dmem
+        self.undo.clear()
+
+        sinks = self.output.sinks
+        self.output.sinks = [] # it was already printed the first time
+        try:
+            while self.steps_run < steps:
+                self.step()
+            self.output.flush()
+        finally:
+            self.output.sinks = sinks
+
+
+    def adc_instruction(self, d, r):
+        Rd = self.dmem[d] # get Rd value
+        Rr = self.dmem[r] # get Rr value
+        C = self.dmem[SREG] & FLAG_C # get carry bit
+
+        self.dmem[d] = (Rd + Rr + C) & 0xFF # set result register value
+        self.changed[d] = 1
+        self.pc += 1 # increment PC
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | ADD_FLAGS[(C << 16) | (Rd << 8) | Rr]
+
+    def add_instruction(self, d, r):
+        Rd = self.dmem[d]
+        Rr = self.dmem[r]
+
+        self.dmem[d] = (Rd + Rr) & 0xFF
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | ADD_FLAGS[(Rd << 8) | Rr]
+
+    def adiw_instruction(self, d, K):
+        Rdl = self.dmem[d]
+        Rdh = self.dmem[d + 1]
+
+        R = (((Rdh << 8) | Rdl) + K) & 0xFFFF
+
+        self.dmem[d] = R & 0xFF
+        self.changed[d] = 1
+        self.dmem[d + 1] = R >> 8
+        self.changed[d + 1] = 1
+        self.pc += 1
+
+        N = R >> 15
+        V = N & (1 - (Rdh >> 7))
+        C = (1 - N) & (Rdh >> 7)
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE0) | ((N ^ V) << 4) | (V << 3) | (N << 2) | ((R == 0) << 1) | C
+
+    def and_instruction(self, d, r):
+        R = self.dmem[d] & self.dmem[r]
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | LOGIC_FLAGS[R]
+
+    def andi_instruction(self, d, K):
+        R = self.dmem[d] & K
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | LOGIC_FLAGS[R]
+
+    def asr_instruction(self, d):
+        Rd = self.dmem[d]
+        C = Rd & 1
+        R = (Rd >> 1) | (Rd & 0x80)
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        N = R >> 7
+        V = N ^ C
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE0) | ((V ^ N) << 4) | (V << 3) | (N << 2) | ((R == 0) << 1) | C
+
+    def bclr_instruction(self, s):
+        self.dmem[SREG] &= ~(1 << s)
+        self.pc += 1
+
+    def brbc_instruction(self, s, k):
+        if not (self.dmem[SREG] & (1 << s)):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brbs_instruction(self, s, k):
+        if self.dmem[SREG] & (1 << s):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brcc_instruction(self, k):
+        if not (self.dmem[SREG] & FLAG_C):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brcs_instruction(self, k):
+        if self.dmem[SREG] & FLAG_C:
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def breq_instruction(self, k):
+        if self.dmem[SREG] & FLAG_Z:
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brge_instruction(self, k):
+        if self.get_flag(FLAG_N) == self.get_flag(FLAG_V):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brhc_instruction(self, k):
+        if not (self.dmem[SREG] & FLAG_H):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brhs_instruction(self, k):
+        if self.dmem[SREG] & FLAG_H:
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brid_instruction(self, k):
+        if not (self.dmem[SREG] & FLAG_I):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brie_instruction(self, k):
+        if self.dmem[SREG] & FLAG_I:
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brlo_instruction(self, k):
+        if self.dmem[SREG] & FLAG_C:
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brlt_instruction(self, k):
+        if self.get_flag(FLAG_N) != self.get_flag(FLAG_V):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brmi_instruction(self, k):
+        if self.dmem[SREG] & FLAG_N:
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brne_instruction(self, k):
+        if not (self.dmem[SREG] & FLAG_Z):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brpl_instruction(self, k):
+        if not (self.dmem[SREG] & FLAG_N):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brsh_instruction(self, k):
+        if not (self.dmem[SREG] & FLAG_C):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brtc_instruction(self, k):
+        if not (self.dmem[SREG] & FLAG_T):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brts_instruction(self, k):
+        if self.dmem[SREG] & FLAG_T:
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brvc_instruction(self, k):
+        if not (self.dmem[SREG] & FLAG_V):
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def brvs_instruction(self, k):
+        if self.dmem[SREG] & FLAG_V:
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 1
+
+    def bset_instruction(self, s):
+        self.dmem[SREG] |= (1 << s)
+        self.pc += 1
+
+    def call_instruction(self, k):
+        ret = self.pc + 2 # return location
+        sp = self.get_SP()
+        self.dmem[sp] = ret % 256 # adding to stack
+        self.changed[sp] = 1
+        self.decrement_SP()
+        sp = self.get_SP()
+        self.dmem[sp] = ret // 256 # adding to stack
+        self.changed[sp] = 1
+        self.decrement_SP()
+        self.pc = k
+
+    def printf_function(self):
+        self.pc += 2
+
+        ### Pop
+        self.increment_SP()
+        self.dmem[26] = self.dmem[self.get_SP()]  # R26 = lo8()
+        self.changed[26] = 1
+
+        self.increment_SP()
+        self.dmem[27] = self.dmem[self.get_SP()] # R27 = hi8()
+        self.changed[27] = 1
+
+        ### Print
+        start = self.get_pointer(26) # dmem value in X
+        end = self.dmem.find(0, start) # the NULL at the end of the string
+        if end == -1:
+            raise IndexError('PRINTF string runs past the end of RAM')
+
+        self.output.write(self.dmem[start:end].decode('latin-1'))
+        # self.output.write('\n') -> could be used to add \n to end of each line
+
+        X = (end + 1) & 0xFFFF # X+ for every character & the NULL
+        self.dmem[26] = X & 0xFF
+        self.dmem[27] = X >> 8
+
+        ### Push
+        sp = self.get_SP()
+        self.dmem[sp] = self.dmem[27]
+        self.changed[sp] = 1
+        self.decrement_SP()
+        #self.dmem[27] = Xhigh # reset the value of R27 to what it was so it isnt disturbed
+
+        sp = self.get_SP()
+        self.dmem[sp] = self.dmem[26]
+        self.changed[sp] = 1
+        self.decrement_SP()
+        #self.dmem[26] = Xlow # reset the value of R26 to what it was so it isnt disturbed
+
+    def cbi_instruction(self, A, b):
+        self.dmem[A] &= ~(1 << b)
+        self.changed[A] = 1
+        self.pc += 1
+
+    def cbr_instruction(self, d, K):
+        R = self.dmem[d] & (0xFF - K)
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | LOGIC_FLAGS[R]
+
+    def clc_instruction(self):
+        self.dmem[SREG] &= ~FLAG_C
+        self.pc += 1
+
+    def clh_instruction(self):
+        self.dmem[SREG] &= ~FLAG_H
+        self.pc += 1
+
+    def cli_instruction(self):
+        self.dmem[SREG] &= ~FLAG_I
+        self.pc += 1
+
+    def cln_instruction(self):
+        self.dmem[SREG] &= ~FLAG_N
+        self.pc += 1
+
+    def clr_instruction(self, d):
+        self.dmem[d] = 0
+        self.changed[d] = 1
+        self.pc += 1
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | FLAG_Z
+
+    def cls_instruction(self):
+        self.dmem[SREG] &= ~FLAG_S
+        self.pc += 1
+
+    def clt_instruction(self):
+        self.dmem[SREG] &= ~FLAG_T
+        self.pc += 1
+
+    def clv_instruction(self):
+        self.dmem[SREG] &= ~FLAG_V
+        self.pc += 1
+
+    def clz_instruction(self):
+        self.dmem[SREG] &= ~FLAG_Z
+        self.pc += 1
+
+    def com_instruction(self, d):
+        R = 0xFF - self.dmem[d]
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE0) | LOGIC_FLAGS[R] | FLAG_C
+
+    def cp_instruction(self, d, r):
+        Rd = self.dmem[d]
+        Rr = self.dmem[r]
+
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | SUB_FLAGS[(Rd << 8) | Rr]
+
+    def cpc_instruction(self, d, r):
+        Rd = self.dmem[d]
+        Rr = self.dmem[r]
+        C = self.dmem[SREG] & FLAG_C
+
+        self.pc += 1
+
+        flags = SUB_FLAGS[(C << 16) | (Rd << 8) | Rr]
+        flags &= ~FLAG_Z | self.dmem[SREG] # Z only stays set if it was already set
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | flags
+
+    def cpi_instruction(self, d, K):
+        Rd = self.dmem[d]
+
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | SUB_FLAGS[(Rd << 8) | K]
+
+    def dec_instruction(self, d):
+        R = (self.dmem[d] - 1) & 0xFF
+        self.dmem[d] = R
+        self.changed[d] = 1
+
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | DEC_FLAGS[R]
+
+    def eor_instruction(self, d, r):
+        R = self.dmem[d] ^ self.dmem[r]
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | LOGIC_FLAGS[R]
+
+    def in_instruction(self, d, A):
+        self.dmem[d] = self.dmem[A]
+        self.changed[d] = 1
+        self.pc += 1
+
+    def inc_instruction(self, d):
+        R = (self.dmem[d] + 1) & 0xFF
+        self.dmem[d] = R
+        self.changed[d] = 1
+
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | INC_FLAGS[R]
+
+    def jmp_instruction(self, k):
+        self.pc = k
+
+    def ld_instruction(self, d, p, mode):
+        if mode == -1: self.decrement_pointer(p) # -X, -Y, -Z
+        K = self.dmem[self.get_pointer(p)]
+        self.dmem[d] = K
+        self.changed[d] = 1
+        self.pc += 1
+        if mode == 1: self.increment_pointer(p) # X+, Y+, Z+
+
+    def ldd_instruction(self, d, p, q):
+        K = self.dmem[self.get_pointer(p) + q]
+        self.dmem[d] = K
+        self.changed[d] = 1
+        self.pc += 1
+
+    def ldi_instruction(self, d, K):
+        self.dmem[d] = K
+        self.changed[d] = 1
+        self.pc += 1
+
+    def lds_instruction(self, d, k):
+        self.dmem[d] = self.dmem[k]
+        self.changed[d] = 1
+        self.pc += 2
+
+    def lsl_instruction(self, d):
+        Rd = self.dmem[d]
+        self.dmem[d] = (Rd << 1) & 0xFF
+        self.changed[d] = 1
+
+        self.pc += 1
+
+        # N & Z are taken from Rd, so V = N ^ C is always 0
+        H = (Rd >> 3) & 1
+        N = Rd >> 7
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | (H << 5) | (N << 4) | (N << 2) | ((Rd == 0) << 1) | N
+
+    def lsr_instruction(self, d):
+        Rd = self.dmem[d]
+        C = Rd & 1
+        R = Rd >> 1
+        self.dmem[d] = R
+        self.changed[d] = 1
+
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE0) | (C << 4) | (C << 3) | ((R == 0) << 1) | C
+
+    def mov_instruction(self, d, r):
+        self.dmem[d] = self.dmem[r]
+        self.changed[d] = 1
+        self.pc += 1
+
+    def movw_instruction(self, d, r):
+        Rrl = self.dmem[r]
+        Rrh = self.dmem[r + 1]
+
+        self.dmem[d] = Rrl
+        self.changed[d] = 1
+        self.dmem[d + 1] = Rrh
+        self.changed[d + 1] = 1
+        self.pc += 1
+
+    def mul_instruction(self, d, r):
+        R = self.dmem[d] * self.dmem[r]
+
+        self.dmem[0] = R & 0xFF
+        self.changed[0] = 1
+        self.dmem[1] = R >> 8
+        self.changed[1] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xFC) | ((R == 0) << 1) | (R >> 15)
+
+    def muls_instruction(self, d, r):
+        R = self.dmem[d] * self.dmem[r]
+
+        self.dmem[0] = R & 0xFF
+        self.changed[0] = 1
+        self.dmem[1] = R >> 8
+        self.changed[1] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xFC) | ((R == 0) << 1) | (R >> 15)
+
+    def mulsu_instruction(self, d, r):
+        R = self.dmem[d] * self.dmem[r]
+
+        self.dmem[0] = R & 0xFF
+        self.changed[0] = 1
+        self.dmem[1] = R >> 8
+        self.changed[1] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xFC) | ((R == 0) << 1) | (R >> 15)
+
+    def neg_instruction(self, d):
+        Rd = self.dmem[d]
+        R = (0x00 - Rd) & 0xFF
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        H = ((R >> 3) | (1 - ((Rd >> 3) & 1))) & 1
+        V = int(R == 0x80)
+        N = R >> 7
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC1) | (H << 5) | ((V ^ N) << 4) | (V << 3) | (N << 2) | ((R != 0) << 1)
+
+    def nop_instruction(self):
+        self.pc += 1
+
+    def or_instruction(self, d, r):
+        R = self.dmem[d] | self.dmem[r]
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | LOGIC_FLAGS[R]
+
+    def ori_instruction(self, d, K):
+        R = self.dmem[d] | K
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | LOGIC_FLAGS[R]
+
+    def out_instruction(self, A, r):
+        self.dmem[A] = self.dmem[r]
+        self.changed[A] = 1
+        self.pc += 1
+
+    def pop_instruction(self, d):
+
+        if self.get_SP() < DMEM_MAX: # check if the top layer has no elements left (ie nothing left in stack)
+            self.increment_SP()
+            STACK = self.dmem[self.get_SP()]
+            self.dmem[d] = STACK
+            self.changed[d] = 1
+            self.pc += 1
+        else:
+            return RETError(self.pc, 'No elements left to pop.')
+
+    def push_instruction(self, r):
+        sp = self.get_SP()
+        if sp < 0x100:
+            return StackOverflowError(self.pc, f'Cannot push another element to the stack.')
+
+        self.dmem[sp] = self.dmem[r]
+        self.changed[sp] = 1
+        self.decrement_SP()
+        self.pc += 1
+
+    def rjmp_instruction(self, k):
+        self.pc = k
+
+    def ret_instruction(self):
+
+        # If stack pointer at end or all NOPs afterwards then end
+        if (self.get_SP() == DMEM_MAX):
+            self.file_end = True
+
+        elif (self.get_SP() == DMEM_MAX - 1):
+            return RETError(self.pc, f'Invalid stack pointer to return from correctly.')
+
+        else:
+            self.increment_SP()
+            kH = self.dmem[self.get_SP()]   # return location(high) from the stack
+            self.increment_SP()
+            kL = self.dmem[self.get_SP()]   # return location(low) from the stack
+            #if self.pushpop[-1] < 0:        # must have balanced stack pushes & pops to return correctly
+            #    return RETError(self.get_pc_val(), f'{-1 * self.pushpop[-1]} too many pops from the stack to return correctly.')
+            #elif self.pushpop[-1] > 0:        # must have balanced stack pushes & pops to return correctly
+            #    return RETError(self.get_pc_val(), f'{self.pushpop[-1]} too many pushes to the stack to return correctly.')
+
+            self.pc = (256 * kH) + kL
+
+    def rol_instruction(self, d):
+        Rd = self.dmem[d]
+        R = ((Rd << 1) | (self.dmem[SREG] & FLAG_C)) & 0xFF
+        self.dmem[d] = R
+        self.changed[d] = 1
+
+        self.pc += 1
+
+        H = (Rd >> 3) & 1
+        N = R >> 7
+        C = Rd >> 7
+        V = N ^ C
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | (H << 5) | ((V ^ N) << 4) | (V << 3) | (N << 2) | ((R == 0) << 1) | C
+
+    def ror_instruction(self, d):
+        Rd = self.dmem[d]
+        N = self.dmem[SREG] & FLAG_C # old carry becomes bit 7
+        R = (N << 7) | (Rd >> 1)
+        self.dmem[d] = R
+        self.changed[d] = 1
+
+        self.pc += 1
+
+        C = Rd & 1
+        V = N ^ C
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE0) | ((V ^ N) << 4) | (V << 3) | (N << 2) | ((R == 0) << 1) | C
+
+    def sbc_instruction(self, d, r):
+        Rd = self.dmem[d] # get Rd value
+        Rr = self.dmem[r] # get Rr value
+        C = self.dmem[SREG] & FLAG_C # get carry bit
+
+        self.dmem[d] = (Rd - Rr - C) & 0xFF # set result register value
+        self.changed[d] = 1
+        self.pc += 1 # increment PC
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | SUB_FLAGS[(C << 16) | (Rd << 8) | Rr]
+
+    def sbi_instruction(self, A, b):
+        self.dmem[A] |= (1 << b)
+        self.changed[A] = 1
+        self.pc += 1
+
+    def sbiw_instruction(self, d, K):
+        Rdl = self.dmem[d]
+        Rdh = self.dmem[d + 1]
+
+        R = (((Rdh << 8) | Rdl) - K) & 0xFFFF
+
+        self.dmem[d] = R & 0xFF
+        self.changed[d] = 1
+        self.dmem[d + 1] = R >> 8
+        self.changed[d + 1] = 1
+        self.pc += 1
+
+        N = R >> 15
+        V = (1 - N) & (Rdh >> 7)
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE0) | ((N ^ V) << 4) | (V << 3) | (N << 2) | ((R == 0) << 1) | V
+
+    def sbr_instruction(self, d, K):
+        R = self.dmem[d] | K
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | LOGIC_FLAGS[R]
+
+    def sbrc_instruction(self, r, b, skip):
+        if (self.dmem[r] & (1 << b)) == 0: # check the b-th bit of R
+            self.cycles += skip - self.pc - 1 # 1 more cycle for each word skipped
+            self.pc = skip
+        else: self.pc += 1
+
+    def sbrs_instruction(self, r, b, skip):
+        if (self.dmem[r] & (1 << b)) != 0: # check the b-th bit of R
+            self.cycles += skip - self.pc - 1 # 1 more cycle for each word skipped
+            self.pc = skip
+        else: self.pc += 1
+
+    def sec_instruction(self):
+        self.dmem[SREG] |= FLAG_C
+        self.pc += 1
+
+    def seh_instruction(self):
+        self.dmem[SREG] |= FLAG_H
+        self.pc += 1
+
+    def sei_instruction(self):
+        self.dmem[SREG] |= FLAG_I
+        self.pc += 1
+
+    def sen_instruction(self):
+        self.dmem[SREG] |= FLAG_N
+        self.pc += 1
+
+    def ser_instruction(self, d):
+        self.dmem[d] = 0xFF
+        self.changed[d] = 1
+        self.pc += 1
+
+    def ses_instruction(self):
+        self.dmem[SREG] |= FLAG_S
+        self.pc += 1
+
+    def set_instruction(self):
+        self.dmem[SREG] |= FLAG_T
+        self.pc += 1
+
+    def sev_instruction(self):
+        self.dmem[SREG] |= FLAG_V
+        self.pc += 1
+
+    def sez_instruction(self):
+        self.dmem[SREG] |= FLAG_Z
+        self.pc += 1
+
+    def st_instruction(self, p, mode, r):
+        if mode == -1: self.decrement_pointer(p) # -X, -Y, -Z
+        k = self.get_pointer(p)
+        self.dmem[k] = self.dmem[r]
+        self.changed[k] = 1
+        self.pc += 1
+        if mode == 1: self.increment_pointer(p) # X+, Y+, Z+
+
+    def std_instruction(self, p, q, r):
+        k = self.get_pointer(p) + q
+        self.dmem[k] = self.dmem[r]
+        self.changed[k] = 1
+        self.pc += 1
+
+    def sts_instruction(self, k, r):
+        self.dmem[k] = self.dmem[r]
+        self.changed[k] = 1
+        self.pc += 2
+
+    def sub_instruction(self, d, r):
+        Rd = self.dmem[d]
+        Rr = self.dmem[r]
+
+        self.dmem[d] = (Rd - Rr) & 0xFF
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | SUB_FLAGS[(Rd << 8) | Rr]
+
+    def subi_instruction(self, d, K):
+        Rd = self.dmem[d]
+
+        self.dmem[d] = (Rd - K) & 0xFF
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | SUB_FLAGS[(Rd << 8) | K]
+
+    def swap_instruction(self, d):
+        Rd = self.dmem[d]
+        self.dmem[d] = ((Rd >> 4) | (Rd << 4)) & 0xFF
+        self.changed[d] = 1
+        self.pc += 1
+
+    def tst_instruction(self, d):
+        R = self.dmem[d]
+
+        self.dmem[d] = R
+        self.changed[d] = 1
+        self.pc += 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | LOGIC_FLAGS[R]
+
+    def xch_instruction(self, d):
+        Z = self.get_pointer(30)
+        Rd = self.dmem[d]
+
+        self.dmem[d] = self.dmem[Z] # Rd <- Z
+        self.changed[d] = 1
+        self.dmem[Z] = Rd # Z <- Rd
+        self.changed[Z] = 1
+
+        self.pc += 1
+
+    # Fused pairs (see fuse_program()). Each runs both instructions with
+    # last_pc set in between, so they act exactly like two steps
+
+    def cpi_branch_fused(self, d, K, branch, operands):
+        Rd = self.dmem[d]
+
+        self.pc += 1
+        self.last_pc = self.pc
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xC0) | SUB_FLAGS[(Rd << 8) | K]
+        branch(self, *operands)
+
+    def dec_brne_fused(self, d, k):
+        R = (self.dmem[d] - 1) & 0xFF
+        self.dmem[d] = R
+        self.changed[d] = 1
+
+        self.last_pc = self.pc + 1
+
+        self.dmem[SREG] = (self.dmem[SREG] & 0xE1) | DEC_FLAGS[R]
+        if R: # Z clear
+            self.pc = k
+            self.cycles += 1 # taken branches take 2 cycles
+        else: self.pc += 2
+
+    def ld_st_fused(self, d, p, q, r):
+        K = self.dmem[self.get_pointer(p)] # LD Rd, p+
+        self.dmem[d] = K
+        self.changed[d] = 1
+        self.increment_pointer(p)
+
+        self.last_pc = self.pc + 1
+
+        k = self.get_pointer(q) # ST q+, Rr
+        self.dmem[k] = self.dmem[r]
+        self.changed[k] = 1
+        self.increment_pointer(q)
+
+        self.pc += 2
+
+    def snapshot(self):
+        """
+        Returns the mutable machine state (data memory
+        including SP & SREG, PC, cycles) to pass to restore().
+        The program image is shared, not copied.
+        """
+
+        return (bytes(self.dmem), self.pc, self.last_pc, self.file_end, self.cycles)
+
+    def restore(self, state):
+        """
+        Puts the machine back into a state
+        returned by snapshot().
+        """
+
+        dmem, self.pc, self.last_pc, self.file_end, self.cycles = state
+        self.dmem[:] = dmem
+        self.clear_changed()
+
+    def get_time(self):
+        """
+        Returns the simulated seconds the cycles
+        so far take at \'clock_hz\'.
+        """
+
+        return self.cycles / self.clock_hz
+
+    def clear_changed(self):
+        """
+        Clears the dirty bitmap so only the
+        next instructions' writes show as changed.
+        """
+
+        self.changed[:] = bytes(self.dmem_length)
+
+    def get_flag(self, flag):
+        """
+        Returns 1 if the SREG flag (eg FLAG_Z)
+        is set, otherwise 0.
+        """
+
+        return int((self.dmem[SREG] & flag) != 0)
+
+    def get_sreg_flags(self):
+        """
+        Returns SREG as a list of flags in the
+        order I, T, H, S, V, N, Z, C (for displaying).
+        """
+
+        return [(self.dmem[SREG] >> bit) & 1 for bit in range(7, -1, -1)]
+
+    def get_XYZ(self, XYZ):
+        return self.get_pointer(POINTER_REGS[XYZ.strip('+-')])
+
+    def get_pointer(self, p):
+        """
+        Returns the 16 bit value of the X, Y or
+        Z pointer whose low register is R\'p\'.
+        """
+
+        return (self.dmem[p + 1] * 256) + self.dmem[p]
+
+    def increment_pointer(self, p):
+        L = self.dmem[p] # low val
+        if (L == 255):
+            self.dmem[p + 1] = (self.dmem[p + 1] + 1) & 0xFF
+            self.changed[p + 1] = 1
+        self.dmem[p] = (L + 1) & 0xFF
+        self.changed[p] = 1
+
+    def decrement_pointer(self, p):
+        L = self.dmem[p] # low val
+        if (L == 0):
+            self.dmem[p + 1] = (self.dmem[p + 1] - 1) & 0xFF
+            self.changed[p + 1] = 1
+        self.dmem[p] = (L - 1) & 0xFF
+        self.changed[p] = 1
+
+    def increment_SP(self):
+        L = (self.dmem_length - 1) % 256
+        H = int((self.dmem_length - (L)) / 256)
+        if (self.dmem[SPL] == 255):
+            if (self.dmem[SPH] == H):
+                self.dmem[SPL] = 0
+                self.changed[SPL] = 1
+                self.dmem[SPH] = 0
+                self.changed[SPH] = 1
+            else:
+                self.dmem[SPL] = 0
+                self.changed[SPL] = 1
+                self.dmem[SPH] = self.dmem[SPH] + 1
+                self.changed[SPH] = 1
+        else:
+            self.dmem[SPL] = self.dmem[SPL] + 1
+            self.changed[SPL] = 1
+
+    def decrement_SP(self):
+        L = (self.dmem_length - 1) % 256
+        H = int((self.dmem_length - (L)) / 256)
+        if (self.dmem[SPL] == 0):
+            if (self.dmem[SPH] == 0):
+                self.dmem[SPL] = 255
+                self.changed[SPL] = 1
+                self.dmem[SPH] = H
+                self.changed[SPH] = 1
+            else:
+                self.dmem[SPL] = 255
+                self.changed[SPL] = 1
+                self.dmem[SPH] = self.dmem[SPH] - 1
+                self.changed[SPH] = 1
+        else:
+            self.dmem[SPL] = self.dmem[SPL] - 1
+            self.changed[SPL] = 1
+
+    def get_SP(self):
+        return (256 * self.dmem[SPH]) + self.dmem[SPL]
+
+    def update_pc_val(self, new_val):
+        self.pc = new_val
+
+    def get_pc_val(self):
+        return self.pc
+
+    def get_binary_instruction(self, instruction: list):
+        """
+        Returns the machine code as a string of bits, or
+        a list of 2 for double length instructions. See
+        encode_instruction() for the opcode words as ints.
+        """
+
+        words = encode_instruction(instruction)
+        if len(words) == 1:
+            return f'{words[0]:016b}'
+        return [f'{word:016b}' for word in words]
+
+
+##################################################################################################################
+#  DECODER
+##################################################################################################################
+
+def decode_program(pmem):
+    """
+    Decodes every PMEM slot once so the
+    interpreter never has to parse strings
+    while it is stepping.
+    """
+
+    return [decode_instruction(pmem, pc) for pc in range(len(pmem))]
+
+def decode_instruction(pmem, pc):
+    """
+    Turns a PMEM entry (eg ['ADD', 'R1', 'R2'])
+    into a (handler, operands) record with
+    register numbers and immediates as ints
+    and jump targets as absolute addresses.
+    """
+
+    inst = pmem[pc]
+
+    if inst == None: # second word of a double length instruction
+        return (Interpreter.nop_instruction, ())
+
+    if (inst[0] == 'CALL') and (inst[1] in FUNCTIONS):
+        return (FUNCTION_HANDLERS[inst[1]], ())
+
+    operands = []
+    for kind, op in zip(INST_DECODE[inst[0]], inst[1:]):
+        if kind == 'R': operands.append(int(op[1:]))                # register number
+        elif kind == 'K': operands.append(int(op))                  # immediate value or absolute address
+        elif kind == 'k': operands.append(pc + int(op) + 1)         # relative jump -> absolute address
+        elif kind == 'A': operands.append(int(op) + 0x20)           # I/O address -> data memory address
+        elif kind == 'P': operands.extend(POINTER_MODES[op])        # pointer register & increment mode
+        elif kind == 'Q': operands.append(POINTER_REGS[op[0]])      # pointer register for displacement
+
+    if inst[0] in ['SBRC', 'SBRS']: # where to skip to, jumping over both words of a double length instruction
+        if (pc + 2 < len(pmem)) and (pmem[pc + 2] == None): operands.append(pc + 3)
+        else: operands.append(pc + 2)
+
+    return (INST_HANDLERS[inst[0]], tuple(operands))
+
+
+# Low register of each pointer
+POINTER_REGS = {'X': 26, 'Y': 28, 'Z': 30}
+
+# Pointer register & mode (1 = post increment, -1 = pre decrement)
+POINTER_MODES = {
+    'X': (26, 0),
+    'X+': (26, 1),
+    '-X': (26, -1),
+    'Y': (28, 0),
+    'Y+': (28, 1),
+    '-Y': (28, -1),
+    'Z': (30, 0),
+    'Z+': (30, 1),
+    '-Z': (30, -1)
+}
+
+# How to decode the operands of each inst
+INST_DECODE = {
+    'ADC': ['R', 'R'],
+    'ADD': ['R', 'R'],
+    'ADIW': ['R', 'K'],
+    'AND': ['R', 'R'],
+    'ANDI': ['R', 'K'],
+    'ASR': ['R'],
+    'BCLR': ['K'],
+    'BRBC': ['K', 'k'],
+    'BRBS': ['K', 'k'],
+    'BRCC': ['k'],
+    'BRCS': ['k'],
+    'BREQ': ['k'],
+    'BRGE': ['k'],
+    'BRHC': ['k'],
+    'BRHS': ['k'],
+    'BRID': ['k'],
+    'BRIE': ['k'],
+    'BRLO': ['k'],
+    'BRLT': ['k'],
+    'BRMI': ['k'],
+    'BRNE': ['k'],
+    'BRPL': ['k'],
+    'BRSH': ['k'],
+    'BRTC': ['k'],
+    'BRTS': ['k'],
+    'BRVC': ['k'],
+    'BRVS': ['k'],
+    'BSET': ['K'],
+    'CALL': ['K'],
+    'CBI': ['A', 'K'],
+    'CBR': ['R', 'K'],
+    'CLC': [],
+    'CLH': [],
+    'CLI': [],
+    'CLN': [],
+    'CLR': ['R'],
+    'CLS': [],
+    'CLT': [],
+    'CLV': [],
+    'CLZ': [],
+    'COM': ['R'],
+    'CP': ['R', 'R'],
+    'CPC': ['R', 'R'],
+    'CPI': ['R', 'K'],
+    'DEC': ['R'],
+    'EOR': ['R', 'R'],
+    'IN': ['R', 'A'],
+    'INC': ['R'],
+    'JMP': ['K'],
+    'LD': ['R', 'P'],
+    'LDD': ['R', 'Q', 'K'],
+    'LDI': ['R', 'K'],
+    'LDS': ['R', 'K'],
+    'LSL': ['R'],
+    'LSR': ['R'],
+    'MOV': ['R', 'R'],
+    'MOVW': ['R', 'R'],
+    'MUL': ['R', 'R'],
+    'MULS': ['R', 'R'],
+    'MULSU': ['R', 'R'],
+    'NEG': ['R'],
+    'NOP': [],
+    'OR': ['R', 'R'],
+    'ORI': ['R', 'K'],
+    'OUT': ['A', 'R'],
+    'POP': ['R'],
+    'PUSH': ['R'],
+    'RJMP': ['k'],
+    'RET': [],
+    'ROL': ['R'],
+    'ROR': ['R'],
+    'SBC': ['R', 'R'],
+    'SBI': ['A', 'K'],
+    'SBIW': ['R', 'K'],
+    'SBR': ['R', 'K'],
+    'SBRC': ['R', 'K'],
+    'SBRS': ['R', 'K'],
+    'SEC': [],
+    'SEH': [],
+    'SEI': [],
+    'SEN': [],
+    'SER': ['R'],
+    'SES': [],
+    'SET': [],
+    'SEV': [],
+    'SEZ': [],
+    'ST': ['P', 'R'],
+    'STD': ['Q', 'K', 'R'],
+    'STS': ['K', 'R'],
+    'SUB': ['R', 'R'],
+    'SUBI': ['R', 'K'],
+    'SWAP': ['R'],
+    'TST': ['R'],
+    'XCH': [None, 'R']
+}
+
+# Interpreter method that executes each inst
+INST_HANDLERS = {
+    'ADC': Interpreter.adc_instruction,
+    'ADD': Interpreter.add_instruction,
+    'ADIW': Interpreter.adiw_instruction,
+    'AND': Interpreter.and_instruction,
+    'ANDI': Interpreter.andi_instruction,
+    'ASR': Interpreter.asr_instruction,
+    'BCLR': Interpreter.bclr_instruction,
+    'BRBC': Interpreter.brbc_instruction,
+    'BRBS': Interpreter.brbs_instruction,
+    'BRCC': Interpreter.brcc_instruction,
+    'BRCS': Interpreter.brcs_instruction,
+    'BREQ': Interpreter.breq_instruction,
+    'BRGE': Interpreter.brge_instruction,
+    'BRHC': Interpreter.brhc_instruction,
+    'BRHS': Interpreter.brhs_instruction,
+    'BRID': Interpreter.brid_instruction,
+    'BRIE': Interpreter.brie_instruction,
+    'BRLO': Interpreter.brlo_instruction,
+    'BRLT': Interpreter.brlt_instruction,
+    'BRMI': Interpreter.brmi_instruction,
+    'BRNE': Interpreter.brne_instruction,
+    'BRPL': Interpreter.brpl_instruction,
+    'BRSH': Interpreter.brsh_instruction,
+    'BRTC': Interpreter.brtc_instruction,
+    'BRTS': Interpreter.brts_instruction,
+    'BRVC': Interpreter.brvc_instruction,
+    'BRVS': Interpreter.brvs_instruction,
+    'BSET': Interpreter.bset_instruction,
+    'CALL': Interpreter.call_instruction,
+    'CBI': Interpreter.cbi_instruction,
+    'CBR': Interpreter.cbr_instruction,
+    'CLC': Interpreter.clc_instruction,
+    'CLH': Interpreter.clh_instruction,
+    'CLI': Interpreter.cli_instruction,
+    'CLN': Interpreter.cln_instruction,
+    'CLR': Interpreter.clr_instruction,
+    'CLS': Interpreter.cls_instruction,
+    'CLT': Interpreter.clt_instruction,
+    'CLV': Interpreter.clv_instruction,
+    'CLZ': Interpreter.clz_instruction,
+    'COM': Interpreter.com_instruction,
+    'CP': Interpreter.cp_instruction,
+    'CPC': Interpreter.cpc_instruction,
+    'CPI': Interpreter.cpi_instruction,
+    'DEC': Interpreter.dec_instruction,
+    'EOR': Interpreter.eor_instruction,
+    'IN': Interpreter.in_instruction,
+    'INC': Interpreter.inc_instruction,
+    'JMP': Interpreter.jmp_instruction,
+    'LD': Interpreter.ld_instruction,
+    'LDD': Interpreter.ldd_instruction,
+    'LDI': Interpreter.ldi_instruction,
+    'LDS': Interpreter.lds_instruction,
+    'LSL': Interpreter.lsl_instruction,
+    'LSR': Interpreter.lsr_instruction,
+    'MOV': Interpreter.mov_instruction,
+    'MOVW': Interpreter.movw_instruction,
+    'MUL': Interpreter.mul_instruction,
+    'MULS': Interpreter.muls_instruction,
+    'MULSU': Interpreter.mulsu_instruction,
+    'NEG': Interpreter.neg_instruction,
+    'NOP': Interpreter.nop_instruction,
+    'OR': Interpreter.or_instruction,
+    'ORI': Interpreter.ori_instruction,
+    'OUT': Interpreter.out_instruction,
+    'POP': Interpreter.pop_instruction,
+    'PUSH': Interpreter.push_instruction,
+    'RJMP': Interpreter.rjmp_instruction,
+    'RET': Interpreter.ret_instruction,
+    'ROL': Interpreter.rol_instruction,
+    'ROR': Interpreter.ror_instruction,
+    'SBC': Interpreter.sbc_instruction,
+    'SBI': Interpreter.sbi_instruction,
+    'SBIW': Interpreter.sbiw_instruction,
+    'SBR': Interpreter.sbr_instruction,
+    'SBRC': Interpreter.sbrc_instruction,
+    'SBRS': Interpreter.sbrs_instruction,
+    'SEC': Interpreter.sec_instruction,
+    'SEH': Interpreter.seh_instruction,
+    'SEI': Interpreter.sei_instruction,
+    'SEN': Interpreter.sen_instruction,
+    'SER': Interpreter.ser_instruction,
+    'SES': Interpreter.ses_instruction,
+    'SET': Interpreter.set_instruction,
+    'SEV': Interpreter.sev_instruction,
+    'SEZ': Interpreter.sez_instruction,
+    'ST': Interpreter.st_instruction,
+    'STD': Interpreter.std_instruction,
+    'STS': Interpreter.sts_instruction,
+    'SUB': Interpreter.sub_instruction,
+    'SUBI': Interpreter.subi_instruction,
+    'SWAP': Interpreter.swap_instruction,
+    'TST': Interpreter.tst_instruction,
+    'XCH': Interpreter.xch_instruction
+}
+
+# Interpreter method that executes each built in function
+FUNCTION_HANDLERS = {
+    'PRINTF': Interpreter.printf_function
+}
+
+# Cycles each inst takes (ATmega328P). Branches take 1 more when
+# taken & SBRC/SBRS 1 more per word skipped, added by their handlers.
+# Anything not listed takes 1 cycle
+INST_CYCLES = {
+    'ADIW': 2,
+    'CALL': 4,
+    'CBI': 2,
+    'JMP': 3,
+    'LD': 2,
+    'LDD': 2,
+    'LDS': 2,
+    'MUL': 2,
+    'MULS': 2,
+    'MULSU': 2,
+    'POP': 2,
+    'PUSH': 2,
+    'RET': 4,
+    'RJMP': 2,
+    'SBI': 2,
+    'SBIW': 2,
+    'ST': 2,
+    'STD': 2,
+    'STS': 2,
+    'XCH': 2
+}
+
+# Cycles of each built in function (just the CALL, the function itself is free)
+FUNCTION_CYCLES = {
+    'PRINTF': 4
+}
+
+HANDLER_CYCLES = {INST_HANDLERS[inst]: cycles for inst, cycles in INST_CYCLES.items()}
+HANDLER_CYCLES.update({FUNCTION_HANDLERS[func]: cycles for func, cycles in FUNCTION_CYCLES.items()})
+
+# Cycles of both instructions of each fused pair
+HANDLER_CYCLES.update({
+    Interpreter.cpi_branch_fused: 2,
+    Interpreter.dec_brne_fused: 2,
+    Interpreter.ld_st_fused: 4
+})
+
+# Instructions run by each fused record (everything else runs 1)
+HANDLER_LENGTHS = {
+    Interpreter.cpi_branch_fused: 2,
+    Interpreter.dec_brne_fused: 2,
+    Interpreter.ld_st_fused: 2
+}
+
+def program_lengths(program):
+    """
+    Returns the instructions each (handler, operands)
+    record of a decoded program runs.
+    """
+
+    return [HANDLER_LENGTHS.get(handler, 1) for handler, operands in program]
+
+def program_cycles(program):
+    """
+    Returns the cycles each (handler, operands)
+    record of a decoded program takes.
+    """
+
+    return [HANDLER_CYCLES.get(handler, 1) for handler, operands in program]
+
+BRANCH_HANDLERS = {INST_HANDLERS[inst] for inst in INST_HANDLERS if inst.startswith('BR') and inst not in ['BCLR', 'BSET']}
+JUMP_HANDLERS = {INST_HANDLERS[inst] for inst in ['CALL', 'JMP', 'RJMP']}
+SKIP_HANDLERS = {INST_HANDLERS[inst] for inst in ['SBRC', 'SBRS']}
+
+def jump_targets(program, labels):
+    """
+    Returns every PMEM address that can be jumped,
+    branched or skipped to (including every label).
+    """
+
+    targets = set(labels.values())
+    for handler, operands in program:
+        if handler in BRANCH_HANDLERS: targets.add(operands[-1])    # k is always last
+        elif handler in JUMP_HANDLERS: targets.add(operands[0])
+        elif handler in SKIP_HANDLERS: targets.add(operands[2])
+    return targets
+
+def fuse_pair(first, second):
+    """
+    Returns a fused record doing both records,
+    or None if the pair isn\'t one that fuses.
+    """
+
+    (handler, operands), (handler2, operands2) = first, second
+
+    if (handler is Interpreter.cpi_instruction) and (handler2 in BRANCH_HANDLERS):
+        return (Interpreter.cpi_branch_fused, operands + (handler2, operands2))
+
+    if (handler is Interpreter.dec_instruction) and (handler2 is Interpreter.brne_instruction):
+        return (Interpreter.dec_brne_fused, operands + operands2)
+
+    if (handler is Interpreter.ld_instruction) and (handler2 is Interpreter.st_instruction):
+        d, p, mode = operands
+        q, mode2, r = operands2
+        if mode == mode2 == 1: # only post increment
+            return (Interpreter.ld_st_fused, (d, p, q, r))
+
+    return None
+
+def fuse_program(program, labels):
+    """
+    Returns a copy of a decoded program with CPI+BRxx,
+    DEC+BRNE & LD+ST (post increment) pairs fused into
+    one record at the first address. Pairs whose second
+    instruction is a jump target aren\'t fused.
+    """
+
+    targets = jump_targets(program, labels)
+    fused = list(program)
+    for pc in range(len(program) - 1):
+        if (pc + 1) in targets:
+            continue
+
+        record = fuse_pair(program[pc], program[pc + 1])
+        if record is not None:
+            fused[pc] = record # the second record stays, unfused, for anything jumping to it
+    return fused
+
+# Records that end a basic block (anything that can leave the PC somewhere other than the next instruction)
+BLOCK_END_HANDLERS = BRANCH_HANDLERS | JUMP_HANDLERS | SKIP_HANDLERS | {
+    Interpreter.ret_instruction,
+    Interpreter.cpi_branch_fused,
+    Interpreter.dec_brne_fused
+}
+
+# Records that can return a RETError or StackOverflowError
+ERROR_HANDLERS = {
+    Interpreter.pop_instruction,
+    Interpreter.push_instruction,
+    Interpreter.ret_instruction
+}
+
+# Records that move the PC on by 2
+DOUBLE_HANDLERS = {
+    Interpreter.lds_instruction,
+    Interpreter.sts_instruction,
+    Interpreter.printf_function,
+    Interpreter.ld_st_fused
+}
+
+class BlockCache(dict):
+    """
+    Compiled basic blocks of a decoded program as
+    (function, records) keyed by start address,
+    each compiled the first time it is looked up.
+    """
+
+    def __init__(self, program, labels):
+        super().__init__()
+        self.program = program
+        self.leaders = jump_targets(program, labels) # every block starts at one of these or after a block end
+
+    def __missing__(self, pc):
+        block = self[pc] = compile_block(self.program, pc, self.leaders)
+        return block
+
+BLOCK_CACHES = collections.OrderedDict() # id(program): BlockCache, oldest first
+
+def program_blocks(program, labels):
+    """
+    Returns the BlockCache of a decoded program, shared
+    by every interpreter running it (eg the same entry
+    of ASSEMBLY_CACHE) so blocks are only compiled once.
+    """
+
+    key = id(program) # the BlockCache keeps the program alive, so the id isn't reused while cached
+    blocks = BLOCK_CACHES.get(key)
+    if blocks is not None:
+        BLOCK_CACHES.move_to_end(key)
+        return blocks
+
+    blocks = BLOCK_CACHES[key] = BlockCache(program, labels)
+    if len(BLOCK_CACHES) > BLOCK_CACHE_SIZE:
+        BLOCK_CACHES.popitem(last=False) # least recently used
+    return blocks
+
+def compile_block(program, start, leaders):
+    """
+    Generates & compiles one function calling every
+    handler of the basic block at \'start\' straight-line,
+    with the PC check, last PC & cycles done once for the
+    whole block. Returns (function, instructions in the
+    block). The function returns (instructions run, error
+    or None), stopping early if a handler returns an error.
+    """
+
+    namespace = {}
+    lines = []
+    pc = start
+    length = 0
+    cycles = 0
+    nops = 0 # NOPs in a row at the end of the lines so far
+    while True:
+        handler, operands = program[pc]
+        length += HANDLER_LENGTHS.get(handler, 1) # fused pairs are 2
+        cycles += HANDLER_CYCLES.get(handler, 1)
+
+        if handler is Interpreter.nop_instruction: # eg the NOPs filling PMEM after the program
+            nops += 1
+            if nops > 1: lines.pop()
+            code = [f'    self.pc += {nops}']
+
+        else:
+            nops = 0
+            name = f'h{length}'
+            namespace[name] = handler
+            args = ''
+            for i, operand in enumerate(operands):
+                if isinstance(operand, (int, tuple)): args += f', {operand!r}'
+                else: # eg the branch handler of a fused CPI
+                    namespace[f'{name}_{i}'] = operand
+                    args += f', {name}_{i}'
+
+            if handler in ERROR_HANDLERS:
+                code = [
+                    f'    out = {name}(self{args})',
+                    f'    if out:',
+                    f'        self.last_pc = {pc}',
+                    f'        self.cycles += {cycles}',
+                    f'        return {length}, out'
+                ]
+            else: code = [f'    {name}(self{args})']
+
+        last, last_pc = len(lines), pc # where the last record starts
+        lines += code
+
+        if handler in BLOCK_END_HANDLERS:
+            break
+        pc += 2 if handler in DOUBLE_HANDLERS else 1
+        if (pc >= len(program)) or (pc in leaders) or (length >= BLOCK_MAX_LENGTH):
+            break
+
+    # before the last handler, as in step(), so fused handlers can set their own
+    lines.insert(last, f'    self.last_pc = {last_pc}')
+    lines.append(f'    self.cycles += {cycles}')
+    lines.append(f'    return {length}, None')
+
+    source = 'def block(self):\n' + '\n'.join(lines)
+    exec(compile(source, f'<block {start} of {len(program)}>', 'exec'), namespace)
+    return namespace['block'], length
+
+
+##################################################################################################################
+#  ENCODER
+##################################################################################################################
+
+# Machine code of each inst as its bits, most significant first, followed by the
+# bit field letter(s) of each operand ('' for operands not encoded, eg the pointer
+# of LD/ST which picks the pattern instead). The rightmost bit of a field is bit 0
+# of the operand. 32 bit patterns are double length instructions
+INST_ENCODING = {
+    'ADC': ('000111rdddddrrrr', 'd', 'r'),
+    'ADD': ('000011rdddddrrrr', 'd', 'r'),
+    'ADIW': ('10010110KKddKKKK', 'd', 'K'),
+    'AND': ('001000rdddddrrrr', 'd', 'r'),
+    'ANDI': ('0111KKKKddddKKKK', 'd', 'K'),
+    'ASR': ('1001010ddddd0101', 'd'),
+    'BCLR': ('100101001sss1000', 's'),
+    'BRBC': ('111101kkkkkkksss', 's', 'k'),
+    'BRBS': ('111100kkkkkkksss', 's', 'k'),
+    'BRCC': ('111101kkkkkkk000', 'k'),
+    'BRCS': ('111100kkkkkkk000', 'k'),
+    'BREQ': ('111100kkkkkkk001', 'k'),
+    'BRGE': ('111101kkkkkkk100', 'k'),
+    'BRHC': ('111101kkkkkkk101', 'k'),
+    'BRHS': ('111100kkkkkkk101', 'k'),
+    'BRID': ('111101kkkkkkk111', 'k'),
+    'BRIE': ('111100kkkkkkk111', 'k'),
+    'BRLO': ('111100kkkkkkk000', 'k'),
+    'BRLT': ('111100kkkkkkk100', 'k'),
+    'BRMI': ('111100kkkkkkk010', 'k'),
+    'BRNE': ('111101kkkkkkk001', 'k'),
+    'BRPL': ('111101kkkkkkk010', 'k'),
+    'BRSH': ('111101kkkkkkk000', 'k'),
+    'BRTC': ('111101kkkkkkk110', 'k'),
+    'BRTS': ('111100kkkkkkk110', 'k'),
+    'BRVC': ('111101kkkkkkk011', 'k'),
+    'BRVS': ('111100kkkkkkk011', 'k'),
+    'BSET': ('100101000sss1000', 's'),
+    'CALL': ('1001010kkkkk111kkkkkkkkkkkkkkkkk', 'k'),
+    'CBI': ('10011000AAAAAbbb', 'A', 'b'),
+    'CBR': ('0111KKKKddddKKKK', 'd', 'K'),
+    'CLC': ('1001010010001000',),
+    'CLH': ('1001010011011000',),
+    'CLI': ('1001010011111000',),
+    'CLN': ('1001010010101000',),
+    'CLR': ('001001rdddddrrrr', 'dr'),
+    'CLS': ('1001010011001000',),
+    'CLT': ('1001010011101000',),
+    'CLV': ('1001010010111000',),
+    'CLZ': ('1001010010011000',),
+    'COM': ('1001010ddddd0000', 'd'),
+    'CP': ('000101rdddddrrrr', 'd', 'r'),
+    'CPC': ('000001rdddddrrrr', 'd', 'r'),
+    'CPI': ('0011KKKKddddKKKK', 'd', 'K'),
+    'DEC': ('1001010ddddd1010', 'd'),
+    'EOR': ('001001rdddddrrrr', 'd', 'r'),
+    'IN': ('10110AAdddddAAAA', 'd', 'A'),
+    'INC': ('1001010ddddd0011', 'd'),
+    'JMP': ('1001010kkkkk110kkkkkkkkkkkkkkkkk', 'k'),
+    'LD X': ('1001000ddddd1100', 'd', ''),
+    'LD X+': ('1001000ddddd1101', 'd', ''),
+    'LD -X': ('1001000ddddd1110', 'd', ''),
+    'LD Y': ('1000000ddddd1000', 'd', ''),
+    'LD Y+': ('1001000ddddd1001', 'd', ''),
+    'LD -Y': ('1001000ddddd1010', 'd', ''),
+    'LD Z': ('1000000ddddd0000', 'd', ''),
+    'LD Z+': ('1001000ddddd0001', 'd', ''),
+    'LD -Z': ('1001000ddddd0010', 'd', ''),
+    'LDD Y+': ('10q0qq0ddddd1qqq', 'd', '', 'q'),
+    'LDD Z+': ('10q0qq0ddddd0qqq', 'd', '', 'q'),
+    'LDI': ('1110KKKKddddKKKK', 'd', 'K'),
+    'LDS': ('1001000ddddd0000kkkkkkkkkkkkkkkk', 'd', 'k'),
+    'LSL': ('000011rdddddrrrr', 'dr'),
+    'LSR': ('1001010ddddd0110', 'd'),
+    'MOV': ('001011rdddddrrrr', 'd', 'r'),
+    'MOVW': ('00000001ddddrrrr', 'd', 'r'),
+    'MUL': ('100111rdddddrrrr', 'd', 'r'),
+    'MULS': ('00000010ddddrrrr', 'd', 'r'),
+    'MULSU': ('000000110ddd0rrr', 'd', 'r'),
+    'NEG': ('1001010ddddd0001', 'd'),
+    'NOP': ('0000000000000000',),
+    'OR': ('001010rdddddrrrr', 'd', 'r'),
+    'ORI': ('0110KKKKddddKKKK', 'd', 'K'),
+    'OUT': ('10111AArrrrrAAAA', 'A', 'r'),
+    'POP': ('1001000ddddd1111', 'd'),
+    'PUSH': ('1001001rrrrr1111', 'r'),
+    'RET': ('1001010100001000',),
+    'RJMP': ('1100kkkkkkkkkkkk', 'k'),
+    'ROL': ('000111rdddddrrrr', 'dr'),
+    'ROR': ('1001010ddddd0111', 'd'),
+    'SBC': ('000010rdddddrrrr', 'd', 'r'),
+    'SBI': ('10011010AAAAAbbb', 'A', 'b'),
+    'SBIW': ('10010111KKddKKKK', 'd', 'K'),
+    'SBR': ('0110KKKKddddKKKK', 'd', 'K'),
+    'SBRC': ('1111110rrrrr0bbb', 'r', 'b'),
+    'SBRS': ('1111111rrrrr0bbb', 'r', 'b'),
+    'SEC': ('1001010000001000',),
+    'SEH': ('1001010001011000',),
+    'SEI': ('1001010001111000',),
+    'SEN': ('1001010000101000',),
+    'SER': ('11101111dddd1111', 'd'),
+    'SES': ('1001010001001000',),
+    'SET': ('1001010001101000',),
+    'SEV': ('1001010000111000',),
+    'SEZ': ('1001010000011000',),
+    'ST X': ('1001001rrrrr1100', '', 'r'),
+    'ST X+': ('1001001rrrrr1101', '', 'r'),
+    'ST -X': ('1001001rrrrr1110', '', 'r'),
+    'ST Y': ('1000001rrrrr1000', '', 'r'),
+    'ST Y+': ('1001001rrrrr1001', '', 'r'),
+    'ST -Y': ('1001001rrrrr1010', '', 'r'),
+    'ST Z': ('1000001rrrrr0000', '', 'r'),
+    'ST Z+': ('1001001rrrrr0001', '', 'r'),
+    'ST -Z': ('1001001rrrrr0010', '', 'r'),
+    'STD Y+': ('10q0qq1rrrrr1qqq', '', 'q', 'r'),
+    'STD Z+': ('10q0qq1rrrrr0qqq', '', 'q', 'r'),
+    'STS': ('1001001rrrrr0000kkkkkkkkkkkkkkkk', 'k', 'r'),
+    'SUB': ('000110rdddddrrrr', 'd', 'r'),
+    'SUBI': ('0101KKKKddddKKKK', 'd', 'K'),
+    'SWAP': ('1001010ddddd0010', 'd'),
+    'TST': ('001000rdddddrrrr', 'dr'),
+    'XCH': ('1001001ddddd0100', '', 'd')
+}
+
+# Insts with an entry for each pointer, and which operand the pointer is
+ENCODE_POINTERS = {
+    'LD': 2,
+    'LDD': 2,
+    'ST': 1,
+    'STD': 1
+}
+
+# Operands (by index in the inst) that are changed before being encoded
+ENCODE_TRANSFORMS = {
+    ('ADIW', 1): lambda d: (d - 24) >> 1,   # R24, R26, R28 or R30
+    ('CBR', 2): lambda K: 0xFF - K,         # ANDI with the complement
+    ('MOVW', 1): lambda d: d >> 1,          # even registers only
+    ('MOVW', 2): lambda r: r >> 1,
+    ('SBIW', 1): lambda d: (d - 24) >> 1
+}
+
+# Built in functions are encoded as a CALL to the last address
+FUNCTION_ADDRESS = 0x3FFFFF
+
+def make_encoder(inst, pattern, fields):
+    """
+    Turns an INST_ENCODING entry into (opcode, words,
+    [(operand index, transform, [(shift right, mask,
+    shift left), ...], lowest, highest), ...]), with each
+    field split into runs of bits that can be shifted into
+    place at once & the (transformed) values it can hold.
+    """
+
+    n = len(pattern)
+    opcode = int(''.join(bit if bit in '01' else '0' for bit in pattern), 2)
+
+    operands = []
+    for index, letters in enumerate(fields, 1):
+        segments = []
+        for letter in letters:
+            positions = [n - 1 - i for i, bit in enumerate(pattern) if bit == letter][::-1] # operand bit 0 first
+
+            start = 0
+            for i in range(1, len(positions) + 1):
+                if (i == len(positions)) or (positions[i] != positions[i - 1] + 1): # end of a run
+                    segments.append((start, (1 << (i - start)) - 1, positions[start]))
+                    start = i
+
+        if segments:
+            transform = ENCODE_TRANSFORMS.get((inst, index))
+            bits = pattern.count(letters[0])
+            if (letters[0] in 'dr') and (transform is None) and (bits < 5): # R16 up only
+                lowest = 16
+            elif (letters[0] == 'k') and (n == 16): # relative jumps are signed
+                lowest = -(1 << (bits - 1))
+            else: lowest = 0
+            operands.append((index, transform, segments, lowest, lowest + (1 << bits) - 1))
+
+    return opcode, n // 16, operands
+
+INST_ENCODERS = {key: make_encoder(key.split()[0], entry[0], entry[1:]) for key, entry in INST_ENCODING.items()}
+
+def encode_instruction(instruction):
+    """
+    Returns the machine code of a PMEM entry (eg
+    ['ADD', 'R1', 'R2']) as a tuple of 1 or 2
+    16 bit opcode words. Raises ValueError if an
+    operand doesn\'t fit its field.
+    """
+
+    inst = instruction[0]
+    if (inst == 'CALL') and (instruction[1] in FUNCTIONS):
+        instruction = ['CALL', FUNCTION_ADDRESS]
+
+    if inst in ENCODE_POINTERS:
+        inst = f'{inst} {instruction[ENCODE_POINTERS[inst]]}'
+
+    opcode, words, operands = INST_ENCODERS[inst]
+    for index, transform, segments, lowest, highest in operands:
+        value = instruction[index]
+        value = int(value[1:]) if isinstance(value, str) else int(value) # registers are eg 'R16'
+        if transform is not None: value = transform(value)
+        if not (lowest <= value <= highest): # the bits past the field would be silently lost
+            raise ValueError(f'Cannot encode {instruction[0]} with {instruction[index]}, it doesn\'t fit the operand\'s field')
+
+        for shift, mask, position in segments:
+            opcode |= ((value >> shift) & mask) << position
+
+    if words == 1:
+        return (opcode,)
+    return (opcode >> 16, opcode & 0xFFFF)
+
+
+##################################################################################################################
+#  HEADLESS
+##################################################################################################################
+
+def assemble(fn, text):
+    """
+    Lexes & parses the text. Returns ([instructions, data, labels], None)
+    or (None, error string) if it doesn't assemble.
+    """
+
+    lexer = Lexer(fn, text)
+    tokens, error = lexer.make_tokens()
+    if error:
+        return None, error.as_string()
+
+    line_nums = tokens[-1]                  # allocating the locations of each line
+    tokens = tokens[0:(len(tokens) - 1)]    # removing line nums from last pos in tokens
+
+    parser = Parser(fn, tokens, line_nums)
+    result, error = parser.parse()
+    if error:
+        return None, error.as_string()
+
+    return result, None
+
+def make_pmem(instructions):
+    """
+    Returns PMEM with the instructions followed by NOPs.
+    Nothing writes to PMEM so the NOPs share one list.
+    """
+
+    return instructions[:PMEM_SIZE] + [['NOP']] * (PMEM_SIZE - len(instructions))
+
+def make_dmem(data):
+    """
+    Returns a new DMEM with the data at 0x100
+    and SP at the end of RAM.
+    """
+
+    DMEM = bytearray(DMEM_SIZE) # registers, I/O & RAM as plain offsets
+    for i in range(len(data)):
+        DMEM[i + 0x100] = data[i] % 256
+
+    # SREG starts at 0 (flags stored as a single byte, see FLAG_C ... FLAG_I)
+    DMEM[SPL] = DMEM_MAX % 256 # stack pointer starts at the end of RAM
+    DMEM[SPH] = DMEM_MAX // 256
+
+    return DMEM
+
+CACHE_VERSION = 2 # bump when the parser or decoder output changes so old disk entries are ignored
+
+class AssemblyCache:
+    """
+    Assembled programs keyed by a hash of their source text,
+    so unchanged files skip the lexer, parser & decoder.
+    Keeps the most recently used \'max_entries\' in memory
+    and, if \'cache_dir\' is given, pickles them to disk.
+    """
+
+    def __init__(self, max_entries=64, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = collections.OrderedDict() # key: [instructions, data, PMEM, program, labels], oldest first
+
+    def assemble(self, fn, text):
+        """
+        Same as assemble() but returns ([instructions, data,
+        PMEM, program, labels], None) with the PMEM & decoded program
+        to share between interpreters, or (None, error string).
+        Errors aren't cached as they name the file.
+        """
+
+        key = hashlib.sha256(text.encode()).hexdigest()
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry, None
+
+        entry = self.load(key)
+        if entry is None:
+            result, error = assemble(fn, text)
+            if error:
+                return None, error
+
+            instructions, data, labels = result
+            PMEM = make_pmem(instructions)
+            entry = [instructions, data, PMEM, decode_program(PMEM), labels]
+            self.save(key, entry)
+
+        self.entries[key] = entry
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False) # least recently used
+        return entry, None
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.v{CACHE_VERSION}.pickle')
+
+    def load(self, key):
+        """
+        Returns the entry saved on disk or None.
+        """
+
+        if self.cache_dir is None:
+            return None
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                instructions, data, program, labels = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError, ValueError):
+            return None
+
+        # handlers are saved by name so the file doesn't depend on how sim.py was imported
+        program = [(getattr(Interpreter, name), operands) for name, operands in program]
+        program += [(Interpreter.nop_instruction, ())] * (PMEM_SIZE - len(program)) # the NOPs after the program
+        return [instructions, data, make_pmem(instructions), program, labels]
+
+    def save(self, key, entry):
+        if self.cache_dir is None:
+            return
+
+        instructions, data, PMEM, program, labels = entry
+        program = [(handler.__name__, operands) for handler, operands in program[:len(instructions)]]
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{self.path(key)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((instructions, data, program, labels), f)
+        os.replace(tmp_path, self.path(key)) # so other processes never read half a file
+
+ASSEMBLY_CACHE = AssemblyCache()
+
+def load_interpreter(fn, text):
+    """
+    Assembles the text through ASSEMBLY_CACHE (or loads a
+    flash image, see load_program()). Returns
+    (Interpreter, None) or (None, error string).
+    """
+
+    entry, error = load_program(fn, text)
+    if error:
+        return None, error
+
+    instructions, data, PMEM, program, labels = entry
+    return Interpreter(make_dmem(data), PMEM, fn, len(instructions), program, labels), None
+
+def run_headless(fn, text, max_steps=None, ram_ranges=(), profile=None, trace=None, breakpoints=(), watchpoints=(), fuse=False, blocks=False):
+    """
+    Assembles & runs the text without a display until the
+    file ends, an error occurs, \'max_steps\' have run or one
+    of the (where, condition) \'breakpoints\' or \'watchpoints\'
+    is hit. PRINTF output goes to stdout. Returns the final
+    state as a dict (see headless_state()), with the profile as
+    text under \'profile\' if a format is given. If \'trace\'
+    is a path every instruction is traced to it. \'fuse\' runs
+    a fused program (see enable_fusion()) & \'blocks\' runs
+    compiled basic blocks (see enable_blocks()) when nothing
+    needs single instructions.
+    """
+
+    interpreter, error = load_interpreter(fn, text)
+    if error:
+        return {'file': fn, 'error': error, 'steps': 0, 'output': ''}
+
+    if not (profile or trace or breakpoints or watchpoints):
+        if fuse: interpreter.enable_fusion()
+        if blocks: interpreter.enable_blocks()
+
+    if profile:
+        interpreter.enable_profiling()
+
+    with (TraceWriter(trace) if trace else contextlib.nullcontext()) as writer:
+        if trace:
+            interpreter.enable_trace(writer)
+
+        # after profiling & tracing, so debug_step() wraps their step()
+        try:
+            for where, condition in breakpoints:
+                interpreter.add_breakpoint(where, condition)
+            for where in watchpoints:
+                interpreter.add_watchpoint(where)
+        except (ValueError, SyntaxError) as e:
+            return {'file': fn, 'error': f'{e}\n', 'steps': 0, 'output': ''}
+
+        # debug_step() checks after each instruction, so one on the first instruction is checked here
+        out = interpreter.breakpoint_hit()
+        if isinstance(out, BreakpointHit):
+            interpreter.hit = out
+            steps, output, error = 0, '', None
+        elif out: steps, output, error = 0, '', out.as_string()
+        else: steps, output, error = run_interpreter(interpreter, max_steps)
+
+    state = headless_state(interpreter, ram_ranges)
+    state.update({'file': fn, 'error': error, 'steps': steps, 'output': output})
+    if profile:
+        state['profile'] = format_profile(interpreter, profile)
+    return state
+
+def run_interpreter(interpreter, max_steps=None, time_limit=None):
+    """
+    Steps until the file ends, an error occurs, \'max_steps\'
+    have run, \'time_limit\' seconds have passed or a breakpoint
+    is hit (left in interpreter.hit).
+    Returns (steps, PRINTF output, error string or None),
+    with the output cut off after MAX_OUTPUT characters.
+    """
+
+    if time_limit is not None:
+        deadline = time.perf_counter() + time_limit
+
+    output = [] # PRINTF output, collected as the buffer flushes
+    kept = 0
+    def collect(text):
+        nonlocal kept
+        if kept < MAX_OUTPUT:
+            output.append(text[:MAX_OUTPUT - kept])
+        kept += len(text)
+
+    interpreter.output.sinks.append(collect)
+
+    steps = 0
+    error = None
+    interpreter.hit = None
+    try:
+        if interpreter.blocks is not None: # a whole basic block at a time, see enable_blocks()
+            check_steps = 4096
+            while (not interpreter.file_end) and (max_steps is None or steps < max_steps):
+                length, out = interpreter.block_step(None if max_steps is None else max_steps - steps) # never past max_steps
+                steps += length
+                if out:
+                    error = out.as_string()
+                    break
+
+                if (time_limit is not None) and (steps >= check_steps):
+                    check_steps = steps + 4096
+                    if time.perf_counter() > deadline:
+                        error = f'Timeout: ran for longer than {time_limit} seconds\n'
+                        break
+
+        elif interpreter.record_lengths is not None: # fused pairs still count as 2 steps, see enable_fusion()
+            lengths = interpreter.record_lengths
+            check_steps = 4096
+            while (not interpreter.file_end) and (max_steps is None or steps < max_steps):
+                pc = interpreter.pc
+                length = lengths[pc] if pc < interpreter.pmem_length else 1
+                if (max_steps is not None) and (steps + length > max_steps): # only the first of the pair fits
+                    length, out = interpreter.counted_step(max_steps - steps)
+                else: out = interpreter.step()
+                steps += length
+                if out:
+                    error = out.as_string()
+                    break
+
+                if (time_limit is not None) and (steps >= check_steps):
+                    check_steps = steps + 4096
+                    if time.perf_counter() > deadline:
+                        error = f'Timeout: ran for longer than {time_limit} seconds\n'
+                        break
+
+        else:
+            while (not interpreter.file_end) and (max_steps is None or steps < max_steps):
+                out = interpreter.step()
+                steps += 1
+                if out: # error or breakpoint
+                    if isinstance(out, BreakpointHit): interpreter.hit = out
+                    else: error = out.as_string()
+                    break
+
+                # checking the clock every step would slow down every run
+                if (time_limit is not None) and (steps % 4096 == 0) and (time.perf_counter() > deadline):
+                    error = f'Timeout: ran for longer than {time_limit} seconds\n'
+                    break
+
+    finally:
+        interpreter.output.flush()
+        interpreter.output.sinks.remove(collect)
+
+    if kept > MAX_OUTPUT:
+        output.append(f'\n[{kept - MAX_OUTPUT} more characters of output dropped]\n')
+
+    return steps, ''.join(output), error
+
+def headless_state(interpreter, ram_ranges=()):
+    """
+    Returns the registers, SREG, SP & the RAM
+    in each (start, end) range of \'ram_ranges\'
+    as a JSON friendly dict.
+    """
+
+    dmem = interpreter.dmem
+    sreg = interpreter.get_sreg_flags()
+
+    return {
+        'finished': interpreter.file_end,
+        'pc': interpreter.get_pc_val(),
+        'registers': list(dmem[0:32]),
+        'sreg': {flag: sreg[i] for i, flag in enumerate('ITHSVNZC')},
+        'sp': interpreter.get_SP(),
+        'ram': {hex(start): list(dmem[start:end]) for start, end in ram_ranges},
+        'cycles': interpreter.cycles,
+        'time': interpreter.get_time(), # seconds at interpreter.clock_hz
+        'breakpoint': interpreter.hit.as_string() if interpreter.hit else None
+    }
+
+def parse_ram_range(text):
+    """
+    Turns \'START:END\' (eg 0x100:0x110, END excluded)
+    into a (start, end) pair for headless_state().
+    """
+
+    start, end = text.split(':')
+    return int(start, 0), int(end, 0)
+
+def parse_breakpoint(text):
+    """
+    Turns \'WHERE\' or \'WHERE if CONDITION\' (eg loop if R16 == 3)
+    into a (where, condition) pair for run_headless().
+    """
+
+    where, _, condition = text.partition(' if ')
+    return where.strip(), (condition.strip() or None)
+
+def load_tkinter():
+    """
+    Imports tkinter for the GUI. Kept out of the module
+    imports so headless runs don't need Tk or a display.
+    """
+
+    import tkinter
+    from tkinter.filedialog import askopenfilename
+    from tkinter.simpledialog import askstring
+
+    globals().update({name: getattr(tkinter, name) for name in tkinter.__all__})
+    globals()['askopenfilename'] = askopenfilename
+    globals()['askstring'] = askstring
+
+
+##################################################################################################################
+#  PROFILER
+##################################################################################################################
+
+PROFILE_FORMATS = ['table', 'json', 'callgrind']
+
+def profile_label_of(labels):
+    """
+    Returns a function giving the label each PMEM
+    address falls under (the closest label before it).
+    """
+
+    starts = sorted((addr, label) for label, addr in labels.items())
+
+    def label_of(pc):
+        name = '(start)'
+        for addr, label in starts:
+            if addr > pc: break
+            name = label
+        return name
+
+    return label_of
+
+def profile_report(interpreter):
+    """
+    Totals an interpreter\'s profile (see enable_profiling())
+    by label. Returns a JSON friendly dict with the labels
+    hottest first & every address that ran.
+    """
+
+    label_of = profile_label_of(interpreter.labels)
+    total = interpreter.cycles or 1
+
+    labels = {}
+    addresses = []
+    for pc, count in enumerate(interpreter.profile_counts):
+        if count == 0:
+            continue
+
+        label = label_of(pc)
+        row = labels.setdefault(label, {'label': label, 'address': interpreter.labels.get(label, 0), 'executed': 0, 'cycles': 0, 'calls': 0})
+        row['executed'] += count
+        row['cycles'] += interpreter.profile_cycles[pc]
+
+        handler, operands = interpreter.program[pc]
+        if handler is Interpreter.call_instruction: # calls into the label at the CALL's target
+            callee = label_of(operands[0])
+            labels.setdefault(callee, {'label': callee, 'address': operands[0], 'executed': 0, 'cycles': 0, 'calls': 0})['calls'] += count
+
+        addresses.append({'address': pc, 'label': label, 'executed': count, 'cycles': interpreter.profile_cycles[pc]})
+
+    rows = sorted(labels.values(), key=lambda row: row['cycles'], reverse=True)
+    for row in rows:
+        row['percent'] = round(100 * row['cycles'] / total, 2)
+
+    return {'file': interpreter.fn, 'cycles': interpreter.cycles, 'labels': rows, 'addresses': addresses}
+
+def profile_table(report):
+    """
+    Formats a profile_report() as a text table.
+    """
+
+    lines = [f'{"label":<20} {"address":>7} {"executed":>10} {"cycles":>10} {"%":>7} {"calls":>7}']
+    for row in report['labels']:
+        lines.append(f'{row["label"]:<20} {row["address"]:>7} {row["executed"]:>10} {row["cycles"]:>10} {row["percent"]:>7} {row["calls"]:>7}')
+    lines.append(f'total cycles: {report["cycles"]}')
+    return '\n'.join(lines) + '\n'
+
+def profile_callgrind(interpreter):
+    """
+    Formats an interpreter\'s profile in the callgrind format
+    (eg for KCachegrind), with each label as a function and
+    PMEM addresses as positions.
+    """
+
+    label_of = profile_label_of(interpreter.labels)
+
+    lines = ['# callgrind format', 'version: 1', 'creator: sim.py', 'positions: instr', 'events: Instructions Cycles', f'fl={interpreter.fn}']
+    last_label = None
+    for pc, count in enumerate(interpreter.profile_counts):
+        if count == 0:
+            continue
+
+        label = label_of(pc)
+        if label != last_label:
+            lines.append(f'fn={label}')
+            last_label = label
+        lines.append(f'{pc} {count} {interpreter.profile_cycles[pc]}')
+
+        handler, operands = interpreter.program[pc]
+        if handler is Interpreter.call_instruction:
+            lines.append(f'cfn={label_of(operands[0])}')
+            lines.append(f'calls={count} {operands[0]}')
+            lines.append(f'{pc} {interpreter.profile_inclusive_counts[pc]} {interpreter.profile_inclusive[pc]}')
+
+    return '\n'.join(lines) + '\n'
+
+def format_profile(interpreter, format_='table'):
+    """
+    Returns the interpreter\'s profile as text in
+    one of PROFILE_FORMATS.
+    """
+
+    if format_ == 'callgrind':
+        return profile_callgrind(interpreter)
+
+    report = profile_report(interpreter)
+    if format_ == 'json':
+        return json.dumps(report, indent=2) + '\n'
+    return profile_table(report)
+
+
+##################################################################################################################
+#  TRACE
+##################################################################################################################
+
+# Traces are TRACE_MAGIC, then fixed size records. Each instruction is a step record
+# (kind 0, SREG after ^ before, PC, opcode, SREG after, number of writes) followed
+# by that many write records (kind 1, new value, address, old value, 0, 0)
+TRACE_MAGIC = b'AVRTRC1\n'
+TRACE_RECORD = struct.Struct('<BBHHBB') # 8 bytes, little endian
+TRACE_STEP = 0
+TRACE_WRITE = 1
+
+# One instruction read back from a trace. writes is a tuple of (address, old value, new value)
+TraceStep = collections.namedtuple('TraceStep', ['pc', 'opcode', 'sreg_before', 'sreg_after', 'writes'])
+
+class TraceWriter:
+    """
+    Appends trace records to a file, gzipped if
+    \'compress\' (or the path ends in .gz). Records are
+    buffered & written \'buffer_size\' bytes at a time.
+    """
+
+    def __init__(self, path, compress=None, buffer_size=1 << 16):
+        if compress is None: compress = path.endswith('.gz')
+        self.file = gzip.open(path, 'wb') if compress else open(path, 'wb')
+        self.file.write(TRACE_MAGIC)
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+
+    def write_step(self, pc, opcode, sreg_before, sreg_after, writes):
+        pack = TRACE_RECORD.pack
+        self.buffer += pack(TRACE_STEP, sreg_before ^ sreg_after, pc, opcode, sreg_after, len(writes))
+        for addr, old, new in writes:
+            self.buffer += pack(TRACE_WRITE, new, addr, old, 0, 0)
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_trace(path, chunk_records=8192):
+    """
+    Lazily yields a TraceStep for each instruction
+    in a trace file (gzipped or not).
+    """
+
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+
+    with (gzip.open(path, 'rb') if compressed else open(path, 'rb')) as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f'{path} is not a trace file')
+
+        step = None
+        writes = []
+        while True:
+            chunk = f.read(chunk_records * TRACE_RECORD.size)
+            if not chunk:
+                break
+
+            for kind, a, addr, b, c, count in TRACE_RECORD.iter_unpack(chunk):
+                if kind == TRACE_WRITE:
+                    writes.append((addr, b, a))
+                    continue
+
+                if step is not None:
+                    yield TraceStep(*step, tuple(writes))
+                step = (addr, b, c ^ a, c) # pc, opcode, SREG before, SREG after
+                writes = []
+
+        if step is not None:
+            yield TraceStep(*step, tuple(writes))
+
+def diff_traces(path, reference_path):
+    """
+    Compares two traces step by step. Returns None if they
+    match, or (step number, step, reference step) for the
+    first difference (a step is None where a trace ended).
+    """
+
+    steps = read_trace(path)
+    reference = read_trace(reference_path)
+    for i, (step, ref_step) in enumerate(itertools.zip_longest(steps, reference)):
+        if step != ref_step:
+            return i, step, ref_step
+    return None
+
+
+##################################################################################################################
+#  IMAGES
+##################################################################################################################
+
+HEX_RECORD_SIZE = 16 # data bytes per Intel HEX line, as avr-objcopy writes
+
+def encode_program(instructions):
+    """
+    Returns the machine code of a parsed program
+    as a list of 16 bit words, one per PMEM address.
+    """
+
+    words = []
+    for instruction in instructions:
+        if instruction is not None: # the second word comes from the double length instruction before
+            words.extend(encode_instruction(instruction))
+    return words
+
+def flash_image(words):
+    """
+    Returns opcode words as a little endian
+    flash image (the layout of a .bin file).
+    """
+
+    return struct.pack(f'<{len(words)}H', *words)
+
+def hex_record(address, kind, data=b''):
+    """
+    Returns one Intel HEX line (without the
+    newline), checksum included.
+    """
+
+    record = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, kind]) + data
+    return f':{record.hex().upper()}{-sum(record) & 0xFF:02X}'
+
+def intel_hex(image):
+    """
+    Returns bytes as Intel HEX text starting at address 0,
+    with extended linear address records past 64 KiB.
+    """
+
+    lines = []
+    upper = 0
+    for address in range(0, len(image), HEX_RECORD_SIZE):
+        if (address >> 16) != upper: # 64 KiB is a whole number of records
+            upper = address >> 16
+            lines.append(hex_record(0, 4, upper.to_bytes(2, 'big')))
+        lines.append(hex_record(address, 0, image[address:address + HEX_RECORD_SIZE]))
+
+    lines.append(hex_record(0, 1)) # end of file
+    return '\n'.join(lines) + '\n'
+
+def export_program(fn, text, prefix):
+    """
+    Assembles the text through ASSEMBLY_CACHE & writes
+    the flash image to \'prefix\'.hex (Intel HEX) & .bin
+    (raw) and the initial .data bytes (loaded to RAM
+    at 0x100) to \'prefix\'.eep (Intel HEX from 0).
+    Returns ({kind: path}, None) or (None, error string).
+    """
+
+    entry, error = ASSEMBLY_CACHE.assemble(fn, text)
+    if error:
+        return None, error
+
+    instructions, data = entry[0], entry[1]
+    try: flash = flash_image(encode_program(instructions))
+    except ValueError as e: # nothing is written rather than a wrong image
+        return None, f'{e}\n'
+    paths = {'hex': f'{prefix}.hex', 'bin': f'{prefix}.bin', 'eep': f'{prefix}.eep'}
+
+    with open(paths['hex'], 'w') as f:
+        f.write(intel_hex(flash))
+    with open(paths['bin'], 'wb') as f:
+        f.write(flash)
+    with open(paths['eep'], 'w') as f:
+        f.write(intel_hex(bytes(byte % 256 for byte in data)))
+
+    return paths, None
+
+
+IMAGE_EXTENSIONS = ['.hex', '.bin'] # flash images run without assembling (see load_image())
+
+DECODE_TABLE = None # built by make_decode_table() the first time an image is loaded
+
+def make_decode_table():
+    """
+    Returns a list of 65536 (instruction, record, fixup)
+    indexed by opcode word, or (None, None, None) for
+    words that aren\'t a supported instruction. Built
+    by encoding every operand INST_OPERANDS allows, with
+    the inst using the fewest operand bits (then the first
+    in INST_ENCODING) winning when two encode the same
+    (eg BREQ over BRBS 1, LD Y over LDD Y+0). Records are decoded at PC 0 & \'fixup\' is
+    what still depends on the address:
+        \'k\':    the relative jump target (add the PC)
+        \'skip\': where SBRC/SBRS skip to
+        int:    index of an address in the second word
+    """
+
+    table = [(None, None, None)] * 0x10000
+    table_bits = [None] * 0x10000 # operand bits of each word's inst
+
+    for key, (pattern, *fields) in INST_ENCODING.items():
+        inst, *pointer = key.split()
+        opcode, words, operands = INST_ENCODERS[key]
+        bits = sum(bit not in '01' for bit in pattern[:16])
+
+        fixup = None
+        domains = []
+        for i, letters in enumerate(fields):
+            if not letters: # the pointer picked the pattern
+                domains.append(pointer or ['Z'])
+                continue
+
+            if (words == 2) and ('k' in letters): # only the top bits of the address are in the first word
+                domains.append([high << 16 for high in range(1 << pattern[:16].count('k'))])
+                fixup = i + 1
+                continue
+
+            spec = INST_OPERANDS[inst][i]
+            values = spec[1] if isinstance(spec[1], list) else range(spec[1], spec[2] + 1)
+            if spec[0] in 'dr': values = [f'R{value}' for value in values]
+            domains.append(values)
+            if INST_DECODE[inst][i] == 'k': fixup = 'k'
+
+        if inst in ['SBRC', 'SBRS']: fixup = 'skip'
+
+        for values in itertools.product(*domains):
+            instruction = [inst, *values]
+            word = encode_instruction(instruction)[0]
+            if (table_bits[word] is None) or (bits < table_bits[word]) or (table_bits[word] == bits and table[word][0][0] == inst):
+                table[word] = (instruction, decode_instruction([instruction], 0), fixup)
+                table_bits[word] = bits
+
+    return table
+
+def decode_words(words):
+    """
+    Decodes opcode words with one DECODE_TABLE lookup each.
+    Returns (instructions, records) for PMEM addresses 0 to
+    len(words), the same as the parser & decode_program()
+    give for the program, with None & a NOP record for
+    the second word of double length instructions.
+    Raises ValueError for unsupported words.
+    """
+
+    global DECODE_TABLE
+    if DECODE_TABLE is None:
+        DECODE_TABLE = make_decode_table()
+    table = DECODE_TABLE
+
+    instructions = []
+    program = []
+    pc = 0
+    while pc < len(words):
+        instruction, record, fixup = table[words[pc]]
+        if instruction is None:
+            raise ValueError(f'Unsupported opcode {words[pc]:#06x} at address {pc}')
+
+        if fixup is None:
+            pass
+
+        elif fixup == 'k': # relative jump, decoded at PC 0
+            handler, operands = record
+            record = (handler, operands[:-1] + (operands[-1] + pc,))
+
+        elif fixup == 'skip': # jumps over both words of a double length instruction
+            handler, operands = record
+            skip = pc + 3 if (pc + 1 < len(words)) and isinstance(table[words[pc + 1]][2], int) else pc + 2
+            record = (handler, operands[:-1] + (skip,))
+
+        else: # address in the second word
+            if pc + 1 >= len(words):
+                raise ValueError(f'Missing the second word of {instruction[0]} at address {pc}')
+
+            instruction = list(instruction)
+            instruction[fixup] |= words[pc + 1]
+            if (instruction[0] == 'CALL') and (instruction[1] == FUNCTION_ADDRESS):
+                instruction = ['CALL', 'PRINTF'] # the only built in function
+            record = decode_instruction([instruction], 0)
+
+        instructions.append(instruction)
+        program.append(record)
+        if isinstance(fixup, int):
+            instructions.append(None)
+            program.append((Interpreter.nop_instruction, ()))
+            pc += 1
+        pc += 1
+
+    return instructions, program
+
+def read_intel_hex(path):
+    """
+    Returns the bytes of an Intel HEX file, with
+    any gaps between records filled with 0.
+    Raises ValueError for malformed records.
+    """
+
+    image = bytearray()
+    upper = 0
+    with open(path, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                if line[0] != ':': raise ValueError
+                record = bytes.fromhex(line[1:])
+                if (len(record) < 5) or (len(record) != record[0] + 5): raise ValueError
+            except ValueError:
+                raise ValueError(f'Malformed record on line {line_num}')
+
+            if sum(record) & 0xFF:
+                raise ValueError(f'Bad checksum on line {line_num}')
+
+            kind = record[3]
+            data = record[4:-1]
+            if kind == 0: # data
+                address = upper + ((record[1] << 8) | record[2])
+                if len(image) < address + len(data):
+                    image.extend(bytes(address + len(data) - len(image)))
+                image[address:address + len(data)] = data
+            elif kind == 1: # end of file
+                break
+            elif kind == 2: # extended segment address
+                upper = int.from_bytes(data, 'big') << 4
+            elif kind == 4: # extended linear address
+                upper = int.from_bytes(data, 'big') << 16
+
+    return bytes(image)
+
+def load_image(fn):
+    """
+    Loads a flash image written by export_program() (or
+    avr-objcopy) from Intel HEX (.hex) or raw (.bin), with
+    the initial .data bytes from the .eep next to it if
+    there is one. Returns ([instructions, data, PMEM,
+    program, labels], None) like AssemblyCache.assemble()
+    (with no labels), or (None, error string).
+    """
+
+    try:
+        if os.path.splitext(fn)[1].lower() == '.hex': image = read_intel_hex(fn)
+        else:
+            with open(fn, 'rb') as f:
+                image = f.read()
+
+        data_fn = os.path.splitext(fn)[0] + '.eep'
+        data = list(read_intel_hex(data_fn)) if os.path.exists(data_fn) else []
+
+        if len(image) % 2:
+            raise ValueError('Flash image has an odd number of bytes')
+        if len(image) > 2 * PMEM_SIZE:
+            raise ValueError(f'Flash image is larger than {2 * PMEM_SIZE} bytes')
+
+        instructions, program = decode_words(struct.unpack(f'<{len(image) // 2}H', image))
+
+    except (OSError, ValueError) as e:
+        return None, f'Invalid Image: {e}\nFile {fn}\n'
+
+    PMEM = make_pmem(instructions)
+    program += [(Interpreter.nop_instruction, ())] * (PMEM_SIZE - len(program))
+    return [instructions, data, PMEM, program, {}], None
+
+def load_program(fn, text):
+    """
+    Returns load_image(fn) for flash images, otherwise
+    assembles the text through ASSEMBLY_CACHE.
+    """
+
+    if os.path.splitext(fn)[1].lower() in IMAGE_EXTENSIONS:
+        return load_image(fn)
+    return ASSEMBLY_CACHE.assemble(fn, text)
+
+def read_source(fn):
+    """
+    Returns the text of an assembly file, or \'\'
+    for a flash image, which load_image() reads.
+    """
+
+    if os.path.splitext(fn)[1].lower() in IMAGE_EXTENSIONS:
+        return ''
+
+    with open(fn, 'r') as f:
+        return f.read()
+
+
+##################################################################################################################
+#  GRADING
+##################################################################################################################
+
+ASM_EXTENSIONS = ['.asm', '.s', '.txt'] # files picked up from a directory
+GRADE_MAX_STEPS = 10_000_000 # default limits, so a submission that never ends can't hang the batch
+GRADE_TIME_LIMIT = 10.0 # seconds per test
+
+def find_asm_files(pattern):
+    """
+    Returns the sorted assembly files in a directory
+    (.asm, .s & .txt) or matching a glob pattern.
+    """
+
+    if os.path.isdir(pattern):
+        files = [os.path.join(pattern, fn) for fn in os.listdir(pattern)]
+        return sorted(fn for fn in files if os.path.splitext(fn)[1].lower() in ASM_EXTENSIONS)
+
+    return sorted(glob.glob(pattern))
+
+def load_test_vectors(fn):
+    """
+    Reads a JSON list of test vectors, eg
+    [{"name": "small", "inputs": {"registers": {"R16": 5}, "ram": {"0x100": [1, 2]}},
+      "expected": {"registers": {"R17": 3}, "ram": {"0x110": [3]}, "output": "3\\n"}}]
+    """
+
+    with open(fn, 'r') as f:
+        return json.load(f)
+
+def apply_inputs(interpreter, inputs):
+    """
+    Sets the registers & RAM given in
+    a test vector\'s inputs.
+    """
+
+    for reg, val in inputs.get('registers', {}).items():
+        interpreter.dmem[REGISTER_FILE.index(reg.upper())] = val % 256
+
+    for start, vals in inputs.get('ram', {}).items():
+        start = int(start, 0)
+        interpreter.dmem[start:start + len(vals)] = bytes(val % 256 for val in vals)
+
+def check_expected(interpreter, output, expected):
+    """
+    Returns a list of the differences between the final
+    state and a test vector\'s expected values.
+    """
+
+    failures = []
+    for reg, val in expected.get('registers', {}).items():
+        actual = interpreter.dmem[REGISTER_FILE.index(reg.upper())]
+        if actual != val % 256:
+            failures.append(f'{reg.upper()} is {actual}, expected {val}')
+
+    for start, vals in expected.get('ram', {}).items():
+        addr = int(start, 0)
+        actual = list(interpreter.dmem[addr:addr + len(vals)])
+        if actual != [val % 256 for val in vals]:
+            failures.append(f'RAM at {start} is {actual}, expected {vals}')
+
+    if ('output' in expected) and (output != expected['output']):
+        failures.append(f'output is {output!r}, expected {expected["output"]!r}')
+
+    if ('max_cycles' in expected) and (interpreter.cycles > expected['max_cycles']):
+        failures.append(f'took {interpreter.cycles} cycles, expected at most {expected["max_cycles"]}')
+
+    return failures
+
+def grade_file(fn, vectors=(), max_steps=None, time_limit=None, cache_dir=None, fuse=False, blocks=False):
+    """
+    Assembles a file once then runs it against each
+    test vector (or once, with no vectors), resetting
+    with Interpreter.restore() in between.
+    Returns the results as a JSON friendly dict.
+    """
+
+    if cache_dir is not None: # this process' cache, shared with the others through the disk
+        ASSEMBLY_CACHE.cache_dir = cache_dir
+
+    result = {'file': fn, 'passed': False, 'error': None, 'tests': []}
+    try:
+        interpreter, error = load_interpreter(fn, read_source(fn))
+        if error:
+            result['error'] = error
+            return result
+
+        if fuse:
+            interpreter.enable_fusion()
+        if blocks:
+            interpreter.enable_blocks()
+        initial_state = interpreter.snapshot()
+
+        for vector in (vectors or [{'name': 'run'}]):
+            interpreter.restore(initial_state)
+            apply_inputs(interpreter, vector.get('inputs', {}))
+
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # PRINTF also prints, keep workers quiet
+                steps, output, error = run_interpreter(interpreter, max_steps, time_limit)
+
+            if (error is None) and (not interpreter.file_end):
+                error = f'Step limit of {max_steps} reached\n'
+
+            failures = [] if error else check_expected(interpreter, output, vector.get('expected', {}))
+            result['tests'].append({
+                'name': vector.get('name', ''),
+                'passed': (error is None) and (not failures),
+                'steps': steps,
+                'cycles': interpreter.cycles,
+                'output': output,
+                'error': error,
+                'failures': failures
+            })
+
+    except Exception as e: # a bad submission shouldn't take down the whole batch
+        result['error'] = f'{type(e).__name__}: {e}\n'
+        return result
+
+    result['passed'] = all(test['passed'] for test in result['tests'])
+    return result
+
+def grade(pattern, vectors=(), max_steps=GRADE_MAX_STEPS, time_limit=GRADE_TIME_LIMIT, workers=None, cache_dir=None, fuse=False, blocks=False):
+    """
+    Grades every assembly file in a directory or glob
+    pattern over a pool of processes. Returns a list
+    of grade_file() results in file order. At least
+    one of \'max_steps\' & \'time_limit\' is needed.
+    """
+
+    if (max_steps is None) and (time_limit is None):
+        raise ValueError('Grading needs a step or time limit, a program that never ends would never finish')
+
+    files = find_asm_files(pattern)
+    if not files:
+        raise FileNotFoundError(f'No assembly files match \'{pattern}\'')
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(grade_file, fn, vectors, max_steps, time_limit, cache_dir, fuse, blocks) for fn in files]
+        for fn, job in zip(files, jobs):
+            try: results.append(job.result())
+            except Exception as e: # eg BrokenProcessPool when a worker dies, recorded against the file
+                results.append({'file': fn, 'passed': False, 'error': f'{type(e).__name__}: {e}\n', 'tests': []})
+    return results
+
+
+##################################################################################################################
 #  SIM
 ##################################################################################################################
 
 class App:
 
-    def __init__(self, root, data):
+    def __init__(self, root, data, steps_per_frame=5000):
         self.root = root
         self.data = data
-        self.data_copy = copy.deepcopy(data)
-        self.interpreter = Interpreter(self.data[0], self.data[1], self.data[2], self.data[3])
+        self.interpreter = Interpreter(*self.data)
+        self.interpreter.output.sinks.append(self.write_console) # PRINTF output
+        self.interpreter.enable_history() # for stepping backwards
+        self.initial_state = self.interpreter.snapshot() # for resetting
         self.dmem_length = len(self.data[0])
         self.pmem_length = len(self.data[1])
         
         self.root.title('AVR Sim')
 
-        self.reload = 0     # if true when the app closes, the app will reboot (for when updating code)
+        self.reload = 0     # if true when the app closes, the app will reboot (for when updating code)
+
+        ########## Running ##########
+        self.steps_per_frame = steps_per_frame  # instructions run before handing back to Tk
+        self.frame_time = 1/30                  # min seconds between redraws while running (~30Hz)
+        self.run_job = None                     # the pending root.after call while running
+        self.last_draw = 0
+        self.console_lines = 1000               # scrollback kept in the console
+
+        ########## Key Binds ##########
+        self.root.protocol("WM_DELETE_WINDOW", self.root.quit)              # exit correctly with close window button
+        self.root.bind("<Escape>", lambda e: self.root.quit())              # exit with < Esc >
+        self.root.bind("<Control-r>", lambda e: self.run())                 # run with < Ctrl+R >
+        self.root.bind("<Control-s>", lambda e: self.step())                # step with < Ctrl+S >
+        self.root.bind("<Control-b>", lambda e: self.step_back())           # step backwards with < Ctrl+B >
+        self.root.bind("<Control-B>", lambda e: self.reverse_continue())    # go back to the start with < Ctrl+Shift+B >
+        self.root.bind("<Control-e>", lambda e: self.reset())               # reset with < Ctrl+E >
+        self.root.bind("<Control-c>", lambda e: self.clear_console())       # clear console with < Ctrl+C >
+        self.root.bind("<Control-u>", lambda e: self.refresh())             # nupdate file with < Ctrl+U >
+        self.root.bind("<Control-n>", lambda e: self.new())                 # open new file with < Ctrl+U >
+
+        ########## Window Colours ##########
+        w = 'white'
+        b = 'black'
+        o = 'orange'
+        g = 'gray12'
+        r = 'red'
+        bl = 'blue'
+        v = 'blue violet'
+
+        self.text_colour = b        # colour of all text in boxes
+        self.text_bg = w            # background of text boxes
+        self.background = g         # background of the screen
+        self.label_colour = b       # colour of the title labels
+        self.label_text = w         # colour of the title text
+        self.button_text = b        # colour of text on buttons
+        self.button_colour = o      # colour of the buttons
+        self.change_colour = r      # colour when a value changes from the last operation
+        self.last_PC_colour = bl
+        self.mix_lastPC_change_colour = v
+        self.breakpoint_colour = 'misty rose'   # background of lines with a breakpoint
+        self.watch_colour = 'light yellow'      # background of watched registers & RAM
+
+        self.font = 'Calibri'
+
+        ########## Number Display Type ##########
+            # Options = 2's comp (+-), dec, hex, bin
+        self.num_disp = 'DEC'
+        self.ram_disp = 'DEC'
+
+        ########## Update Tracking ##########
+        self.inst_lines = {}    # (address, type) -> instruction line, for the program in self.data
+        self.last_sreg = self.interpreter.get_sreg_flags()
+
+        self.last_SP = [( self.interpreter.get_SP() % 256 ),
+                        int((self.interpreter.get_SP() - self.interpreter.get_SP()%256) / 256),
+                        hex(self.interpreter.get_SP())]
+
+        ########## Window sizes ##########
+        self.ww = self.root.winfo_screenwidth()      # window width
+        self.wh = round(0.92*self.root.winfo_screenheight())     # window height
+        #self.ww = 1200
+        #self.wh = 750
+        self.root.geometry(f'{self.ww}x{self.wh}')
+        #self.root.attributes('-fullscreen',True)
+
+
+        ########## Display ##########
+        Frame(master=self.root, width=10*self.ww, height=10*self.wh, bg=self.background).place(x=0,y=0)
+
+        self.displayed_before = False
+
+        self.text_boxes()   # initialise input boxes
+        self.buttons()      # initialise buttons
+        self.make_display() # initialise the rest
+        self.display()      # display the rest
+
+    def make_display(self):
+        """
+        Creates the registers, SREG, instructions,
+        RAM & other boxes once. display() only
+        updates what is written in them.
+        """
+
+        label_font_size = round(self.wh/60)
+        frame_height = round(self.wh/30)
+
+        ############ Registers ############
+        regx = 0.48 * self.ww
+        regy = 0.05 * self.wh
+        reg_width = round(self.ww/4.1)
+        reg_height = round(self.wh/1.6)
+
+        reg_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=reg_width)
+        reg_title.place(x=regx,y=regy-(0.04*self.wh), anchor = 'n')
+
+        reg_label = Label(self.root,text='Registers',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
+        reg_label.place(x=regx,y=regy-(0.04*self.wh), anchor = 'n')
+
+        font_size = round(self.wh/65) + 2
+        self.reg_box = Text(self.root,height=18,width=29,bg=self.text_bg,fg=self.text_colour,font=(self.font,font_size))
+        self.reg_box.config(borderwidth=5,relief='sunken')
+        self.reg_box.place(x=regx,y=regy, anchor = 'n')
+        self.reg_box.tag_configure('changed', foreground=self.change_colour)
+        self.reg_box.tag_configure('watched', background=self.watch_colour)
+        self.reg_box.bind('<Double-Button-1>', self.toggle_register_watch)
+
+
+        ############ SREG ############
+        sregx = 0.48 * self.ww
+        sregy = 0.78 * self.wh
+
+        sreg_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=reg_width)
+        sreg_title.place(x=sregx,y=sregy-(0.04*self.wh), anchor = 'n')
+
+        sreg_label = Label(self.root,text='Status Register',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
+        sreg_label.place(x=sregx,y=sregy-0.04*self.wh, anchor = 'n')
+
+        font_size = round(self.wh/65) + 4
+        self.sreg_box = Text(self.root,font=(self.font,font_size),height=2,width=24,bg=self.text_bg,fg=self.text_colour)
+        self.sreg_box.config(borderwidth=5,relief='sunken')
+        self.sreg_box.place(x=sregx,y=sregy, anchor = 'n')
+        self.sreg_box.tag_configure('changed', foreground=self.change_colour)
+
+
+        ############ Instructions ############
+        instx = 0.255 * self.ww
+        insty = 0.05 * self.wh
+        inst_width = round(self.ww/6)
+        inst_height = round(self.wh/1.4)
+
+        inst_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=inst_width)
+        inst_title.place(x=instx,y=insty-0.04*self.wh, anchor = 'n')
+
+        inst_label = Label(self.root,text='Instructions',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
+        inst_label.place(x=instx,y=insty-0.04*self.wh, anchor = 'n')
+
+        font_size = round(self.wh/100) + 2
+        self.inst_box = Text(self.root,height=50-font_size,width=26,bg=self.text_bg,fg=self.text_colour)
+        self.inst_box.config(font=(self.font,font_size),borderwidth=5,relief='sunken')
+        self.inst_box.place(x=instx, y=insty, anchor = 'n')
+        self.inst_box.tag_configure("Last Line", foreground=self.last_PC_colour,background=self.text_bg)
+        self.inst_box.tag_configure("Breakpoint", background=self.breakpoint_colour)
+        self.inst_box.bind('<Double-Button-1>', self.toggle_breakpoint)   # breakpoint
+        self.inst_box.bind('<Button-3>', self.conditional_breakpoint)     # breakpoint with a condition
+
+        self.inst_rows = 50 - font_size     # lines visible in the box
+        self.inst_margin = 20               # extra lines either side to scroll into
+        self.inst_window = None             # (first, last, type) of the lines currently in the box
+
+        inst_scrollbar = Scrollbar(self.root, orient='vertical',command=self.inst_box.yview)
+        inst_scrollbar.place(x=instx + 0.082*self.ww,y=insty,height=inst_height, anchor = 'ne')
+
+
+        ############ RAM ############
+        ramx = 0.705 * self.ww
+        ramy = 0.05 * self.wh
+
+        ram_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=inst_width)
+        ram_title.place(x=ramx,y=ramy-0.04*self.wh, anchor = 'n')
+
+        ram_label = Label(self.root,text='RAM',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
+        ram_label.place(x=ramx,y=ramy-0.04*self.wh, anchor = 'n')
+
+        font_size = round(self.wh/100) + 2
+        self.ram_box = Text(self.root,height=50-font_size,width=26,bg=self.text_bg,fg=self.text_colour)
+        self.ram_box.config(font=(self.font,font_size),borderwidth=5,relief='sunken')
+        self.ram_box.place(x=ramx, y=ramy, anchor = 'n')
+
+        self.ram_scrollbar = Scrollbar(self.root, orient='vertical',command=self.ram_box.yview)
+        self.ram_scrollbar.place(x=ramx + 0.082*self.ww,y=ramy,height=inst_height, anchor = 'ne')
+        self.ram_box.tag_configure('changed', foreground=self.change_colour)
+        self.ram_box.tag_configure('watched', background=self.watch_colour)
+        self.ram_box.bind('<Double-Button-1>', self.toggle_ram_watch)
+
+        self.ram_rows = 50 - font_size      # rows visible in the box
+        self.ram_margin = 20                # extra rows either side to scroll into
+        self.ram_window = None              # (first, last, types) of the rows currently in the box
+
+
+        #### Other
+        otherx = 0.89 * self.ww
+        othery = 0.05 * self.wh
+        other_width = round(self.ww/6)
+        font_size = round(self.wh/50) + 2
+
+        Other_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=other_width)
+        Other_title.place(x=otherx,y=othery-0.04*self.wh, anchor = 'n')
+
+        Other_label = Label(self.root,text='Other',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
+        Other_label.place(x=otherx,y=othery-0.04*self.wh, anchor = 'n')
+
+            #PC Box
+        self.PC_box = Text(self.root,height=2,width=15,bg=self.text_bg,fg=self.text_colour)
+        self.PC_box.config(borderwidth=5,relief='sunken',font=(self.font,font_size))
+        self.PC_box.place(x=otherx, y=othery, anchor = 'n')
 
-        ########## Key Binds ##########
-        self.root.protocol("WM_DELETE_WINDOW", self.root.quit)              # exit correctly with close window button
-        self.root.bind("<Escape>", lambda e: self.root.quit())              # exit with < Esc >
-        self.root.bind("<Control-r>", lambda e: self.run())                 # run with < Ctrl+R >
-        self.root.bind("<Control-s>", lambda e: self.step())                # step with < Ctrl+S >
-        self.root.bind("<Control-e>", lambda e: self.reset())               # reset with < Ctrl+E >
-        self.root.bind("<Control-c>", lambda e: self.clear_console())       # clear console with < Ctrl+C >
-        self.root.bind("<Control-u>", lambda e: self.refresh())             # nupdate file with < Ctrl+U >
-        self.root.bind("<Control-n>", lambda e: self.new())                 # open new file with < Ctrl+U >
+            # XYZ Box
+        self.XYZ_box = Text(self.root,height=3,width=15,bg=self.text_bg,fg=self.text_colour)
+        self.XYZ_box.config(borderwidth=5,relief='sunken',font=(self.font,font_size))
+        self.XYZ_box.place(x=otherx, y=othery+0.12*self.wh, anchor = 'n')
+        self.XYZ_box.tag_configure('changed', foreground=self.change_colour,background=self.text_bg)
 
-        ########## Window Colours ##########
-        w = 'white'
-        b = 'black'
-        o = 'orange'
-        g = 'gray12'
-        r = 'red'
-        bl = 'blue'
-        v = 'blue violet'
+            # SP BOX
+        self.SP_box = Text(self.root,height=3,width=15,bg=self.text_bg,fg=self.text_colour)
+        self.SP_box.config(borderwidth=5,relief='sunken',font=(self.font,font_size))
+        self.SP_box.place(x=otherx, y=othery+0.28*self.wh, anchor = 'n')
+        self.SP_box.tag_configure('changed', foreground=self.change_colour,background=self.text_bg)
 
-        self.text_colour = b        # colour of all text in boxes
-        self.text_bg = w            # background of text boxes
-        self.background = g         # background of the screen
-        self.label_colour = b       # colour of the title labels
-        self.label_text = w         # colour of the title text
-        self.button_text = b        # colour of text on buttons
-        self.button_colour = o      # colour of the buttons
-        self.change_colour = r      # colour when a value changes from the last operation
-        self.last_PC_colour = bl
-        self.mix_lastPC_change_colour = v
+            # Cycles Box (under the console)
+        self.cycles_box = Text(self.root,height=2,width=27,bg=self.text_bg,fg=self.text_colour)
+        self.cycles_box.config(borderwidth=5,relief='sunken',font=(self.font,round(self.wh/80)))
+        self.cycles_box.place(x=otherx, y=othery+0.84*self.wh, anchor = 'n')
 
-        self.font = 'Calibri'
+    def get_inst_line(self, i):
+        """
+        Returns the line shown for PMEM address i.
+        BIN & HEX lines are cached since they only
+        change when a new program is loaded.
+        """
 
-        ########## Number Display Type ##########
-            # Options = 2's comp (+-), dec, hex, bin
-        self.num_disp = 'DEC'
-        self.ram_disp = 'DEC'
+        key = (i, self.num_disp in ('BIN', 'HEX') and self.num_disp)
+        if key in self.inst_lines:
+            return self.inst_lines[key]
 
-        ########## Update Tracking ##########
-        self.last_sreg = [i for i in self.interpreter.sreg.value]
+        inst_ls = self.interpreter.pmem[i]
+        if self.num_disp in ('BIN', 'HEX'): # machine code
+            if inst_ls == None: word = encode_instruction(self.interpreter.pmem[i-1])[1] # second word
+            else: word = encode_instruction(inst_ls)[0]
 
-        self.last_SP = [( self.interpreter.get_SP() % 256 ),
-                        int((self.interpreter.get_SP() - self.interpreter.get_SP()%256) / 256),
-                        hex(self.interpreter.get_SP())]
+            if self.num_disp == 'BIN': inst = f'{i}: {word:016b}\n'
+            else: inst = f'{i}: {word:#06x}\n'
 
-        ########## Window sizes ##########
-        self.ww = self.root.winfo_screenwidth()      # window width
-        self.wh = round(0.92*self.root.winfo_screenheight())     # window height
-        #self.ww = 1200
-        #self.wh = 750
-        self.root.geometry(f'{self.ww}x{self.wh}')
-        #self.root.attributes('-fullscreen',True)
+        else: # regular instructions
+            if inst_ls == None: inst = f'{i}: (double size inst.)\n'
+            elif len(inst_ls) == 1: inst = f'{i}: {inst_ls[0]}\n'
+            elif len(inst_ls) == 2: inst = f'{i}: {inst_ls[0]} {inst_ls[1]}\n'
+            elif len(inst_ls) == 3: inst = f'{i}: {inst_ls[0]} {inst_ls[1]}, {inst_ls[2]}\n'
+            elif inst_ls[0] == 'STD': inst = f'{i}: {inst_ls[0]} {inst_ls[1]}{inst_ls[2]}, {inst_ls[3]}\n'
+            elif inst_ls[0] == 'LDD': inst = f'{i}: {inst_ls[0]} {inst_ls[1]}, {inst_ls[2]}{inst_ls[3]}\n'
 
+        self.inst_lines[key] = inst
+        return inst
 
-        ########## Display ##########
-        Frame(master=self.root, width=10*self.ww, height=10*self.wh, bg=self.background).place(x=0,y=0)
+    def get_ram_line(self, i):
+        """
+        Returns the row shown for RAM address i.
+        """
 
-        self.displayed_before = False
+        val = self.convert_val_to_type(self.interpreter.dmem[i], True, False)
+        return f'{hex(i)}: {val}'
 
-        self.text_boxes()   # initialise input boxes
-        self.buttons()      # initialise buttons
-        self.display()      # display the rest
+    def clear_box(self, box):
+        """
+        Empties a display box (and its tags)
+        so it can be written to again.
+        """
 
-    def display(self):
-        label_font_size = round(self.wh/60)
-        frame_height = round(self.wh/30)
+        box.config(state=NORMAL)
+        box.delete('1.0', END)
 
-        sreg = self.interpreter.sreg
+    def display(self):
+        sreg = self.interpreter.get_sreg_flags()
 
         ############ Fixing any text box issues ############
         steps = self.step_box.get('1.0',END)
@@ -3021,46 +4898,13 @@ class App:
                     break
         
         ############ Registers ############
-        regx = 0.48 * self.ww
-        regy = 0.05 * self.wh
-        reg_width = round(self.ww/4.1)
-        reg_height = round(self.wh/1.6)
-
-        reg_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=reg_width)
-        reg_title.place(x=regx,y=regy-(0.04*self.wh), anchor = 'n')
-
-        reg_label = Label(self.root,text='Registers',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
-        reg_label.place(x=regx,y=regy-(0.04*self.wh), anchor = 'n')
-       
-
-
-        #reg_box = Frame(self.root,height=reg_height,width=reg_width,bg=self.text_bg,borderwidth=5,relief='sunken')
-        #reg_box.place(x=regx,y=regy, anchor = 'n')
-        #
-        #for i in range(32):
-        #    reg = self.interpreter.dmem[i]
-        #    val = self.convert_val_to_type(reg.value, False)
-        #    disp = f'R{i}: ' + ('  ' * int(i < 10)) + f'{val}'
-        #    if reg.changed == 1:
-        #        reg_label = Label(text=disp,font=(self.font,15),bg=self.text_bg,fg=self.change_colour)
-        #    else:
-        #        reg_label = Label(text=disp,font=(self.font,15),bg=self.text_bg,fg=self.text_colour)
-        #    x = regx + (- 0.11 + ( 0.11 * int(i > 15) )) * self.ww
-        #    y = regy + (0.018 + (i * 0.037) - (0.592 * int(i > 15))) * self.wh
-        #    reg_label.place(x=x, y=y)
-        #    reg.new_instruct()
-
-
-        font_size = round(self.wh/65) + 2
-        reg_box = Text(self.root,height=18,width=29,bg=self.text_bg,fg=self.text_colour,font=(self.font,font_size))
-        reg_box.config(borderwidth=5,relief='sunken')
-        reg_box.place(x=regx,y=regy, anchor = 'n')
-
+        reg_box = self.reg_box
+        self.clear_box(reg_box)
 
         reg_box.insert(END,'\n')
         for i in range(16):
-            val1 = str(self.convert_val_to_type(self.interpreter.dmem[i].value, False, False))
-            val2 = str(self.convert_val_to_type(self.interpreter.dmem[i+16].value, False, False))
+            val1 = str(self.convert_val_to_type(self.interpreter.dmem[i], False, False))
+            val2 = str(self.convert_val_to_type(self.interpreter.dmem[i+16], False, False))
             
             if self.num_disp == 'BIN':
                 val1 = val1[2:]
@@ -3070,80 +4914,38 @@ class App:
             line_b = f'R{i+16}: {val2}\n'
             reg_box.insert(END, line_a + line_b)
 
-            if self.interpreter.dmem[i].changed == 1:
-                reg_box.tag_add(str(i), f'{i+2}.0', f'{i+2}.{len(line_a)}')
-                reg_box.tag_configure(str(i), foreground=self.change_colour)
+            if self.interpreter.changed[i]:
+                reg_box.tag_add('changed', f'{i+2}.0', f'{i+2}.{len(line_a)}')
             
-            if self.interpreter.dmem[i+16].changed == 1:
-                reg_box.tag_add(str(i+16), f'{i+2}.{len(line_a)}', f'{i+2}.{len(line_a + line_b)}')
-                reg_box.tag_configure(str(i+16), foreground=self.change_colour)
-
-        reg_box.config(state=DISABLED)
-        
+            if self.interpreter.changed[i+16]:
+                reg_box.tag_add('changed', f'{i+2}.{len(line_a)}', f'{i+2}.{len(line_a + line_b)}')
 
-        ############ SREG ############
-        sregx = 0.48 * self.ww
-        sregy = 0.78 * self.wh
-        sreg_width = round(self.ww/4)
-        sreg_height = round(self.wh/10.2)
+            if i in self.interpreter.watchpoints:
+                reg_box.tag_add('watched', f'{i+2}.0', f'{i+2}.{len(line_a)}')
 
-        sreg_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=reg_width)
-        sreg_title.place(x=sregx,y=sregy-(0.04*self.wh), anchor = 'n')
+            if (i+16) in self.interpreter.watchpoints:
+                reg_box.tag_add('watched', f'{i+2}.{len(line_a)}', f'{i+2}.{len(line_a + line_b) - 1}')
 
-        sreg_label = Label(self.root,text='Status Register',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
-        sreg_label.place(x=sregx,y=sregy-0.04*self.wh, anchor = 'n')
-        
-        #sreg_box = Frame(self.root,height=sreg_height,width=sreg_width,bg=self.text_bg,borderwidth=5,relief='sunken')
-        #sreg_box.place(x=sregx,y=sregy, anchor = 'n')
-
-        #flags = ['I', 'T', 'H', 'S', 'V', 'N', 'Z', 'C']
-        #for i in range(8):
-        #    x = sregx + (- 1/8 + 0.026*(i+1)) * self.ww
-        #    y = sregy + 0.01 * self.wh
-        #    
-        #    if sreg.value[i] != self.last_sreg[i]:
-        #        sreg_label = Label(text=flags[i],font=(self.font,20),bg=self.text_bg,fg=self.change_colour)
-        #        val_label = Label(text=sreg.value[i],font=(self.font,20),bg=self.text_bg,fg=self.change_colour)
-        #    
-        #    else:
-        #        sreg_label = Label(text=flags[i],font=(self.font,20),bg=self.text_bg,fg=self.text_colour)
-        #        val_label = Label(text=sreg.value[i],font=(self.font,20),bg=self.text_bg,fg=self.text_colour)
-        #    
-        #    sreg_label.place(x=x, y=y)
-        #    val_label.place(x=x, y=y + 0.035*self.wh)
+        reg_box.config(state=DISABLED)
         
-        font_size = round(self.wh/65) + 4
-        sreg_box = Text(self.root,font=(self.font,font_size),height=2,width=24,bg=self.text_bg,fg=self.text_colour)
-        sreg_box.config(borderwidth=5,relief='sunken')
-        sreg_box.place(x=sregx,y=sregy, anchor = 'n')
 
-        flags = ['I', 'T', 'H', 'S', 'V', 'N', 'Z', 'C']
+        ############ SREG ############
+        sreg_box = self.sreg_box
+        self.clear_box(sreg_box)
 
-        sreg_box.insert(END, f'   I    T    H    S    V    N    Z    C\n   {sreg.value[0]}')
+        sreg_box.insert(END, f'   I    T    H    S    V    N    Z    C\n   {sreg[0]}')
         for i in range(1,8):
-            sreg_box.insert(END, f'    {sreg.value[i]}')
-            if sreg.value[i] != self.last_sreg[i]:
-                sreg_box.tag_add(flags[i], f'1.{5*i + 3}', f'1.{5*i + 4}')
-                sreg_box.tag_configure(flags[i], foreground=self.change_colour)
-
-                sreg_box.tag_add(f'{flags[i]}_val', f'2.{5*i + 3}', f'2.{5*i + 4}')
-                sreg_box.tag_configure(f'{flags[i]}_val', foreground=self.change_colour)
+            sreg_box.insert(END, f'    {sreg[i]}')
+            if sreg[i] != self.last_sreg[i]:
+                sreg_box.tag_add('changed', f'1.{5*i + 3}', f'1.{5*i + 4}')
+                sreg_box.tag_add('changed', f'2.{5*i + 3}', f'2.{5*i + 4}')
 
         sreg_box.config(state=DISABLED)
 
-        self.last_sreg = [i for i in sreg.value] # update for next iteration
-
-        sreg_label = Label(text='Status Register',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
-        sreg_label.place(x=sregx,y=sregy-(0.04*self.wh), anchor = 'n')
+        self.last_sreg = sreg # update for next iteration
         
 
         ############ Instructions ############
-        instx = 0.255 * self.ww
-        insty = 0.05 * self.wh
-        inst_width = round(self.ww/6)
-        inst_height = round(self.wh/1.4)
-
-        
         p = self.interpreter.get_pc_val() # for putting into the instruction location box where the instruction is at
         if p < 10:
             self.inst_y_box.delete('1.0', END)
@@ -3152,98 +4954,45 @@ class App:
             self.inst_y_box.delete('1.0', END)
             self.inst_y_box.insert(END, f'{p - 10}')
 
-        inst_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=inst_width)
-        inst_title.place(x=instx,y=insty-0.04*self.wh, anchor = 'n')
+        inst_box = self.inst_box
 
-        inst_label = Label(self.root,text='Instructions',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
-        inst_label.place(x=instx,y=insty-0.04*self.wh, anchor = 'n')
+        # only the lines in view (plus a margin to scroll into) are put in the box
+        top = min(int(self.inst_y_box.get('1.0',END)), max(0, self.pmem_length - self.inst_rows))
+        first = max(0, top - self.inst_margin)
+        last = min(self.pmem_length, top + self.inst_rows + self.inst_margin)
 
-        font_size = round(self.wh/100) + 2
-        inst_box = Text(self.root,height=50-font_size,width=26,bg=self.text_bg,fg=self.text_colour)
-        inst_box.config(font=(self.font,font_size),borderwidth=5,relief='sunken')
-        inst_box.place(x=instx, y=insty, anchor = 'n')
+        window = (first, last, self.num_disp in ('BIN', 'HEX') and self.num_disp)
+        if window != self.inst_window: # the lines themselves only change when scrolling or changing type
+            self.clear_box(inst_box)
+            for i in range(first, last): # inserting into box
+                inst_box.insert(END, self.get_inst_line(i))
+            inst_box.config(state=DISABLED)
+            self.inst_window = window
 
-        inst_scrollbar = Scrollbar(self.root, orient='vertical',command=inst_box.yview)
-        inst_scrollbar.place(x=instx + 0.082*self.ww,y=insty,height=inst_height, anchor = 'ne')
+        inst_box.tag_remove("Last Line", '1.0', END)
+        inst_box.tag_remove("Current Line", '1.0', END)
+        inst_box.tag_remove("Breakpoint", '1.0', END)
 
-        for i in range(self.pmem_length): # inserting into box
-            inst_ls = self.interpreter.pmem[i]
-            if self.num_disp == 'BIN': # binary instructions
-                if inst_ls == None: inst = self.interpreter.get_binary_instruction(self.interpreter.pmem[i-1])[1]
-                else: inst = self.interpreter.get_binary_instruction(inst_ls)
+        for i in self.interpreter.breakpoints:
+            if first <= i < last:
+                inst_box.tag_add("Breakpoint", f'{i-first+1}.0', f'{i-first+2}.0')
 
-                if isinstance(inst, list): inst = inst[0]
-                inst = f'{i}: {inst}\n'
-            
-            elif self.num_disp == 'HEX': # hex instructions
-                if inst_ls == None: inst = self.interpreter.get_binary_instruction(self.interpreter.pmem[i-1])[1]
-                else: inst = self.interpreter.get_binary_instruction(inst_ls)
-                if isinstance(inst, list): inst = inst[0]
-                inst = hex(int(inst, 2))
-                for l in range(len(inst), 6):
-                    inst = inst[0:2] + '0' + inst[2:]
-                inst = f'{i}: {inst}\n'
-
-            else: # regular instructions
-                if inst_ls == None: inst = f'{i}: (double size inst.)\n'
-                elif len(inst_ls) == 1: inst = f'{i}: {inst_ls[0]}\n'
-                elif len(inst_ls) == 2: inst = f'{i}: {inst_ls[0]} {inst_ls[1]}\n'
-                elif len(inst_ls) == 3: inst = f'{i}: {inst_ls[0]} {inst_ls[1]}, {inst_ls[2]}\n'
-                elif inst_ls[0] == 'STD': inst = f'{i}: {inst_ls[0]} {inst_ls[1]}{inst_ls[2]}, {inst_ls[3]}\n'
-                elif inst_ls[0] == 'LDD': inst = f'{i}: {inst_ls[0]} {inst_ls[1]}, {inst_ls[2]}{inst_ls[3]}\n'
-
-            inst_box.insert(END, inst)
-        
-        if isinstance(self.interpreter.last_pc, int):
-            inst_box.tag_add("Last Line", f'{self.interpreter.last_pc+1}.0', f'{self.interpreter.last_pc+2}.0')
-            inst_box.tag_configure("Last Line", foreground=self.last_PC_colour,background=self.text_bg) # colouring the line up to in red
+        last_pc = self.interpreter.last_pc
+        if isinstance(last_pc, int) and (first <= last_pc < last):
+            inst_box.tag_add("Last Line", f'{last_pc-first+1}.0', f'{last_pc-first+2}.0')
 
-        inst_box.tag_add("Current Line", f'{self.interpreter.get_pc_val()+1}.0', f'{self.interpreter.get_pc_val()+2}.0')
+        if first <= p < last:
+            inst_box.tag_add("Current Line", f'{p-first+1}.0', f'{p-first+2}.0')
         inst_box.tag_configure("Current Line", foreground=self.change_colour,background=self.text_bg) # colouring the line up to in red
         
-        if (self.interpreter.last_pc == self.interpreter.get_pc_val()):   # if PC = last PC
+        if (last_pc == p):   # if PC = last PC
             inst_box.tag_configure("Current Line", foreground=self.mix_lastPC_change_colour,background=self.text_bg) # colouring the line up to in red
 
-        inst_box.config(state=DISABLED)
-        #inst_box.yview_moveto(inst_box.yview()[1])
-
-        inst_view = (1 + int(self.inst_y_box.get('1.0',END))) / 0x4001
-        if inst_view >= 1: inst_view = 0x3FD6/0x4001 # last section of the inst memory
-        inst_box.yview_moveto(inst_view)
+        inst_box.yview(f'{top-first+1}.0')
 
 
         ############ RAM ############
-        ramx = 0.705 * self.ww
-        ramy = 0.05 * self.wh
-
-        #if self.displayed_before:
-        #    old_val = round(self.ram_box.yview()[0], 5)
-
-        ram_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=inst_width)
-        ram_title.place(x=ramx,y=ramy-0.04*self.wh, anchor = 'n')
-
-        ram_label = Label(self.root,text='RAM',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
-        ram_label.place(x=ramx,y=ramy-0.04*self.wh, anchor = 'n')
-
-        font_size = round(self.wh/100) + 2
-        self.ram_box = Text(self.root,height=50-font_size,width=26,bg=self.text_bg,fg=self.text_colour)
-        self.ram_box.config(font=(self.font,font_size),borderwidth=5,relief='sunken')
-        self.ram_box.place(x=ramx, y=ramy, anchor = 'n')
-
-        for i in range(0x100, self.dmem_length): # inserting into box
-            val = self.convert_val_to_type(self.interpreter.dmem[i], True, False)
-            val = f'{hex(i)}: {val}\n'
-            self.ram_box.insert(END, val)
-
-        self.ram_scrollbar = Scrollbar(self.root, orient='vertical',command=self.ram_box.yview)
-        self.ram_scrollbar.place(x=ramx + 0.082*self.ww,y=ramy,height=inst_height, anchor = 'ne')
-        
-        #if self.displayed_before:
-        #    self.ram_scrollbar.set(old_val, old_val)
-
-        self.ram_box.config(state=DISABLED)
-        #self.ram_box.yview_moveto(self.ram_box.yview()[1])
-
+        ram_box = self.ram_box
 
         # Converting to values 
         ram_view_val = self.ram_y_box.get('1.0',END)
@@ -3252,45 +5001,43 @@ class App:
             else: ram_view = int(self.ram_y_box.get('1.0',END), 16)
         else: ram_view = int(self.ram_y_box.get('1.0',END))
         
-        if ram_view < 0x100: ram_view = 0x100
-        elif ram_view > DMEM_MAX: ram_view = DMEM_MAX - 42
-        
-        ram_view = (ram_view - 0xFF)/(DMEM_MAX - 0xFF)
-        self.ram_box.yview_moveto(ram_view)
-
-        #if self.displayed_before:
-        #    self.ram_box.yview_moveto(old_val)
+        # only the rows in view (plus a margin to scroll into) are put in the box
+        top = max(0x100, min(ram_view, self.dmem_length - self.ram_rows))
+        first = max(0x100, top - self.ram_margin)
+        last = min(self.dmem_length, top + self.ram_rows + self.ram_margin)
+        changed = self.interpreter.changed
+
+        window = (first, last, self.num_disp, self.ram_disp)
+        if window != self.ram_window: # scrolled, changed type or reset so write every row
+            self.clear_box(ram_box)
+            for i in range(first, last): # inserting into box
+                ram_box.insert(END, self.get_ram_line(i) + '\n')
+                if changed[i]:
+                    ram_box.tag_add('changed', f'{i-first+1}.0', f'{i-first+1}.end')
+            self.ram_window = window
+
+        else: # only rewrite the cells written to since the last refresh
+            ram_box.config(state=NORMAL)
+            ram_box.tag_remove('changed', '1.0', END)
+            i = changed.find(1, first, last)
+            while i != -1:
+                ram_box.delete(f'{i-first+1}.0', f'{i-first+1}.end')
+                ram_box.insert(f'{i-first+1}.0', self.get_ram_line(i), 'changed')
+                i = changed.find(1, i + 1, last)
+
+        ram_box.tag_remove('watched', '1.0', END)
+        for i in self.interpreter.watchpoints:
+            if first <= i < last:
+                ram_box.tag_add('watched', f'{i-first+1}.0', f'{i-first+1}.end')
+
+        ram_box.config(state=DISABLED)
+        ram_box.yview(f'{top-first+1}.0')
 
 
         #### Other
-        otherx = 0.89 * self.ww
-        othery = 0.05 * self.wh
-        other_width = round(self.ww/6)
-        font_size = round(self.wh/50) + 2
-
             #PC Box
-
-        #PC_box = Frame(self.root,height=round(self.wh/10),width=other_width,bg=self.text_bg,borderwidth=5,relief='sunken')
-        #PC_box.place(relx=otherx, rely=othery, anchor = 'n')
-
-        #PC_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=other_width)
-        #PC_title.place(relx=otherx,rely=othery-0.038, anchor = 'n')
-
-        #PC_label = Label(self.root,text='Other',font=(self.font,15),bg=self.label_colour,fg=self.label_text)
-        #PC_label.place(relx=otherx,rely=othery-0.038, anchor = 'n')
-
-        #PC_val_label = Label(self.root,text=f'PC: {self.interpreter.get_pc_val()}',font=(self.font,30),bg=self.text_bg,fg=self.text_colour)
-        #PC_val_label.place(relx=otherx-0.07,rely=othery+0.02, anchor = 'nw')
-
-        Other_title = Frame(self.root, bg=self.label_colour,height=frame_height,width=other_width)
-        Other_title.place(x=otherx,y=othery-0.04*self.wh, anchor = 'n')
-
-        Other_label = Label(self.root,text='Other',font=(self.font,label_font_size),bg=self.label_colour,fg=self.label_text)
-        Other_label.place(x=otherx,y=othery-0.04*self.wh, anchor = 'n')
-
-        PC_box = Text(self.root,height=2,width=15,bg=self.text_bg,fg=self.text_colour)
-        PC_box.config(borderwidth=5,relief='sunken',font=(self.font,font_size))
-        PC_box.place(x=otherx, y=othery, anchor = 'n')
+        PC_box = self.PC_box
+        self.clear_box(PC_box)
 
         PC_box.insert(END, f'  Prev. PC: {self.interpreter.last_pc}')
         PC_box.insert(END, f'\n  PC: {self.interpreter.get_pc_val()}')
@@ -3298,71 +5045,47 @@ class App:
 
 
             # XYZ Box
-
-        #XYZ_box = Frame(self.root,height=round(self.wh/7),width=other_width,bg=self.text_bg,borderwidth=5,relief='sunken')
-        #XYZ_box.place(relx=otherx, rely=othery+0.11, anchor = 'n')
-
-        #xyz = ['X', 'Y', 'Z']
-        #for i in range(3):
-            #val = self.convert_val_to_type(self.interpreter.get_XYZ(xyz[i]), False)
-            #XYZ_val = f'{xyz[i]}: {val}'
-            #XYZ_val_label = Label(self.root,text=XYZ_val,font=(self.font,14),bg=self.text_bg,fg=self.text_colour)
-            #XYZ_val_label.place(relx=otherx-0.075,rely=othery+0.125 + (0.0405 * i), anchor = 'nw')
-
-        XYZ_box = Text(self.root,height=3,width=15,bg=self.text_bg,fg=self.text_colour)
-        XYZ_box.config(borderwidth=5,relief='sunken',font=(self.font,font_size))
-        XYZ_box.place(x=otherx, y=othery+0.12*self.wh, anchor = 'n')
+        XYZ_box = self.XYZ_box
+        self.clear_box(XYZ_box)
 
         for i, elem in enumerate(['X', 'Y', 'Z']):
             val = self.convert_val_to_type(self.interpreter.get_XYZ(elem), False, True)
             XYZ_box.insert(END, f'  {elem}: {val}')
             if elem != 'Z': XYZ_box.insert(END, '\n')
-            if self.interpreter.dmem[26 + 2*i].changed or self.interpreter.dmem[27 + 2*i].changed: # dealing with change colouring
-                XYZ_box.tag_add(elem, f'{i+1}.0', f'{i+2}.0')
-                XYZ_box.tag_configure(elem, foreground=self.change_colour,background=self.text_bg)
+            if self.interpreter.changed[26 + 2*i] or self.interpreter.changed[27 + 2*i]: # dealing with change colouring
+                XYZ_box.tag_add('changed', f'{i+1}.0', f'{i+2}.0')
 
         XYZ_box.config(state=DISABLED)
 
             # SP BOX
-        #SP_box = Frame(self.root,height=round(self.wh/7),width=other_width,bg=self.text_bg,borderwidth=5,relief='sunken')
-        #SP_box.place(relx=otherx, rely=othery+0.26, anchor = 'n')
-
-        #SPL_val = f'SPL: {self.interpreter.get_SP()%256}'
-        #SPL_val_label = Label(self.root,text=SPL_val,font=(self.font,15),bg=self.text_bg,fg=self.text_colour)
-        #SPL_val_label.place(relx=otherx-0.07,rely=othery+0.28, anchor = 'nw')
-
-        #SPH_val = f'SPH: {int((self.interpreter.get_SP() - self.interpreter.get_SP()%256) / 256)}'
-        #SPH_val_label = Label(self.root,text=SPH_val,font=(self.font,15),bg=self.text_bg,fg=self.text_colour)
-        #SPH_val_label.place(relx=otherx-0.07,rely=othery+0.32, anchor = 'nw')
-
-        #SP_val = f'SP: {hex(self.interpreter.get_SP())}'
-        #SP_val_label = Label(self.root,text=SP_val,font=(self.font,15),bg=self.text_bg,fg=self.text_colour)
-        #SP_val_label.place(relx=otherx-0.07,rely=othery+0.36, anchor = 'nw')
-        
-        SP_box = Text(self.root,height=3,width=15,bg=self.text_bg,fg=self.text_colour)
-        SP_box.config(borderwidth=5,relief='sunken',font=(self.font,font_size))
-        SP_box.place(x=otherx, y=othery+0.28*self.wh, anchor = 'n')
+        SP_box = self.SP_box
+        self.clear_box(SP_box)
 
         val = self.interpreter.get_SP() % 256
         SP_box.insert(END, f'  SPL: {val}\n')
         if val != self.last_SP[0]:
-            SP_box.tag_add('SPL', '1.0', '2.0')
-            SP_box.tag_configure('SPL', foreground=self.change_colour,background=self.text_bg)
+            SP_box.tag_add('changed', '1.0', '2.0')
         
         val = int((self.interpreter.get_SP() - self.interpreter.get_SP()%256) / 256)
         SP_box.insert(END, f'  SPH: {val}\n')
         if val != self.last_SP[1]:
-            SP_box.tag_add('SPH', '2.0', '3.0')
-            SP_box.tag_configure('SPH', foreground=self.change_colour,background=self.text_bg)
+            SP_box.tag_add('changed', '2.0', '3.0')
 
         val = hex(self.interpreter.get_SP())
         SP_box.insert(END, f'  SP: {val}')
         if val != self.last_SP[2]:
-            SP_box.tag_add('SP', '3.0', '4.0')
-            SP_box.tag_configure('SP', foreground=self.change_colour,background=self.text_bg)
+            SP_box.tag_add('changed', '3.0', '4.0')
 
         SP_box.config(state=DISABLED)
 
+            # Cycles Box
+        cycles_box = self.cycles_box
+        self.clear_box(cycles_box)
+
+        cycles_box.insert(END, f'  Cycles: {self.interpreter.cycles} @ {self.interpreter.clock_hz / 1e6:g} MHz')
+        cycles_box.insert(END, f'\n  Time: {self.interpreter.get_time() * 1e6:.3f} us')
+        cycles_box.config(state=DISABLED)
+
         self.displayed_before = True
 
     def text_boxes(self):
@@ -3428,15 +5151,20 @@ class App:
         reset_button.config(command=self.reset)
         reset_button.place(x=x_val,y=0.05*self.wh, anchor = 'n')
         
-        run_file_button = Button(self.root,text='Run File',font=(self.font,15))
-        run_file_button.config(bg=self.button_colour,fg=self.button_text,height=2,width=14)
-        run_file_button.config(command=self.run)
-        run_file_button.place(x=x_val,y=0.17*self.wh, anchor = 'n')
+        self.run_file_button = Button(self.root,text='Run File',font=(self.font,15))   # becomes 'Pause' while running
+        self.run_file_button.config(bg=self.button_colour,fg=self.button_text,height=2,width=14)
+        self.run_file_button.config(command=self.run)
+        self.run_file_button.place(x=x_val,y=0.17*self.wh, anchor = 'n')
 
         step_button = Button(self.root,text='Step',font=(self.font,15))
-        step_button.config(bg=self.button_colour,fg=self.button_text,height=2,width=14)
+        step_button.config(bg=self.button_colour,fg=self.button_text,height=2,width=6)
         step_button.config(command=self.step)
-        step_button.place(x=x_val,y=0.29*self.wh, anchor = 'n')
+        step_button.place(x=0.111*self.ww,y=0.29*self.wh, anchor = 'n')
+
+        back_button = Button(self.root,text='Back',font=(self.font,15))
+        back_button.config(bg=self.button_colour,fg=self.button_text,height=2,width=6)
+        back_button.config(command=self.step_back)
+        back_button.place(x=0.059*self.ww,y=0.29*self.wh, anchor = 'n')
 
         #quit_button = Button(self.root,text='Quit',font=(self.font,17))
         #quit_button.config(bg=self.button_colour,fg=self.button_text,height=2,width=12)
@@ -3498,29 +5226,63 @@ class App:
 
     def run(self):
         """
-        Runs the whole code
+        Runs the whole code, or pauses
+        it if it is already running.
         """
-        for i in range(32): # refresh the 'changed' variable
-            self.interpreter.dmem[i].new_instruct()
+        if self.run_job is not None:
+            self.pause()
+            return
+
+        self.interpreter.clear_changed() # refresh the 'changed' bitmap
 
         self.update_last_SP()
 
-        while self.interpreter.file_end == False:
-            output = self.interpreter.step()
-            if isinstance(output, str):
-                self.console_box.insert(END, output)
-                self.console_box.yview_moveto(1)
+        self.run_file_button.config(text='Pause')
+        self.last_draw = time.perf_counter()
+        self.run_slice()
 
-            elif output:  # error
-                self.console_box.insert(END, output)
-                self.console_box.yview_moveto(1)
-                break
+    def run_slice(self):
+        """
+        Runs up to 'steps_per_frame' instructions,
+        then hands back to Tk so the window keeps
+        responding. Redraws at most every 'frame_time'.
+        """
+
+        steps, output, error = run_interpreter(self.interpreter, self.steps_per_frame) # output already sent to write_console
+        if error:
+            self.write_console(error)
+
+        if self.interpreter.hit:
+            self.write_console(self.interpreter.hit.as_string())
+
+        if self.interpreter.file_end or error or self.interpreter.hit:
+            self.run_job = None
+            self.run_file_button.config(text='Run File')
+            self.display()
+            return
+
+        now = time.perf_counter()
+        if now - self.last_draw >= self.frame_time:
+            self.display()
+            self.last_draw = now
 
+        self.run_job = self.root.after(1, self.run_slice)
+
+    def pause(self):
+        """
+        Stops a run after the current slice.
+        """
+        if self.run_job is None:
+            return
+
+        self.root.after_cancel(self.run_job)
+        self.run_job = None
+        self.run_file_button.config(text='Run File')
         self.display()
 
     def step(self):
-        for i in range(32): # refresh the 'changed' variable
-            self.interpreter.dmem[i].new_instruct()
+        self.pause()
+        self.interpreter.clear_changed() # refresh the 'changed' bitmap
 
         self.update_last_SP()
 
@@ -3529,15 +5291,113 @@ class App:
         except: step_size = 1
         for repeat in range(step_size):
             output = self.interpreter.step()
-            if isinstance(output, str):
-                self.console_box.insert(END, output)
-                self.console_box.yview_moveto(1)
-            elif output:  # error
-                self.console_box.insert(END, output)
-                self.console_box.yview_moveto(1)
+            if output:  # error
+                self.write_console(output.as_string())
                 break
-            
+
+        self.interpreter.output.flush() # PRINTF output goes to the console through write_console
+        self.display()
+
+    def step_back(self):
+        """
+        Undoes as many steps as the step
+        box says, in place of Step.
+        """
+        self.pause()
+        self.interpreter.clear_changed() # refresh the 'changed' bitmap
+
+        self.update_last_SP()
+
+        step_size = self.step_box.get('1.0',END)
+        try: step_size = int(step_size)
+        except: step_size = 1
+        self.interpreter.reverse_step(step_size)
+
+        self.ram_window = None # going back past the undo records restores a whole snapshot
+        self.display()
+
+    def reverse_continue(self):
+        """
+        Steps backwards to the last
+        breakpoint or the start.
+        """
+        self.pause()
+        self.interpreter.clear_changed() # refresh the 'changed' bitmap
+
+        self.update_last_SP()
+
+        self.interpreter.reverse_continue(lambda interpreter: interpreter.at_breakpoint())
+
+        self.ram_window = None
+        self.display()
+
+    def toggle_breakpoint(self, event, condition=None):
+        """
+        Adds or removes a breakpoint on the
+        double clicked instruction.
+        """
+        line = int(self.inst_box.index(f'@{event.x},{event.y}').split('.')[0])
+        pc = self.inst_window[0] + line - 1
+
+        if (pc in self.interpreter.breakpoints) and (condition is None):
+            self.interpreter.remove_breakpoint(pc)
+        else:
+            try: self.interpreter.add_breakpoint(pc, condition)
+            except (ValueError, SyntaxError) as e:
+                self.write_console(f'Breakpoint: {e}\n')
+
+        self.display()
+        return 'break' # stop Tk selecting the word
+
+    def conditional_breakpoint(self, event):
+        """
+        Asks for a condition (eg R16 == 3) for a
+        breakpoint on the right clicked instruction.
+        """
+        line = int(self.inst_box.index(f'@{event.x},{event.y}').split('.')[0])
+        pc = self.inst_window[0] + line - 1
+
+        condition = askstring('Breakpoint', f'Break at {pc} when (eg R16 == 3, blank for always):', parent=self.root)
+        if condition is None: # cancelled
+            return 'break'
+
+        return self.toggle_breakpoint(event, condition.strip())
+
+    def toggle_register_watch(self, event):
+        """
+        Adds or removes a watchpoint on the
+        double clicked register.
+        """
+        line, col = map(int, self.reg_box.index(f'@{event.x},{event.y}').split('.'))
+        i = line - 2
+        if not (0 <= i < 16):
+            return 'break'
+
+        text = self.reg_box.get(f'{line}.0', f'{line}.end')
+        if col >= text.find(f'R{i+16}:'): # right column
+            i += 16
+
+        if i in self.interpreter.watchpoints: self.interpreter.remove_watchpoint(i)
+        else: self.interpreter.add_watchpoint(i)
+
+        self.display()
+        return 'break'
+
+    def toggle_ram_watch(self, event):
+        """
+        Adds or removes a watchpoint on the
+        double clicked RAM address.
+        """
+        line = int(self.ram_box.index(f'@{event.x},{event.y}').split('.')[0])
+        addr = self.ram_window[0] + line - 1
+        if addr >= self.dmem_length:
+            return 'break'
+
+        if addr in self.interpreter.watchpoints: self.interpreter.remove_watchpoint(addr)
+        else: self.interpreter.add_watchpoint(addr)
+
         self.display()
+        return 'break'
 
     def reset(self):
         """
@@ -3545,13 +5405,12 @@ class App:
         the file can be run again.
         """
 
-        for i in range(32): # refresh the 'changed' variable
-            self.interpreter.dmem[i].new_instruct()
-
+        self.pause()
         self.last_SP = [0, 0, '0x0'] # resetting expected SP variables
 
-        self.data = copy.deepcopy(self.data_copy)
-        self.interpreter = Interpreter(self.data[0], self.data[1], self.data[2], self.data[3])
+        self.interpreter.restore(self.initial_state) # also refreshes the 'changed' bitmap
+        self.interpreter.clear_history()
+        self.ram_window = None # RAM rows can't be updated from the bitmap after a restore
 
         self.display()
 
@@ -3594,6 +5453,20 @@ class App:
     def clear_console(self):
         self.console_box.delete('1.0', END)
 
+    def write_console(self, text):
+        """
+        Adds text to the console, dropping the oldest
+        lines once there are more than \'console_lines\'.
+        """
+
+        self.console_box.insert(END, text)
+
+        lines = int(self.console_box.index('end-1c').split('.')[0])
+        if lines > self.console_lines:
+            self.console_box.delete('1.0', f'{lines - self.console_lines + 1}.0')
+
+        self.console_box.yview_moveto(1)
+
     def convert_val_to_type(self, val, is_ram: bool, is_XYZ: bool):
         """
         Takes a number and converts
@@ -3673,39 +5546,21 @@ Man, you're tough and very long.
 #  RUN
 ##################################################################################################################
 
-def run(fn, text):
-
-    ########### Lexer ###########
-    lexer = Lexer(fn, text)
-    tokens, error = lexer.make_tokens()
-    if error or (len(tokens) == 0):
-        return tokens, error.as_string()
-
-    line_nums = tokens[-1]                  # allocating the locations of each line
-    tokens = tokens[0:(len(tokens) - 1)]    # removing line nums from last pos in tokens
-
+def run(fn, text, steps_per_frame=5000):
 
-    ########### Parser ###########
-    parser = Parser(fn, tokens, line_nums)
-    result, error = parser.parse()
+    ########### Lexer & Parser ###########
+    entry, error = load_program(fn, text) # unchanged files (eg on refresh) skip assembling
     if error:
-        return result, error.as_string()
-
-    instructions = result[0]
-    inst_length = len(instructions)
-    for i in range(len(PMEM)): # PMEM & DMEM imported from avr_reg.py
-        if i < len(instructions): PMEM[i] = instructions[i]
-        else: PMEM[i] = ['NOP']
+        return None, error
 
-    data = result[1]
-    for i in range(len(data)):
-        DMEM[i + 0x100] = data[i]
+    instructions, data, PMEM, program, labels = entry
+    DMEM = make_dmem(data)
 
 
     ########### Simulator ###########
-    data = [DMEM, PMEM, fn, inst_length]
+    data = [DMEM, PMEM, fn, len(instructions), program, labels]
     root = Tk()
-    app = App(root, data)
+    app = App(root, data, steps_per_frame)
     root.mainloop()
 
     if app.reload != 0:
@@ -3717,66 +5572,91 @@ def run(fn, text):
 
 if __name__ == '__main__':
 
+    arg_parser = argparse.ArgumentParser(description='AVR Simulator')
+    arg_parser.add_argument('file', nargs='?', help='assembly file to run (asks for one if not given)')
+    arg_parser.add_argument('--headless', action='store_true', help='run to the end without a display & print the final state as JSON')
+    arg_parser.add_argument('--steps', type=int, default=None, help=f'(headless/grade) maximum number of instructions to run (grade default {GRADE_MAX_STEPS}, 0 for no limit)')
+    arg_parser.add_argument('--ram', type=parse_ram_range, action='append', default=[], metavar='START:END', help='(headless) RAM range to include in the JSON, eg 0x100:0x110')
+    arg_parser.add_argument('--grade', action='store_true', help='grade every file in the directory or glob given as the file')
+    arg_parser.add_argument('--tests', help='(grade) JSON file of test vectors')
+    arg_parser.add_argument('--timeout', type=float, default=None, help=f'(grade) wall clock seconds allowed per test (default {GRADE_TIME_LIMIT:g}, 0 for no limit)')
+    arg_parser.add_argument('--workers', type=int, default=None, help='(grade) number of processes to use')
+    arg_parser.add_argument('--cache', default=None, metavar='DIR', help='also keep assembled programs in this directory')
+    arg_parser.add_argument('--break', dest='breakpoints', type=parse_breakpoint, action='append', default=[], metavar='WHERE', help='(headless) stop at a label or address, eg loop or "loop if R16 == 3"')
+    arg_parser.add_argument('--watch', action='append', default=[], metavar='WHERE', help='(headless) stop when a register or RAM address changes, eg R16 or 0x100')
+    arg_parser.add_argument('--profile', choices=PROFILE_FORMATS, default=None, help='(headless) count the instructions & cycles run under each label')
+    arg_parser.add_argument('--profile-out', default=None, metavar='FILE', help='(headless) file for the --profile report (default stderr)')
+    arg_parser.add_argument('--trace', default=None, metavar='FILE', help='(headless) write every instruction run to a binary trace (gzipped if FILE ends in .gz)')
+    arg_parser.add_argument('--fuse', action='store_true', help='(headless/grade) fuse common instruction pairs into one step to run faster (ignored with --break, --watch, --profile & --trace)')
+    arg_parser.add_argument('--blocks', action='store_true', help='(headless/grade) run compiled basic blocks instead of single instructions to run faster (ignored like --fuse)')
+    arg_parser.add_argument('--export', default=None, metavar='PREFIX', help='assemble only, writing the flash image to PREFIX.hex & PREFIX.bin and the .data bytes to PREFIX.eep')
+    arg_parser.add_argument('--clock', type=float, default=CLOCK_HZ, metavar='HZ', help='clock speed used to turn cycles into time (default 16 MHz)')
+    arg_parser.add_argument('--frame-steps', type=int, default=5000, help='(GUI) instructions run between redraws when running')
+    args = arg_parser.parse_args()
+    ASSEMBLY_CACHE.cache_dir = args.cache
+    CLOCK_HZ = args.clock
+
+    if args.grade:
+        if not args.file:
+            arg_parser.error('a directory or glob is needed with --grade')
+
+        max_steps = GRADE_MAX_STEPS if args.steps is None else (args.steps or None)
+        time_limit = GRADE_TIME_LIMIT if args.timeout is None else (args.timeout or None)
+        if (max_steps is None) and (time_limit is None):
+            arg_parser.error('--grade needs a --steps or --timeout limit, they cannot both be 0')
+        if not find_asm_files(args.file):
+            arg_parser.error(f'no assembly files match \'{args.file}\'')
+
+        vectors = load_test_vectors(args.tests) if args.tests else []
+        results = grade(args.file, vectors, max_steps, time_limit, args.workers, args.cache, args.fuse, args.blocks)
+        print(json.dumps(results, indent=2))
+        sys.exit(0 if all(result['passed'] for result in results) else 1)
+
+    if args.export:
+        if not args.file:
+            arg_parser.error('a file is needed with --export')
+
+        with open(args.file, 'r') as f:
+            paths, error = export_program(args.file, f.read(), args.export)
+
+        print(json.dumps({'file': args.file, 'error': error, **(paths or {})}))
+        sys.exit(1 if error else 0)
+
+    if args.headless:
+        if not args.file:
+            arg_parser.error('a file is needed with --headless')
+
+        state = run_headless(args.file, read_source(args.file), args.steps, args.ram, args.profile, args.trace, args.breakpoints, args.watch, args.fuse, args.blocks)
+
+        if args.profile:
+            profile = state.pop('profile', '')
+            if args.profile_out:
+                with open(args.profile_out, 'w') as f:
+                    f.write(profile)
+            else: sys.stderr.write(profile)
+
+        if state['output'] and not state['output'].endswith('\n'):
+            print('')
+        print(json.dumps(state))
+        sys.exit(1 if state['error'] else 0)
+
+    load_tkinter()
+
     output = 2      # run a new file
     first_run = True
 
     while True:
 
-        ######################################
-        #  DEFINE MEMORY
-        ######################################
-
-        pmem_size = 0x4000 # max 0x3FFF
-        PMEM = [0x00 for i in range(pmem_size)]
-
-        dem_size = 0x900 # max 0x8FF
-        DMEM_MAX = dem_size - 1
-        DMEM = [0x00 for i in range(dem_size)]
-
-
-        ######################################
-        #  DEFINE REGISTER FILE
-        ######################################
-
-        for i in range(256):
-            DMEM[i] = Register('R' + str(i))
-
-        SREG = Register('SREG')
-        SREG.value = [0, 0, 0, 0, 0, 0, 0, 0]
-
-        #PCL = Register('PCL')
-        #PCH = Register('PCH')
-
-
-        SPL = Register('SPL')
-        low = DMEM_MAX % 256
-        SPL.set_value(low)
-        #SPL.set_value(L)
-        SPH = Register('SPH')
-        high = int((DMEM_MAX - low) / 256)
-        SPH.set_value(high)
-        #SPH.set_value(H)
-
-        #DMEM[0x5B] = PCL # program counter low byte
-        #DMEM[0x5C] = PCH # program counter high byte
-        DMEM[0x5D] = SPL # stack pointer low byte (0x3D in I/O file)
-        DMEM[0x5E] = SPH # stack pointer high byte (0x3E in I/O file)
-        DMEM[0x5F] = SREG # status register (0x3F in I/O file)
-
-        REGISTER_FILE = []
-        for i in range(32):
-            REGISTER_FILE.append(f'R{str(i)}')
-
         ######################################
         #  GET FILE
         ######################################
 
         if (output == 2) and first_run:
-            if len(sys.argv) < 2:
+            if not args.file:
                 Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
                 fn = askopenfilename() # show an "Open" dialog box and return the path to the selected file
             
-            else: fn = sys.argv[1]
+            else: fn = args.file
 
         elif (output == 2):
             Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
@@ -3791,12 +5671,10 @@ if __name__ == '__main__':
         first_run = False
 
         if fn:
-            with open(fn, 'r') as f:
-                lines = f.read()
-                output, error = run(fn, lines)
-                if error:
-                    print(error)
-                    break
+            output, error = run(fn, read_source(fn), args.frame_steps)
+            if error:
+                print(error)
+                break
         
         else:
             break
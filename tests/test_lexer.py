@@ -0,0 +1,189 @@
+"""
+Checks the Lexer's per part fast path (make_simple_line()) against
+the one token at a time lexer (make_line()) it stands in for.
+Run with: python -m unittest discover tests (or pytest)
+"""
+
+import glob
+import os
+import random
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sim
+
+# Lines the examples don't have, mostly the parts make_simple_line() has to get right
+EXTRA_LINES = [
+    '    ld r16, X+',
+    '    ld r16, -X',
+    '    st Y+, r17',
+    '    st -Z, r0',
+    '    ldd r16, Y+3',
+    '    std Z+63, r1',
+    '    ld r16, X +',
+    '    st - Y, r2',
+    '    ldi r16, -5',
+    '    ldi r16, -0x10',
+    '    ldi r16, 0x1F',
+    '    ldi r16, 0b101',
+    '    ldi r16, 0o17',
+    '    ldi r16, 0x',
+    '    ldi r16, lo8(msg)',
+    '    ldi r17, hi8(msg)',
+    '    call printf',
+    'x:',
+    'X:',
+    'X: ldi r16, 1',
+    'label: ldi r16, 1 ; comment',
+    'n: .byte 8',
+    'result: .space 1',
+    'msg: .string "hi\\n"',
+    'msg: .asciz "hi"',
+    '    .string hello, world',
+    '.asciz abc',
+    '.section .data',
+    '.section .text',
+    '    .global main',
+    '.def temp = r16',
+    '    ldi temp, 3',
+    '.end',
+    '    ,',
+    '    add r1,r2',
+    '    add r1 , r2',
+    '\tadd\tr1,\tr2',
+    '    add r1, r2 ; r1 += r2',
+    '; only a comment',
+    '',
+    '    ',
+    '    brne loop',
+    '    rjmp .+2',
+    '    ldi r16, 5 extra',
+    '    ldi r16, $5',
+    '    ldi r16, "a"',
+    '    movw r25:r24, r23:r22',
+    '    lds r18, n+1'
+]
+
+MUTATION_CHARS = ' \t,;:+-XYZxyz0123456789.()"$'
+
+def corpus_lines():
+    """
+    Returns the lines of every example file
+    followed by EXTRA_LINES.
+    """
+
+    lines = []
+    for fn in sorted(glob.glob(os.path.join(ROOT, 'examples', '*'))):
+        with open(fn, 'r') as f:
+            lines.extend(f.read().split('\n'))
+    return lines + EXTRA_LINES
+
+def mutate(line, rng):
+    """
+    Returns a copy of \'line\' with one random change,
+    eg a different case, spacing or number base, or a
+    character inserted, removed or swapped.
+    """
+
+    choice = rng.randrange(9)
+    if choice == 0:
+        return line.upper()
+    if choice == 1:
+        return line.lower()
+    if choice == 2:
+        return line.replace(', ', rng.choice([',', ' , ', ',\t', '  ,  ']))
+    if choice == 3:
+        return line.replace('    ', rng.choice(['\t', ' ', '        ', '']))
+    if choice == 4:
+        return rng.choice(['lbl: ', 'X: ', 'a.b_c: ', '']) + line.strip()
+    if choice == 5:
+        return line + rng.choice([' ; note', ';', ' ,', ' 7', ' -3', ' X+', ':'])
+    if choice == 6:
+        number = rng.randrange(-300, 300)
+        return line + rng.choice([f', {number}', f', {hex(number)}', f', {bin(number)}', f', -{abs(number)}'])
+
+    idx = rng.randrange(len(line) + 1)
+    if choice == 7:
+        return line[:idx] + rng.choice(MUTATION_CHARS) + line[idx:]
+    return line[:idx] + line[idx + 1:]
+
+def token_values(tokens):
+    return [(tok.type, tok.value) if isinstance(tok, sim.Token) else repr(tok) for tok in tokens]
+
+def lex_slow(line):
+    """
+    Returns the make_line() tokens of \'line\' as (type,
+    value) pairs, or None if it doesn\'t lex.
+    """
+
+    lexer = sim.Lexer('<test>', line)
+    lexer.lines, lexer.line_nums, lexer.open_strings = [], [], []
+    idx, error = lexer.make_line(0)
+    if idx is None:
+        return None
+    return token_values(lexer.lines[0]) if lexer.lines else []
+
+def lex_simple(line):
+    """
+    Returns the make_simple_line() tokens of \'line\' as
+    (type, value) pairs, or None if it needs make_line().
+    """
+
+    tokens = sim.Lexer('<test>', line).make_simple_line(line)
+    return None if tokens is None else token_values(tokens)
+
+class SimpleLineTest(unittest.TestCase):
+    def check_lines(self, lines):
+        simple_count = 0
+        for line in lines:
+            for attempt in range(2): # the second time through the part caches
+                simple = lex_simple(line)
+                if simple is None:
+                    continue
+
+                simple_count += 1
+                self.assertEqual(simple, lex_slow(line), f'line {line!r}')
+        return simple_count
+
+    def test_corpus(self):
+        lines = corpus_lines()
+        self.assertGreater(self.check_lines(lines), len(lines)) # most lines take the fast path
+
+    def test_mutated_corpus(self):
+        rng = random.Random(0)
+        lines = corpus_lines()
+        mutated = []
+        for i in range(5000):
+            line = rng.choice(lines)
+            for j in range(rng.randrange(1, 4)):
+                line = mutate(line, rng)
+            mutated.append(line)
+        self.assertGreater(self.check_lines(mutated), 0)
+
+class CacheLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_size = sim.LEXER_CACHE_SIZE
+
+    def tearDown(self):
+        sim.LEXER_CACHE_SIZE = self.cache_size
+
+    def test_caches_are_cleared_past_the_limit(self):
+        many = '.section .text\n' + ''.join(f'l{i}: ldi r16, {i}\n' for i in range(200)) + '.end'
+        few = '.section .text\nmain: ldi r16, 1\n.end'
+
+        sim.LEXER_CACHE_SIZE = 50
+        before, error = sim.Lexer('many', many).make_tokens()
+        self.assertGreater(len(sim.FIRST_PART_TOKENS), 50)
+
+        sim.Lexer('few', few).make_tokens()
+        self.assertLessEqual(len(sim.FIRST_PART_TOKENS), 50)
+        self.assertLessEqual(len(sim.PART_TOKENS), 50)
+
+        after, error = sim.Lexer('many', many).make_tokens()
+        self.assertEqual([token_values(line) for line in before[:-1]], [token_values(line) for line in after[:-1]])
+
+if __name__ == '__main__':
+    unittest.main()